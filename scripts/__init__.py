@@ -0,0 +1,2 @@
+# the modules import each other relative to the package, or by their names when they are run as scripts (python scripts/sync.py)
+from .pipeline import Job, Pipeline, PipelineError
@@ -0,0 +1,170 @@
+import subprocess
+from fractions import Fraction
+
+if __package__:
+    from .util import input_args, lazy_import
+else:
+    from util import input_args, lazy_import
+
+np = lazy_import("numpy")
+
+# sample rate used for synchronization, plenty for claps and speech
+AUDIO_RATE = 8000
+
+# length of the audio window that is compared, in seconds
+AUDIO_WINDOW = 30.0
+
+# maximum offset that is searched for, in seconds
+MAX_OFFSET = 10.0
+
+# takes shorter than this don't drift by a noticeable fraction of a frame, in seconds
+DRIFT_MIN_DURATION = 600.0
+
+# length of the audio windows that are compared along a take to measure the clock drift, in seconds
+DRIFT_WINDOW = 4.0
+
+# number of windows spread over the take
+DRIFT_WINDOWS = 16
+
+# maximum offset between the eyes that is searched for in every window, in seconds (the start is already aligned)
+DRIFT_SEARCH = 0.25
+
+# windows that correlate less are ignored (i.e. wind noise, silence)
+DRIFT_MIN_CONFIDENCE = 0.3
+
+# windows that are further off the fitted line are ignored, in seconds
+DRIFT_TOLERANCE = 0.005
+
+def extract_audio(video, start, duration, rate=AUDIO_RATE, chapters=None):
+    """
+    Decodes a mono, low sample rate audio window from a video, without decoding the video.
+
+    :param start: Start of the window in seconds.
+    :param duration: Length of the window in seconds.
+    :return: float32 array of samples.
+    """
+
+    cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-ss",
+        f"{start:.6f}",
+        *input_args(video, chapters),
+        "-t",
+        f"{duration:.6f}",
+        "-vn",
+        "-ac",
+        "1",
+        "-ar",
+        str(rate),
+        "-f",
+        "f32le",
+        "pipe:"
+    ]
+
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(out, np.float32)
+
+def cross_correlate(a, b, max_lag=None):
+    """
+    Finds the lag of a relative to b via FFT cross-correlation.
+    A positive lag means that an event happens lag samples later in a than in b.
+
+    :param max_lag: Only consider lags up to this many samples (in both directions).
+    :return: Tuple of lag in samples and confidence (normalized correlation of the peak, 0 to 1).
+    """
+
+    a = a - np.mean(a)
+    b = b - np.mean(b)
+
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length() # next power of two, zero padded to avoid circular correlation
+
+    correlation = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+
+    # reorder to lags -(len(b) - 1) ... len(a) - 1
+    lags = np.arange(-(len(b) - 1), len(a))
+    correlation = np.concatenate((correlation[size - (len(b) - 1):], correlation[:len(a)]))
+
+    if max_lag is not None:
+        valid = np.abs(lags) <= max_lag
+        lags = lags[valid]
+        correlation = correlation[valid]
+
+    peak = np.argmax(np.abs(correlation))
+
+    norm = np.sqrt(np.sum(a * a) * np.sum(b * b))
+    confidence = float(np.abs(correlation[peak]) / norm) if norm > 0 else 0.0
+
+    return int(lags[peak]), confidence
+
+def estimate_offset(video1, video2, frame_rate, chapters1=None, chapters2=None, window=AUDIO_WINDOW, max_offset=MAX_OFFSET):
+    """
+    Estimates the start offset between two videos from their audio.
+
+    :return: Tuple of start_frame1, start_frame2 (frames to skip at the start of each video) and confidence.
+    """
+
+    audio1 = extract_audio(video1, 0.0, window, chapters=chapters1)
+    audio2 = extract_audio(video2, 0.0, window, chapters=chapters2)
+
+    if len(audio1) == 0 or len(audio2) == 0:
+        return 0, 0, 0.0
+
+    lag, confidence = cross_correlate(audio1, audio2, int(max_offset * AUDIO_RATE))
+
+    # an event that happens later in the left video means that the left video started earlier
+    frames = round(abs(lag) / AUDIO_RATE * float(Fraction(frame_rate)))
+    if lag > 0:
+        return frames, 0, confidence
+    return 0, frames, confidence
+
+def estimate_drift(video1, video2, start_sec1, start_sec2, duration, chapters1=None, chapters2=None, windows=DRIFT_WINDOWS, window=DRIFT_WINDOW):
+    """
+    Measures the clock drift of the right video relative to the left one, by cross-correlating short audio windows
+    spread over the synced take. Only one window per eye is decoded at a time, so the memory use doesn't depend on
+    the length of the take.
+
+    :param start_sec1: Start of the synced take in the left video, in seconds.
+    :param start_sec2: Start of the synced take in the right video, in seconds.
+    :param duration: Length of the synced take in seconds.
+    :return: Tuple of drift (seconds the right video runs ahead per second, i.e. 1e-6 is 1 ppm), offset at the start in
+             seconds and the number of windows the fit is based on, or None if there are not enough reliable windows.
+    """
+
+    if duration < window * 2:
+        return None
+
+    times = []
+    offsets = []
+    weights = []
+    for t in np.linspace(0.0, duration - window, windows):
+        audio1 = extract_audio(video1, start_sec1 + t, window, chapters=chapters1)
+        audio2 = extract_audio(video2, start_sec2 + t, window, chapters=chapters2)
+        if len(audio1) == 0 or len(audio2) == 0:
+            continue
+
+        lag, confidence = cross_correlate(audio1, audio2, int(DRIFT_SEARCH * AUDIO_RATE))
+        if confidence < DRIFT_MIN_CONFIDENCE:
+            continue
+
+        # an event that happens later in the left window happened earlier on the right clock
+        times.append(t + window / 2)
+        offsets.append(-lag / AUDIO_RATE)
+        weights.append(confidence)
+
+    times = np.array(times)
+    offsets = np.array(offsets)
+    weights = np.array(weights)
+    if len(times) < 3:
+        return None
+
+    # fit offset = start + drift * t, a second time without the windows that matched an echo (or another clap)
+    drift, start = np.polyfit(times, offsets, 1, w=weights)
+    inliers = np.abs(offsets - (start + drift * times)) <= DRIFT_TOLERANCE
+    if inliers.sum() < 3:
+        return None
+    drift, start = np.polyfit(times[inliers], offsets[inliers], 1, w=weights[inliers])
+
+    return float(drift), float(start), int(inliers.sum())
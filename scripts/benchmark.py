@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import tempfile
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+if __package__:
+    from .sync import process_videos
+    from .telemetry import JobTelemetry
+else:
+    from sync import process_videos
+    from telemetry import JobTelemetry
+
+# GoPro 5.3K 8:7
+WIDTH = 5312
+HEIGHT = 4648
+FRAME_RATE = "30000/1001"
+
+# the right camera starts a few frames later, so that the trimming is part of the benchmark
+START_OFFSET_FRAMES = 3
+
+# interpolations of v360
+INTERPOLATIONS = ["nearest", "linear", "cubic", "lanczos", "spline16", "gauss", "mitchell"]
+
+MASK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "mask", "hidden_lens_transparent.png")
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# commands that have to start right away, none of them needs numpy or cv2
+STARTUP_COMMANDS = {
+    "sync_help": ["sync.py", "--help"],
+    "sync_plan_help": ["sync.py", "plan", "--help"],
+    "sync_worker_help": ["sync.py", "worker", "--help"],
+    "calibrate_help": ["calibrate.py", "--help"]
+}
+
+# modules that are only imported when they are used (see util.lazy_import)
+HEAVY_MODULES = ["numpy", "cv2"]
+
+# seconds a startup command may take, including the start of the interpreter
+STARTUP_BUDGET = 0.5
+
+# runs a script like python would, and prints the heavy modules that were actually imported
+STARTUP_PROBE = """
+import sys, runpy
+script, heavy = sys.argv[1], sys.argv[2].split(",")
+sys.path.insert(0, sys.argv[3])
+sys.argv = [script] + sys.argv[4:]
+try:
+    runpy.run_path(script, run_name="__main__")
+except SystemExit:
+    pass
+print("IMPORTED:" + ",".join(name for name in heavy if name in sys.modules))
+"""
+
+# (dewarp, mask, preview, interp) of every variant
+VARIANTS = {
+    "sync": (False, False, False, None),
+    "dewarp": (True, False, False, None),
+    "dewarp_mask": (True, True, False, None),
+    "preview": (True, False, True, None),
+    **{f"dewarp_{interp}": (True, False, False, interp) for interp in INTERPOLATIONS}
+}
+
+def generate_clip(filename, duration, timecode, creation_time):
+    """
+    Generates a synthetic 5.3K 8:7 10 bit HEVC clip with audio and GoPro-style timecode/creation_time tags.
+    """
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={WIDTH}x{HEIGHT}:rate={FRAME_RATE}:duration={duration}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v",
+        "libx265",
+        "-preset",
+        "ultrafast",
+        "-pix_fmt",
+        "yuv420p10le",
+        "-c:a",
+        "aac",
+        "-timecode",
+        timecode,
+        "-metadata:s:v:0",
+        f"creation_time={creation_time}",
+        filename
+    ]
+
+    print(f"Generating {filename}")
+    subprocess.run(cmd, check=True, capture_output=True)
+
+def generate_clips(work_dir, duration):
+    """
+    Generates a left/right pair in left/ and right/ folders, like the ingress of sync.py. Existing clips of the same
+    duration are reused.
+
+    :return: Tuple of the left and right clip.
+    """
+
+    clips = []
+    for side, frame in (("left", 0), ("right", START_OFFSET_FRAMES)):
+        os.makedirs(os.path.join(work_dir, side), exist_ok=True)
+        filename = os.path.join(work_dir, side, f"GX01{int(duration):04d}.MP4")
+        if not os.path.exists(filename):
+            generate_clip(filename, duration, f"12:00:00;{frame:02d}", "2025-01-01T12:00:00.000000Z")
+        clips.append(filename)
+
+    return tuple(clips)
+
+def children_cpu_time():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def run_variant(name, video1, video2, work_dir, duration, threads):
+    """
+    Runs process_videos on the CPU path with the options of a variant.
+
+    :return: Dictionary of fps, wall time, frames, CPU utilisation and peak memory, or None if ffmpeg failed.
+    """
+
+    dewarp, mask, preview, interp = VARIANTS[name]
+
+    calibration = {
+        "start_sec1": START_OFFSET_FRAMES / (30000 / 1001),
+        "start_sec2": 0.0,
+        "offset1_x": 0, "offset1_y": 0, "offset2_x": 0, "offset2_y": 0,
+        "rotate_global1": 0.0, "rotate_global2": 0.0, "rotate_local1": 0.0, "rotate_local2": 0.0
+    }
+
+    output_file = os.path.join(work_dir, f"{name}.mp4")
+    telemetry = JobTelemetry(name, min(duration, 15.0) if preview else duration)
+
+    cpu_start = children_cpu_time()
+    start = time.monotonic()
+    success = process_videos(video1, video2, calibration, output_file, "12:00:00;03", dewarp, MASK if mask else None, False, preview, threads, telemetry=telemetry, interp=interp)
+    wall_time = time.monotonic() - start
+    cpu_end = children_cpu_time()
+
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    if not success:
+        return None
+
+    record = telemetry.record(True, output_file)
+    return {
+        "fps": record["frames"] / wall_time if wall_time > 0 else 0.0,
+        "wall_time": wall_time,
+        "frames": record["frames"],
+        "cpu": (cpu_end - cpu_start) / wall_time / (os.cpu_count() or 1) * 100 if cpu_start is not None and wall_time > 0 else None,
+        "peak_rss": record["peak_rss"]
+    }
+
+def run_startup(command, repeat):
+    """
+    Runs a startup command (see STARTUP_COMMANDS) in a fresh interpreter.
+
+    :param command: List of the script and its arguments, i.e. ["sync.py", "--help"].
+    :return: Dictionary of the median wall time and the heavy modules that were imported.
+    """
+
+    script, *arguments = command
+    cmd = [sys.executable, "-c", STARTUP_PROBE, os.path.join(SCRIPTS_DIR, script), ",".join(HEAVY_MODULES), SCRIPTS_DIR, *arguments]
+
+    times = []
+    imported = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        times.append(time.monotonic() - start)
+        imported = next((line[len("IMPORTED:"):].split(",") for line in out.splitlines() if line.startswith("IMPORTED:")), [])
+
+    return {"wall_time": sorted(times)[len(times) // 2], "imported": [module for module in imported if module]}
+
+def startup(repeat, budget):
+    """
+    Checks that --help and the planning commands start within the budget, without importing numpy or cv2.
+
+    :return: Tuple of the results and the commands that failed the check.
+    """
+
+    results = {}
+    slow = []
+    for name in STARTUP_COMMANDS:
+        result = run_startup(STARTUP_COMMANDS[name], repeat)
+        results[name] = result
+
+        flag = ""
+        if result["wall_time"] > budget or result["imported"]:
+            slow.append(name)
+            flag = f" SLOW (imported: {', '.join(result['imported'])})" if result["imported"] else " SLOW"
+        print(f"{name}: {result['wall_time'] * 1000:.0f} ms{flag}")
+
+    return results, slow
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the results next to a baseline and returns the variants that got slower than the tolerance.
+    """
+
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or not base["fps"]:
+            print(f"{name}: {result['fps']:.2f} fps (no baseline)")
+            continue
+
+        change = result["fps"] / base["fps"] - 1
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name}: {result['fps']:.2f} fps, baseline {base['fps']:.2f} fps ({change * 100:+.1f}%){flag}")
+
+    return regressions
+
+def ffmpeg_version():
+    try:
+        return subprocess.run(["ffmpeg", "-version"], check=True, capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the CPU filter graphs of sync.py on synthetic GoPro-like clips")
+    parser.add_argument("-w", "--work-dir", help="directory for the synthetic clips and outputs", default=os.path.join(tempfile.gettempdir(), "dugotovr_benchmark"))
+    parser.add_argument("--duration", help="length of the synthetic clips in seconds (longer than 15s to tell the preview apart)", type=float, default=20.0)
+    parser.add_argument("--variants", help="variants to run (default: all)", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--repeat", help="number of runs per variant, the median is reported", type=int, default=1)
+    parser.add_argument("--threads", help="thread budget for libx265 (default: all cores)", type=int, default=None)
+    parser.add_argument("-o", "--output", help="file to write the results to", default="benchmark_results.json")
+    parser.add_argument("-b", "--baseline", help="results of an earlier run to compare against", default=None)
+    parser.add_argument("--tolerance", help="relative fps drop that is flagged as a regression", type=float, default=0.1)
+    parser.add_argument("--startup", help="only check that --help and the planning commands start within the budget, without importing numpy or cv2", action="store_true")
+    parser.add_argument("--startup-budget", help="seconds a startup command may take", type=float, default=STARTUP_BUDGET)
+
+    args = parser.parse_args()
+
+    if args.startup:
+        results, slow = startup(max(args.repeat, 3), args.startup_budget)
+        with open(args.output, "w") as f:
+            json.dump({"time": time.time(), "host": socket.gethostname(), "budget": args.startup_budget, "startup": results}, f, indent=2)
+        print(f"Wrote the results to {args.output}")
+        if slow:
+            print(f"{len(slow)} command(s) over the budget: {', '.join(slow)}")
+            sys.exit(1)
+        return
+
+    video1, video2 = generate_clips(args.work_dir, args.duration)
+
+    results = {}
+    for name in args.variants:
+        runs = []
+        for i in range(args.repeat):
+            print(f"Running {name} ({i + 1}/{args.repeat})")
+            result = run_variant(name, video1, video2, args.work_dir, args.duration, args.threads)
+            if result is None:
+                print(f"{name} failed, skipping it.")
+                break
+            runs.append(result)
+
+        if runs:
+            # the run with the median fps
+            results[name] = sorted(runs, key=lambda run: run["fps"])[len(runs) // 2]
+            print(f"{name}: {results[name]['fps']:.2f} fps, {results[name]['wall_time']:.1f}s")
+
+    report = {
+        "time": time.time(),
+        "host": socket.gethostname(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": ffmpeg_version(),
+        "duration": args.duration,
+        "threads": args.threads,
+        "results": results
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote the results to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+    if len(results) < len(args.variants):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
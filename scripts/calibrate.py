@@ -1,29 +1,473 @@
 import argparse
-import ffmpeg
 import os
 import glob
-import numpy as np
-import cv2
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
 import yaml
 
-from util import *
-
-def extract_frames(video, num_frames):
-    out, err = (
-        ffmpeg
-        .input(video)
-        .trim(end_frame=num_frames)
-        .filter('crop', 4648, 4648) # crop to the center of the fisheye
-        .filter('scale', 4096, 4096) # downscale to 4096x4096
-        .output('pipe:', format='rawvideo', pix_fmt='rgb24')
-        .run(capture_stdout=True)
-    )
-    video = (
+if __package__:
+    from .util import *
+    from .audio import estimate_offset
+    from .framecache import FrameCache
+    from .gpmf import estimate_roll
+else:
+    from util import *
+    from audio import estimate_offset
+    from framecache import FrameCache
+    from gpmf import estimate_roll
+
+ffmpeg = lazy_import("ffmpeg")
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# size of the (square) calibration frames
+FRAME_SIZE = 4096
+
+# number of consecutive frames that are decoded with a single ffmpeg call
+DECODE_CHUNK = 8
+
+# number of frames before and after the current one to decode in the background
+PREFETCH = 4
+
+# size of the frames used for automatic calibration
+ALIGNMENT_SIZE = 1024
+
+# radius of the center region used for automatic calibration, relative to the frame size
+ALIGNMENT_RADIUS = 0.35
+
+# number of ORB features per frame and minimum number of (inlier) matches for automatic calibration
+ALIGNMENT_FEATURES = 2000
+ALIGNMENT_MIN_MATCHES = 20
+
+# calibration of a video that has not been calibrated yet
+DEFAULT_CALIBRATION = {
+    "start_frame": 0,
+    "x_offset": 0,
+    "y_offset": 0,
+    "rotation_global": 0.0,
+    "rotation_local": 0.0
+}
+
+def extract_frames(video, start_frame, num_frames, frame_rate, chapters=None, size=FRAME_SIZE, cache=None):
+    """
+    Decodes num_frames frames starting at start_frame, cropped to the center of the fisheye.
+    Seeking happens on the input side, so only the frames from the preceding keyframe onwards are decoded.
+
+    :param size: Size the frames are scaled to.
+    :param cache: FrameCache to read the frames from (if all of them are cached) and store decoded frames in, or None.
+    :return: Array of shape (n, size, size, 3) in BGR order, or a list of n memory-mapped frames from the cache.
+    """
+
+    if cache is not None:
+        key = FrameCache.video_key(video, chapters, size)
+        frames = cache.load_frames(key, start_frame, num_frames)
+        if frames is not None:
+            return frames
+
+    # aim half a frame before the start frame, so rounding can't make ffmpeg drop it
+    seek = max(0.0, (start_frame - 0.5) / float(Fraction(frame_rate)))
+
+    cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-ss",
+        f"{seek:.6f}",
+        *input_args(video, chapters),
+        "-frames:v",
+        str(num_frames),
+        "-vf",
+        f"crop=4648:4648,scale={size}:{size}", # crop to the center of the fisheye and downscale
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:"
+    ]
+
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+
+    frames = (
         np.frombuffer(out, np.uint8)
-        .reshape([-1, 4096, 4096, 3])
+        .reshape([-1, size, size, 3])
     )
 
-    return video
+    if cache is not None:
+        cache.store_frames(key, start_frame, frames)
+
+    return frames
+
+class FrameSource:
+    """
+    Decodes frames of a video on demand in a background thread.
+    Decoded frames are kept in an LRU cache that is bounded by a memory budget, and in the on-disk frame cache (if any).
+    """
+
+    def __init__(self, video, data, memory_budget, level_size, frame_cache=None):
+        self.video = video
+        self.frame_cache = frame_cache
+        self.cache_key = FrameCache.video_key(video, data.get("chapters"), FRAME_SIZE) if frame_cache is not None else None
+        self.level_size = level_size
+        self.chapters = data.get("chapters")
+        self.frame_rate = data["frame_rate"]
+        self.num_frames = FrameSource.count_frames(data)
+        self.capacity = max(2, memory_budget // ((FRAME_SIZE * FRAME_SIZE + level_size * level_size) * 3))
+        self.prefetch_radius = min(PREFETCH, (self.capacity - 1) // 2)
+
+        self.cache = OrderedDict()
+        self.pending = [] # frame indices to decode, most important first
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def count_frames(data):
+        """
+        Estimates the number of frames of a video from its duration and frame rate.
+        """
+
+        return max(1, int(data["duration"] * float(Fraction(data["frame_rate"]))))
+
+    def get(self, index):
+        """
+        Returns frame index and its downscaled version, blocking until it has been decoded.
+        The neighbouring frames are decoded in the background afterwards.
+        """
+
+        with self.condition:
+            while True:
+                if self.error is not None:
+                    raise self.error
+                index = min(max(0, index), self.num_frames - 1) # the frame count is only an estimate until the end was decoded
+                if index in self.cache:
+                    break
+                if index not in self.pending:
+                    self.pending.insert(0, index)
+                    self.condition.notify_all()
+                self.condition.wait()
+
+            self.cache.move_to_end(index)
+            frames = self.cache[index]
+
+            # replace the pending frames with the neighbours of this one, the following frames first (stepping forward is the most common)
+            self.pending = []
+            for offset in range(1, self.prefetch_radius + 1):
+                for i in (index + offset, index - offset):
+                    if 0 <= i < self.num_frames and i not in self.cache:
+                        self.pending.append(i)
+            self.condition.notify_all()
+
+        return frames
+
+    def on_disk(self, index):
+        return self.frame_cache is not None and self.frame_cache.contains(self.cache_key, index)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.cache.clear()
+            self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+
+                start = self.pending.pop(0)
+                if start in self.cache:
+                    continue
+
+                # decode runs of consecutive frames at once, seeking is the expensive part
+                # frames of the on-disk cache are read on their own, a run is only decoded up to the next one of them
+                count = 1
+                while count < DECODE_CHUNK and start + count < self.num_frames and start + count not in self.cache and (start + count) in self.pending and not self.on_disk(start) and not self.on_disk(start + count):
+                    self.pending.remove(start + count)
+                    count += 1
+
+            try:
+                frames = extract_frames(self.video, start, count, self.frame_rate, self.chapters, cache=self.frame_cache)
+            except subprocess.CalledProcessError as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+
+            # the downscaled level is what the preview is rendered from, so prepare it here instead of in the UI loop
+            levels = [cv2.resize(frame, (self.level_size, self.level_size), interpolation=cv2.INTER_AREA) for frame in frames]
+
+            with self.condition:
+                if len(frames) == 0: # past the end of the video
+                    if start == 0:
+                        self.error = RuntimeError(f"Could not decode any frames from {self.video}")
+                    self.num_frames = max(1, min(self.num_frames, start))
+                for i, (frame, level) in enumerate(zip(frames, levels)):
+                    self.cache[start + i] = (frame, level)
+                    self.cache.move_to_end(start + i)
+                while len(self.cache) > self.capacity:
+                    self.cache.popitem(last=False)
+                self.condition.notify_all()
+
+class PreviewRenderer:
+    """
+    Renders the calibration preview from the downscaled frames, or a full resolution region of interest when zoomed in.
+    Rotation and offset are applied with a single affine warp per eye, into buffers that are reused across key presses.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.eye1 = np.zeros((size, size, 3), np.uint8)
+        self.eye2 = np.zeros((size, size, 3), np.uint8)
+        self.anaglyph = np.zeros((size, size, 3), np.uint8)
+        self.sbs = np.zeros((size, size * 2, 3), np.uint8)
+
+    def warp(self, frame, scale, origin, angle, x_offset, y_offset, dst):
+        """
+        Rotates frame around the fisheye center and offsets it, in the coordinates of the full resolution frame.
+        Only the part of the result that starts at origin (scaled by scale) is rendered into dst.
+        """
+
+        center = FRAME_SIZE / 2 * scale
+        matrix = cv2.getRotationMatrix2D((center, center), angle, 1)
+        matrix[0, 2] += x_offset * scale - origin[0]
+        matrix[1, 2] += y_offset * scale - origin[1]
+        cv2.warpAffine(frame, matrix, (self.size, self.size), dst=dst)
+
+    def render(self, frames1, frames2, x_offset, y_offset, rotation1, rotation2, anaglyph, lines, zoom):
+        """
+        :param frames1: Tuple of full resolution and downscaled left frame.
+        :param frames2: Tuple of full resolution and downscaled right frame.
+        :param zoom: Show the center of the frames at full resolution.
+        :return: The preview image (a reused buffer).
+        """
+
+        if zoom:
+            scale = 1.0
+            origin = ((FRAME_SIZE - self.size) / 2, (FRAME_SIZE - self.size) / 2)
+            frame1, frame2 = frames1[0], frames2[0]
+        else:
+            scale = self.size / FRAME_SIZE
+            origin = (0, 0)
+            frame1, frame2 = frames1[1], frames2[1]
+
+        # offset the frames in x and y and split the difference between the two frames
+        self.warp(frame1, scale, origin, rotation1, x_offset, y_offset, self.eye1)
+        self.warp(frame2, scale, origin, rotation2, -x_offset, -y_offset, self.eye2)
+
+        # add a horizontal grid to the frames
+        if lines:
+            thickness = max(1, round(6 * scale))
+            color = (255, 255, 255)
+            for y in (1024, 2048, 3072):
+                y = round(y * scale - origin[1])
+                if 0 <= y < self.size:
+                    cv2.line(self.eye1, (0, y), (self.size, y), color, thickness)
+                    cv2.line(self.eye2, (0, y), (self.size, y), color, thickness)
+
+        if anaglyph:
+            return color_anaglyph(self.eye1, self.eye2, self.anaglyph)
+
+        self.sbs[:, :self.size] = self.eye1
+        self.sbs[:, self.size:] = self.eye2
+        return self.sbs
+
+def calibration_file(video):
+    return f"{os.path.splitext(video)[0]}.yaml"
+
+def load_calibration(video):
+    """
+    Loads the calibration file of a video, missing keys (or a missing file) are filled with the defaults.
+    """
+
+    content = dict(DEFAULT_CALIBRATION)
+    if os.path.exists(calibration_file(video)):
+        with open(calibration_file(video), "r") as f:
+            content.update(yaml.safe_load(f) or {})
+    return content
+
+def update_calibration(video, values):
+    """
+    Updates the calibration file of a video with values, keeping all other keys.
+    Missing keys are filled with the defaults, so that sync.py can always load the file.
+    """
+
+    content = load_calibration(video)
+    content.update(values)
+
+    with open(calibration_file(video), "w") as f:
+        yaml.dump(content, f)
+
+def auto_sync_pair(video_pair, min_confidence):
+    (video1, data1), (video2, data2) = video_pair
+
+    try:
+        start_frame1, start_frame2, confidence = estimate_offset(video1, video2, data1["frame_rate"], data1.get("chapters"), data2.get("chapters"))
+    except subprocess.CalledProcessError as e:
+        print(f"Error extracting the audio of {video1} and {video2}: {e}")
+        return False
+
+    if confidence < min_confidence:
+        print(f"Audio offset of {video1} and {video2} is not reliable (confidence: {confidence:.2f}), not saving it.")
+        return False
+
+    print(f"Audio offset of {video1} and {video2}: left: {start_frame1}, right: {start_frame2} (confidence: {confidence:.2f})")
+    update_calibration(video1, {"start_frame": start_frame1})
+    update_calibration(video2, {"start_frame": start_frame2})
+    return True
+
+def auto_sync(video_pairs, min_confidence, num_jobs):
+    """
+    Determines the start frames of all pairs from their audio, without opening a window.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, num_jobs)) as executor:
+        results = list(executor.map(lambda pair: auto_sync_pair(pair, min_confidence), video_pairs))
+
+    print(f"Synchronized {sum(results)}/{len(video_pairs)} pair(s) via audio.")
+
+def estimate_alignment(frame1, frame2):
+    """
+    Estimates the rotation and vertical offset of frame2 relative to frame1 from matched ORB features.
+    Only the center of the fisheye is used, the edges are too distorted to match reliably.
+
+    :return: Tuple of rotation in degrees (as in cv2.getRotationMatrix2D), vertical offset in pixels and number of inliers, or None.
+    """
+
+    gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
+
+    size = gray1.shape[0]
+    mask = np.zeros_like(gray1)
+    cv2.circle(mask, (size // 2, size // 2), int(size * ALIGNMENT_RADIUS), 255, -1)
+
+    orb = cv2.ORB_create(nfeatures=ALIGNMENT_FEATURES)
+    keypoints1, descriptors1 = orb.detectAndCompute(gray1, mask)
+    keypoints2, descriptors2 = orb.detectAndCompute(gray2, mask)
+    if descriptors1 is None or descriptors2 is None:
+        return None
+
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(descriptors1, descriptors2)
+    if len(matches) < ALIGNMENT_MIN_MATCHES:
+        return None
+
+    points1 = np.float32([keypoints1[match.queryIdx].pt for match in matches])
+    points2 = np.float32([keypoints2[match.trainIdx].pt for match in matches])
+
+    # rotation, uniform scale and translation, robust against wrong matches (and the depth dependent horizontal disparity)
+    matrix, inliers = cv2.estimateAffinePartial2D(points1, points2, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers.sum() < ALIGNMENT_MIN_MATCHES:
+        return None
+
+    angle = np.degrees(np.arctan2(matrix[0, 1], matrix[0, 0]))
+
+    # vertical displacement of the fisheye center
+    center = np.array([size / 2, size / 2, 1.0])
+    dy = (matrix @ center)[1] - size / 2
+
+    return angle, dy, int(inliers.sum())
+
+def auto_calibrate_pair(video_pair, samples, frame_cache=None):
+    (video1, data1), (video2, data2) = video_pair
+
+    calibration1 = load_calibration(video1)
+    calibration2 = load_calibration(video2)
+
+    frames1 = FrameSource.count_frames(data1)
+    frames2 = FrameSource.count_frames(data2)
+    length = min(frames1 - calibration1["start_frame"], frames2 - calibration2["start_frame"])
+
+    angles = []
+    offsets = []
+    # spread the samples over the clip, skipping the very beginning and end (camera handling)
+    for position in np.linspace(0.05, 0.95, samples):
+        frame = int(position * length)
+        try:
+            frame1 = extract_frames(video1, calibration1["start_frame"] + frame, 1, data1["frame_rate"], data1.get("chapters"), ALIGNMENT_SIZE, frame_cache)
+            frame2 = extract_frames(video2, calibration2["start_frame"] + frame, 1, data2["frame_rate"], data2.get("chapters"), ALIGNMENT_SIZE, frame_cache)
+        except subprocess.CalledProcessError as e:
+            print(f"Error extracting frame {frame} of {video1} and {video2}: {e}")
+            continue
+        if len(frame1) == 0 or len(frame2) == 0:
+            continue
+
+        result = estimate_alignment(frame1[0], frame2[0])
+        if result is not None:
+            angles.append(result[0])
+            offsets.append(result[1])
+
+    if len(angles) < max(1, samples // 2):
+        print(f"Could not calibrate {video1} and {video2}, only {len(angles)}/{samples} frame(s) had enough matching features.")
+        return False
+
+    # the median ignores the odd frame with a bad estimate
+    angle = float(np.median(angles))
+    dy = float(np.median(offsets)) * FRAME_SIZE / ALIGNMENT_SIZE
+
+    # the preview rotates the left eye by -(global + local) and the right eye by -(global - local),
+    # and moves the left eye down by y_offset and the right eye up by y_offset
+    rotation_local = round(-angle / 2, 2)
+    y_offset = round(dy / 2)
+
+    print(f"Calibrated {video1} and {video2} from {len(angles)} frame(s): y_offset: {y_offset}, rotation (local): {rotation_local:.2f}")
+    update_calibration(video1, {"y_offset": y_offset, "rotation_local": rotation_local})
+    update_calibration(video2, {"y_offset": -y_offset, "rotation_local": -rotation_local})
+    return True
+
+def auto_calibrate(video_pairs, samples, num_jobs, frame_cache=None):
+    """
+    Determines the vertical offset and relative rotation of all pairs from matched features, without opening a window.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, num_jobs)) as executor:
+        results = list(executor.map(lambda pair: auto_calibrate_pair(pair, samples, frame_cache), video_pairs))
+
+    print(f"Calibrated {sum(results)}/{len(video_pairs)} pair(s) via feature matching.")
+
+def auto_level_pair(video_pair, roll_curve=False):
+    (video1, data1), (video2, data2) = video_pair
+
+    rolls = []
+    for video, data in ((video1, data1), (video2, data2)):
+        result = estimate_roll(data.get("chapters") or [video], data["duration"])
+        if result is None:
+            print(f"{video} has no telemetry (GPMF) track, can't level it.")
+            continue
+        roll, (times, curve) = result
+        rolls.append(roll)
+
+        if roll_curve:
+            # roll over the clip (not the take), for handheld shots
+            with open(f"{os.path.splitext(video)[0]}.roll.csv", "w") as f:
+                f.write("time,roll\n")
+                f.writelines(f"{t:.3f},{r:.3f}\n" for t, r in zip(times, curve))
+
+    if not rolls:
+        return False
+
+    # both cameras sit on the same rig, their mean is less noisy than either of them
+    rotation_global = round(float(np.mean(rolls)), 2)
+    print(f"Leveled {video1} and {video2} from telemetry: rotation (global): {rotation_global:.2f}")
+    update_calibration(video1, {"rotation_global": rotation_global})
+    update_calibration(video2, {"rotation_global": rotation_global})
+    return True
+
+def auto_level(video_pairs, num_jobs, roll_curve=False):
+    """
+    Determines the horizon rotation of all pairs from the gravity vector in their GoPro telemetry, without decoding video.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, num_jobs)) as executor:
+        results = list(executor.map(lambda pair: auto_level_pair(pair, roll_curve), video_pairs))
+
+    print(f"Leveled {sum(results)}/{len(video_pairs)} pair(s) via telemetry.")
 
 # Further improvements:
 # add support for rotation
@@ -32,6 +476,18 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("ingress", help="the path to ingress from")
     parser.add_argument("-s", "--skip", help="skip already calibrated files", action="store_true")
+    parser.add_argument("--refresh-index", help="re-probe all videos instead of using the metadata index", action="store_true")
+    parser.add_argument("--cache-mb", help="memory budget for decoded frames in MB", type=int, default=2048)
+    parser.add_argument("--frame-cache", help="directory to keep decoded frames in across sessions", default=os.path.join(os.path.expanduser("~"), ".cache", "dugotovr", "frames"))
+    parser.add_argument("--frame-cache-gb", help="size limit of the frame cache in GB, the least recently used frames are removed (0 disables it)", type=float, default=50.0)
+    parser.add_argument("--preview-size", help="size of each eye in the preview window in pixels", type=int, default=1024)
+    parser.add_argument("--auto-sync", help="determine the start frames from the audio of all pairs, without opening a window", action="store_true")
+    parser.add_argument("--min-confidence", help="minimum confidence of the audio offset to save it", type=float, default=0.2)
+    parser.add_argument("--auto-calibrate", help="determine the vertical offset and relative rotation of all pairs from matched features, without opening a window", action="store_true")
+    parser.add_argument("--samples", help="number of frames to sample per pair for --auto-calibrate", type=int, default=5)
+    parser.add_argument("--auto-level", help="determine the horizon rotation of all pairs from the GoPro telemetry (gravity), without opening a window", action="store_true")
+    parser.add_argument("--roll-curve", help="with --auto-level, also write the roll over time of each clip to <clip>.roll.csv (for handheld shots)", action="store_true")
+    parser.add_argument("-j", "--jobs", help="number of pairs to process concurrently in headless modes", type=int, default=4)
 
     if len(sys.argv) < 2:
         parser.print_help()
@@ -48,23 +504,47 @@ def main():
         sys.exit(1)
 
     # Get all video files in the ingress directory
-    videos = glob.glob(os.path.join(ingress, "*/*.mp4"))
+    videos = glob.glob(os.path.join(ingress, VIDEO_PATTERN))
 
     if len(videos) < 2:
         print("Please provide at least 2 video files for calibration.")
         sys.exit(1)
 
-    video_pairs = match_videos(videos, ingress)
+    try:
+        video_pairs = match_videos(videos, ingress, args.refresh_index)
+    except PipelineError as e:
+        print(e)
+        sys.exit(1)
 
     print(f"Found {len(video_pairs)} pair(s) of videos for calibration.")
 
+    frame_cache = FrameCache(args.frame_cache, int(args.frame_cache_gb * 1024 ** 3)) if args.frame_cache_gb > 0 else None
+
+    if args.auto_sync or args.auto_calibrate or args.auto_level:
+        if skip:
+            video_pairs = [
+                pair for pair in video_pairs
+                if not (os.path.exists(calibration_file(pair[0][0])) and os.path.exists(calibration_file(pair[1][0])))
+            ]
+        if args.auto_sync:
+            auto_sync(video_pairs, args.min_confidence, args.jobs)
+        if args.auto_calibrate:
+            auto_calibrate(video_pairs, args.samples, args.jobs, frame_cache)
+        if args.auto_level:
+            auto_level(video_pairs, args.jobs, args.roll_curve)
+        return
+
     # keep offset across videos
     x_offset = 0
     y_offset = 0
     rotation_global = 0.0 # to correct horizon on both
     rotation_local = 0.0 # to correct rotation against each other
 
-    frames_to_extract = 30 # 30 should be enough
+    # memory budget for decoded frames, split between both eyes
+    memory_budget = args.cache_mb * 1024 * 1024 // 2
+
+    preview_size = min(args.preview_size, FRAME_SIZE)
+    renderer = PreviewRenderer(preview_size)
 
     for video_pair in video_pairs:
         (video1, data1), (video2, data2) = video_pair
@@ -80,6 +560,7 @@ def main():
         start_frame2_orig = 0
         anaglyph = True
         lines = True
+        zoom = False
         calibration_changed = False
 
         calibration_file1 = video1.replace(".mp4", ".yaml").replace(".MP4", ".yaml")
@@ -116,56 +597,36 @@ def main():
                 start_frame1 = start_difference.frames
                 start_frame1_orig = start_difference.frames
             
-        # extract the first 30 frames of each video
-        frames1 = extract_frames(video1, frames_to_extract+1)
-        frames2 = extract_frames(video2, frames_to_extract+1)
-        
+        # frames are decoded on demand, only the ones that are looked at (and their neighbours)
+        frames1 = FrameSource(video1, data1, memory_budget, preview_size, frame_cache)
+        frames2 = FrameSource(video2, data2, memory_budget, preview_size, frame_cache)
+        frames_per_second = round(float(Fraction(data1["frame_rate"])))
+
         while True:
             print(f"Seek: {seek}, start frame left: {start_frame1}, start frame right: {start_frame2}, x_offset: {x_offset}, y_offset: {y_offset}, rotation (local): {rotation_local}, rotation (global): {rotation_global}")
 
-            frame1 = np.copy(frames1[seek + start_frame1])
-            frame2 = np.copy(frames2[seek + start_frame2])
-            
-            # rotate the frames
-            frame1 = cv2.warpAffine(frame1, cv2.getRotationMatrix2D((2048, 2048), -(rotation_global + rotation_local), 1), (4096, 4096))
-            frame2 = cv2.warpAffine(frame2, cv2.getRotationMatrix2D((2048, 2048), -(rotation_global - rotation_local), 1), (4096, 4096))
-
-            # offset the frames in x and y and split the difference between the two frames
-            frame1 = np.roll(frame1, x_offset, axis=1)
-            frame2 = np.roll(frame2, -x_offset, axis=1)
-            frame1 = np.roll(frame1, y_offset, axis=0)
-            frame2 = np.roll(frame2, -y_offset, axis=0)
-
-            # add a horizontal grid to the frames
-            if lines:
-                thickness = 6
-                color = (255, 255, 255)
-                cv2.line(frame1, (0, 2048), (4096, 2048), color, thickness)
-                cv2.line(frame2, (0, 2048), (4096, 2048), color, thickness)
-                cv2.line(frame1, (0, 1024), (4096, 1024), color, thickness)
-                cv2.line(frame2, (0, 1024), (4096, 1024), color, thickness)
-                cv2.line(frame1, (0, 3072), (4096, 3072), color, thickness)
-                cv2.line(frame2, (0, 3072), (4096, 3072), color, thickness)
-
-            # fix color issues
-            frame1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2RGB)
-            frame2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2RGB)
-
-            if anaglyph:
-                preview = color_anaglyph(frame1, frame2)
-            else:
-                preview = np.hstack((frame1, frame2))
+            preview = renderer.render(
+                frames1.get(seek + start_frame1),
+                frames2.get(seek + start_frame2),
+                x_offset,
+                y_offset,
+                -(rotation_global + rotation_local),
+                -(rotation_global - rotation_local),
+                anaglyph,
+                lines,
+                zoom
+            )
 
             # add text for debugging to frame1
             # top left: seek, left start, right start
             # top right: x_offset, y_offset
             # top bottom: legend for controls
-            font_scale = 2
-            font_thickness = 3
+            font_scale = 2 * preview_size / FRAME_SIZE
+            font_thickness = max(1, round(3 * preview_size / FRAME_SIZE))
             color = (255, 255, 255)
             top_left_text_1 = f"Seek: {seek}, Left: {start_frame1}, Right: {start_frame2}"
             top_left_text_2 = f"X: {x_offset}, Y: {y_offset}, Rot (l): {rotation_local:.2f}, Rot (g): {rotation_global:.2f}"
-            bottom_left_text_1 = "WASD: X/Y Offset, N/M: Left, J/K: Right, I/O: Seek, ,/.: Rot (l), -/+: Rot (g), R: Reset, Space: Anaglyph, Q: Quit, E: Next"
+            bottom_left_text_1 = "WASD: X/Y Offset, N/M: Left, J/K: Right, I/O: Seek, U/P: Seek 1s, ,/.: Rot (l), -/+: Rot (g), R: Reset, Space: Anaglyph, Z: Zoom, Q: Quit, E: Next"
 
             # get text size with cv2.getTextSize
             (_, top_left_text_1_height), _ = cv2.getTextSize(top_left_text_1, cv2.FONT_HERSHEY_DUPLEX, font_scale, font_thickness)
@@ -179,6 +640,8 @@ def main():
             key = cv2.waitKey(0)
 
             if key == ord('q'):
+                frames1.close()
+                frames2.close()
                 return
             elif key == ord('e'):
                 break
@@ -222,10 +685,16 @@ def main():
                 anaglyph = not anaglyph
             elif key == ord('h'):
                 lines = not lines
+            elif key == ord('z'):
+                zoom = not zoom
             elif key == ord('i'):
                 seek -= 1
             elif key == ord('o'):
                 seek += 1
+            elif key == ord('u'):
+                seek -= frames_per_second
+            elif key == ord('p'):
+                seek += frames_per_second
             elif key == ord('r'):
                 seek = 0
                 x_offset = 0
@@ -236,12 +705,13 @@ def main():
                 rotation_local = 0.0
                 calibration_changed = True
 
-            start_frame1 = min(max(0, start_frame1), frames_to_extract)
-            start_frame2 = min(max(0, start_frame2), frames_to_extract)
-            seek = min(max(0, seek), frames_to_extract) # clamp between 0 and frames_to_extract
-            seek = min(min(frames_to_extract - start_frame1, frames_to_extract - start_frame2), seek) # make sure we don't seek too far
+            start_frame1 = min(max(0, start_frame1), frames1.num_frames - 1)
+            start_frame2 = min(max(0, start_frame2), frames2.num_frames - 1)
+            seek = min(frames1.num_frames - 1 - start_frame1, frames2.num_frames - 1 - start_frame2, seek) # make sure we don't seek too far
             seek = max(0, seek) # and make sure we don't seek into negative frames
         cv2.destroyAllWindows()
+        frames1.close()
+        frames2.close()
 
         if calibration_changed:
             print("Saving calibration data...")
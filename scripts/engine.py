@@ -0,0 +1,373 @@
+import os
+import sys
+import time
+import queue
+import threading
+import subprocess
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+if __package__:
+    from .util import FINGERPRINT_PREFIX, input_args, lazy_import
+    from .telemetry import Task
+    from .remap import CROP_SIZE, EYE_SIZE, map_arrays
+    from .graph import timing_nodes
+else:
+    from util import FINGERPRINT_PREFIX, input_args, lazy_import
+    from telemetry import Task
+    from remap import CROP_SIZE, EYE_SIZE, map_arrays
+    from graph import timing_nodes
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# number of decoded frames per eye and remapped frames that can be in flight
+INPUT_SLOTS = 3
+OUTPUT_SLOTS = 3
+
+# number of frames that are remapped at the same time
+FRAMES_IN_FLIGHT = 2
+
+# seconds between throughput reports
+REPORT_INTERVAL = 5.0
+
+# black in 10 bit limited range
+BLACK_LUMA = 64
+BLACK_CHROMA = 512
+
+def frame_bytes(width, height):
+    """
+    Returns the size of a yuv420p10le frame in bytes.
+    """
+
+    return width * height * 2 * 3 // 2
+
+def frame_planes(buffer, offset, width, height):
+    """
+    Returns the Y, U and V planes of a yuv420p10le frame in buffer as arrays (without copying).
+    """
+
+    y = np.ndarray((height, width), np.uint16, buffer, offset)
+    u = np.ndarray((height // 2, width // 2), np.uint16, buffer, offset + y.nbytes)
+    v = np.ndarray((height // 2, width // 2), np.uint16, buffer, offset + y.nbytes + u.nbytes)
+    return y, u, v
+
+# state of the remap worker processes, set up once per process by init_worker
+_worker = {}
+
+def init_worker(input_names, output_name, map_files):
+    cv2.setNumThreads(1) # the parallelism comes from the tiles
+
+    _worker["inputs"] = [shared_memory.SharedMemory(name=name) for name in input_names]
+    _worker["output"] = shared_memory.SharedMemory(name=output_name)
+
+    # memory-mapped, so all workers share the same pages
+    _worker["maps"] = [[np.load(f, mmap_mode="r") for f in files] for files in map_files]
+
+def remap_tile(eye, input_slot, output_slot, row_start, row_end):
+    """
+    Remaps rows row_start:row_end of one eye from an input slot into its half of an output slot.
+    """
+
+    source = frame_planes(_worker["inputs"][eye].buf, input_slot * frame_bytes(CROP_SIZE, CROP_SIZE), CROP_SIZE, CROP_SIZE)
+    target = frame_planes(_worker["output"].buf, output_slot * frame_bytes(EYE_SIZE * 2, EYE_SIZE), EYE_SIZE * 2, EYE_SIZE)
+    map_x, map_y, chroma_x, chroma_y = _worker["maps"][eye]
+
+    for plane, (src, dst) in enumerate(zip(source, target)):
+        if plane == 0:
+            rows = slice(row_start, row_end)
+            columns = slice(eye * EYE_SIZE, (eye + 1) * EYE_SIZE)
+            x, y, black = map_x, map_y, BLACK_LUMA
+        else:
+            rows = slice(row_start // 2, row_end // 2)
+            columns = slice(eye * EYE_SIZE // 2, (eye + 1) * EYE_SIZE // 2)
+            x, y, black = chroma_x, chroma_y, BLACK_CHROMA
+
+        cv2.remap(src, np.asarray(x[rows]), np.asarray(y[rows]), cv2.INTER_LINEAR, dst=dst[rows, columns], borderMode=cv2.BORDER_CONSTANT, borderValue=black)
+
+class Stage:
+    """
+    Throughput counter of a pipeline stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+
+    def add(self, busy):
+        self.frames += 1
+        self.busy += busy
+
+    def report(self, elapsed):
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        utilization = self.busy / elapsed * 100 if elapsed > 0 else 0.0
+        return f"{self.name}: {fps:.2f} fps ({utilization:.0f}% busy)"
+
+def read_exactly(stream, view):
+    """
+    Reads len(view) bytes from stream into view. Returns False at the end of the stream.
+    """
+
+    read = 0
+    while read < len(view):
+        n = stream.readinto(view[read:])
+        if not n:
+            return False
+        read += n
+    return True
+
+def write_all(stream, view):
+    written = 0
+    while written < len(view):
+        written += stream.write(view[written:])
+
+def process_videos_python(video1, video2, calibration, output_file, tc, dewarp, mask, cuda, preview, frame_rate, map_cache, workers=None, chapters1=None, chapters2=None, fingerprint=None, telemetry=None):
+    """
+    Alternative to process_videos that runs the geometry in Python instead of in an ffmpeg filter graph.
+    Both eyes are decoded to raw frames through pipes, remapped tile by tile in a process pool (on shared memory,
+    with the maps from remap.py) and streamed into the encoder, with bounded queues in between.
+    The throughput of each stage is reported, to see if decoding, remapping or encoding is the limit.
+
+    :param frame_rate: Frame rate of the videos, i.e. "30000/1001".
+    :param map_cache: Directory to cache the remap arrays in.
+    :param workers: Number of remap processes (None uses all cores).
+    :param fingerprint: Fingerprint of the job (see job_fingerprint), stored in the comment tag of the output.
+    :param telemetry: JobTelemetry to report the encoded frames to (see telemetry.py).
+    :return: True if the pair was processed successfully, False otherwise.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    frame_rate = Fraction(frame_rate)
+    max_frames = int(15 * frame_rate) if preview else None
+
+    map_files = [map_arrays(calibration, 1, dewarp, map_cache), map_arrays(calibration, 2, dewarp, map_cache)]
+
+    input_size = frame_bytes(CROP_SIZE, CROP_SIZE)
+    output_size = frame_bytes(EYE_SIZE * 2, EYE_SIZE)
+
+    inputs = [shared_memory.SharedMemory(create=True, size=input_size * INPUT_SLOTS) for _ in range(2)]
+    output = shared_memory.SharedMemory(create=True, size=output_size * OUTPUT_SLOTS)
+
+    free_inputs = [queue.Queue() for _ in range(2)]
+    decoded = [queue.Queue() for _ in range(2)] # bounded by the number of slots
+    free_outputs = queue.Queue()
+    in_flight = queue.Queue(maxsize=FRAMES_IN_FLIGHT)
+    remapped = queue.Queue() # bounded by the number of slots
+    for slot in range(INPUT_SLOTS):
+        free_inputs[0].put(slot)
+        free_inputs[1].put(slot)
+    for slot in range(OUTPUT_SLOTS):
+        free_outputs.put(slot)
+
+    stages = {
+        "decode1": Stage("decode (left)"),
+        "decode2": Stage("decode (right)"),
+        "remap": Stage("remap"),
+        "encode": Stage("encode")
+    }
+    errors = []
+    done = threading.Event()
+    closed = threading.Event() # the encoder stopped taking frames (i.e. -shortest ended on the audio)
+
+    decoders = []
+    for eye, (video, chapters, start) in enumerate(((video1, chapters1, calibration["start_sec1"]), (video2, chapters2, calibration["start_sec2"]))):
+        # the drift correction drops or repeats frames of the drifting eye in its decoder (see graph.timing_nodes)
+        filters = [str(node) for node in timing_nodes(calibration, eye + 1, frame_rate)] + [f"crop={CROP_SIZE}:{CROP_SIZE}"]
+        decoders.append(subprocess.Popen([
+            "ffmpeg",
+            "-v",
+            "error",
+            "-ss",
+            f"{start:.6f}",
+            *input_args(video, chapters),
+            "-vf",
+            ",".join(filters),
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "yuv420p10le",
+            "pipe:"
+        ], stdout=subprocess.PIPE, bufsize=0))
+
+    encoder_cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-y", # stdin is the frame pipe, ffmpeg can't ask whether to overwrite
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "yuv420p10le",
+        "-s",
+        f"{EYE_SIZE * 2}x{EYE_SIZE}",
+        "-r",
+        str(frame_rate),
+        "-i",
+        "pipe:",
+        "-ss",
+        f"{calibration['start_sec1']:.6f}",
+        *input_args(video1, chapters1),
+        "-i" if mask else None,
+        mask if mask else None,
+        "-filter_complex" if mask and dewarp else None,
+        "[0:v][2:v] overlay,format=yuv420p10 [out]" if mask and dewarp else None,
+        "-map",
+        "[out]" if mask and dewarp else "0:v",
+        "-map",
+        "1:a:0?",
+        "-shortest",
+        "-metadata",
+        f"timecode={tc}",
+        "-metadata" if fingerprint else None,
+        f"comment={FINGERPRINT_PREFIX}{fingerprint}" if fingerprint else None,
+        "-c:a:0",
+        "copy",
+        "-c:v",
+        "hevc_nvenc" if cuda else "libx265",
+        "-b:v" if cuda else "-crf",
+        "200M" if cuda else "18",
+        output_file
+    ]
+    encoder = subprocess.Popen(list(filter(None, encoder_cmd)), stdin=subprocess.PIPE, bufsize=0)
+
+    def decode(eye):
+        try:
+            stage = stages[f"decode{eye + 1}"]
+            while not done.is_set():
+                slot = free_inputs[eye].get()
+                if done.is_set(): # the slot might still be remapped
+                    break
+                start = time.perf_counter()
+                with inputs[eye].buf[slot * input_size:(slot + 1) * input_size] as view:
+                    complete = read_exactly(decoders[eye].stdout, view)
+                if not complete:
+                    break
+                stage.add(time.perf_counter() - start)
+                decoded[eye].put(slot)
+        except Exception as e:
+            errors.append(e)
+        decoded[eye].put(None)
+
+    def dispatch(executor):
+        try:
+            tile_rows = -(-EYE_SIZE // workers)
+            tile_rows += tile_rows % 2 # keep the tiles aligned to the chroma rows
+            frames = 0
+            while max_frames is None or frames < max_frames:
+                slot1 = decoded[0].get()
+                slot2 = decoded[1].get()
+                if slot1 is None or slot2 is None or errors: # the shortest input ends the output
+                    break
+                output_slot = free_outputs.get()
+                if errors or closed.is_set():
+                    break
+                futures = [
+                    executor.submit(remap_tile, eye, slot, output_slot, row, min(row + tile_rows, EYE_SIZE))
+                    for eye, slot in ((0, slot1), (1, slot2))
+                    for row in range(0, EYE_SIZE, tile_rows)
+                ]
+                in_flight.put((time.perf_counter(), futures, slot1, slot2, output_slot))
+                frames += 1
+        except Exception as e:
+            errors.append(e)
+        done.set()
+        in_flight.put(None)
+
+    def collect():
+        # keeps draining after an error, so that the dispatcher never blocks on a full queue
+        while True:
+            item = in_flight.get()
+            if item is None:
+                break
+            start, futures, slot1, slot2, output_slot = item
+            try:
+                wait(futures)
+                for future in futures:
+                    future.result()
+                stages["remap"].add(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+            free_inputs[0].put(slot1)
+            free_inputs[1].put(slot2)
+            remapped.put(output_slot)
+        remapped.put(None)
+
+    def encode():
+        # keeps returning the output slots after an error (i.e. the encoder exited), so that the dispatcher can stop
+        while True:
+            slot = remapped.get()
+            if slot is None:
+                break
+            if not errors and not closed.is_set():
+                try:
+                    start = time.perf_counter()
+                    with output.buf[slot * output_size:(slot + 1) * output_size] as view:
+                        write_all(encoder.stdin, view)
+                    stages["encode"].add(time.perf_counter() - start)
+                    task.frame = stages["encode"].frames
+                    task.out_time = float(task.frame / frame_rate)
+                except BrokenPipeError:
+                    closed.set() # an actual failure shows in the exit code of the encoder
+                except Exception as e:
+                    errors.append(e)
+            free_outputs.put(slot)
+        try:
+            encoder.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def report(start):
+        while not done.wait(REPORT_INTERVAL):
+            elapsed = time.monotonic() - start
+            print(" | ".join(stage.report(elapsed) for stage in stages.values()) + f" | queued: {decoded[0].qsize()}/{decoded[1].qsize()} decoded, {remapped.qsize()} remapped", file=sys.stderr)
+
+    # the encoder is fed through a pipe, so the progress comes from the encode stage instead of ffmpeg
+    task = telemetry.task("encode") if telemetry is not None else Task("encode")
+
+    print(f"Processing {video1} and {video2} -> {output_file} (python engine, {workers} remap worker(s))")
+    start = time.monotonic()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=([i.name for i in inputs], output.name, map_files)) as executor:
+            threads = [
+                threading.Thread(target=decode, args=(0,), daemon=True),
+                threading.Thread(target=decode, args=(1,), daemon=True),
+                threading.Thread(target=dispatch, args=(executor,), daemon=True),
+                threading.Thread(target=collect, daemon=True),
+                threading.Thread(target=encode, daemon=True),
+                threading.Thread(target=report, args=(start,), daemon=True)
+            ]
+            for thread in threads:
+                thread.start()
+
+            # the decoders are stopped by the dispatcher (shortest input / preview length), unblock them
+            threads[2].join()
+            for decoder in decoders:
+                decoder.kill()
+            for eye in range(2):
+                for slot in range(INPUT_SLOTS):
+                    free_inputs[eye].put(slot)
+
+            for thread in threads[:5]:
+                thread.join()
+
+        returncode = encoder.wait()
+    finally:
+        for decoder in decoders:
+            decoder.kill()
+            decoder.wait()
+        for memory in inputs + [output]:
+            memory.close()
+            memory.unlink()
+
+    elapsed = time.monotonic() - start
+    print(" | ".join(stage.report(elapsed) for stage in stages.values()))
+
+    if errors or returncode != 0:
+        print(f"Error processing {video1} and {video2}: {errors[0] if errors else f'encoder exited with {returncode}'}")
+        return False
+
+    print(f"Successfully processed {output_file} ({stages['encode'].frames} frames in {elapsed:.1f}s)\n")
+    return True
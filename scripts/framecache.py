@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+
+if __package__:
+    from .remap import save_npy
+    from .util import lazy_import
+else:
+    from remap import save_npy
+    from util import lazy_import
+
+np = lazy_import("numpy")
+
+# bump this when the decoding of the calibration frames changes, so that cached frames are decoded again
+FRAME_CACHE_VERSION = 1
+
+class FrameCache:
+    """
+    On-disk cache of decoded calibration frames, one .npy file per frame, shared by all calibrate.py sessions.
+    Frames are memory-mapped when they are read, so that sessions looking at the same pair share the same pages
+    (of the page cache) instead of each holding a copy. The least recently used frames are removed when the cache
+    grows past its size limit.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def video_key(video, chapters, size):
+        """
+        Returns the key of the frames of a take at a resolution: the name, size and modification time of its chapters,
+        so that a changed file is never served from the cache.
+        """
+
+        inputs = []
+        for chapter in chapters or [video]:
+            stat = os.stat(chapter)
+            inputs.append([os.path.basename(chapter), stat.st_size, stat.st_mtime_ns])
+
+        data = json.dumps({"version": FRAME_CACHE_VERSION, "inputs": inputs, "size": size}, sort_keys=True)
+        return f"{os.path.splitext(os.path.basename(video))[0]}_{size}_{hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]}"
+
+    def frame_file(self, key, index):
+        return os.path.join(self.cache_dir, key, f"{index:07d}.npy")
+
+    def contains(self, key, index):
+        return os.path.exists(self.frame_file(key, index))
+
+    def load(self, key, index):
+        """
+        Returns a read-only memory map of a cached frame, or None if it is not cached.
+        """
+
+        filename = self.frame_file(key, index)
+        try:
+            frame = np.load(filename, mmap_mode="r")
+            os.utime(filename) # the modification time is the last use, for the eviction
+        except (OSError, ValueError):
+            return None
+        return frame
+
+    def load_frames(self, key, start, count):
+        """
+        Returns the frames start to start + count, or None if any of them is not cached.
+        """
+
+        frames = []
+        for index in range(start, start + count):
+            frame = self.load(key, index)
+            if frame is None:
+                return None
+            frames.append(frame)
+        return frames
+
+    def store_frames(self, key, start, frames):
+        os.makedirs(os.path.join(self.cache_dir, key), exist_ok=True)
+        for i, frame in enumerate(frames):
+            try:
+                save_npy(self.frame_file(key, start + i), frame)
+            except OSError as e: # i.e. full disk, or the file is mapped by another session (Windows)
+                print(f"Could not cache frame {start + i} of {key}: {e}")
+                break
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used frames until the cache is within its size limit.
+        """
+
+        files = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".npy") and ".tmp" not in name:
+                    try:
+                        stat = os.stat(os.path.join(directory, name))
+                    except FileNotFoundError: # removed by another session
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, filename in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError: # mapped by another session (Windows), or already removed
+                continue
+            total -= size
@@ -0,0 +1,189 @@
+import struct
+import subprocess
+
+if __package__:
+    from .util import lazy_import
+else:
+    from util import lazy_import
+
+ffmpeg = lazy_import("ffmpeg")
+np = lazy_import("numpy")
+
+# GPMF value types (see https://github.com/gopro/gpmf-parser), all big endian
+GPMF_TYPES = {
+    "b": ">i1", "B": ">u1", "s": ">i2", "S": ">u2", "l": ">i4", "L": ">u4",
+    "j": ">i8", "J": ">u8", "f": ">f4", "d": ">f8"
+}
+
+# sensor axes of GoPro cameras without an ORIN entry (HERO8 and later write it, this is their order)
+DEFAULT_ORIENTATION = "ZXY"
+
+# length of the window the roll curve is smoothed over, in seconds (averages out walking and vibrations)
+ROLL_WINDOW = 1.0
+
+# spacing of the samples of the roll curve, in seconds
+ROLL_STEP = 0.1
+
+KLV_HEADER = struct.Struct(">4scBH")
+
+def telemetry_stream(video):
+    """
+    Returns the index of the GPMF telemetry stream of a video, or None if it has none.
+    """
+
+    try:
+        probe = ffmpeg.probe(video)
+    except ffmpeg.Error as e:
+        print(f"Error occurred while probing {video}: {e.stderr}")
+        return None
+
+    return next((stream["index"] for stream in probe["streams"] if stream.get("codec_tag_string") == "gpmd"), None)
+
+def read_klv(stream):
+    """
+    Reads the top level KLV entries (DEVC) of a GPMF stream one after the other, as they come out of ffmpeg.
+
+    :param stream: Binary file-like object.
+    :return: Generator of (key, type, struct size, repeat, payload) tuples.
+    """
+
+    while True:
+        header = stream.read(KLV_HEADER.size)
+        if len(header) < KLV_HEADER.size:
+            return
+        key, kind, size, repeat = KLV_HEADER.unpack(header)
+        length = size * repeat
+        payload = stream.read((length + 3) & ~3) # payloads are padded to 4 bytes
+        yield key.decode("latin-1"), kind.decode("latin-1"), size, repeat, payload[:length]
+
+def parse_klv(data):
+    """
+    Parses the KLV entries of a (nested) payload.
+
+    :return: Generator of (key, type, struct size, repeat, payload) tuples.
+    """
+
+    offset = 0
+    while offset + KLV_HEADER.size <= len(data):
+        key, kind, size, repeat = KLV_HEADER.unpack_from(data, offset)
+        offset += KLV_HEADER.size
+        length = size * repeat
+        yield key.decode("latin-1"), kind.decode("latin-1"), size, repeat, data[offset:offset + length]
+        offset += (length + 3) & ~3
+
+def klv_values(kind, size, repeat, payload):
+    """
+    Returns the values of a KLV entry as an array of shape (repeat, elements), or a string for type c.
+    """
+
+    if kind == "c":
+        return payload.decode("latin-1").rstrip("\0")
+    dtype = np.dtype(GPMF_TYPES[kind])
+    return np.frombuffer(payload, dtype).reshape(repeat, size // dtype.itemsize).astype(np.float64)
+
+def accelerometer(video):
+    """
+    Extracts the accelerometer samples of a video from its GPMF track. The track is copied out by ffmpeg, the video
+    is not decoded.
+
+    :return: Array of shape (n, 3) of the camera X, Y, Z axes in m/s², empty if the video has no telemetry.
+    """
+
+    index = telemetry_stream(video)
+    if index is None:
+        return np.empty((0, 3))
+
+    cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        video,
+        "-map",
+        f"0:{index}",
+        "-c",
+        "copy",
+        "-f",
+        "data",
+        "pipe:"
+    ]
+
+    samples = []
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        for key, _, _, _, devc in read_klv(process.stdout):
+            if key != "DEVC":
+                continue
+            for key, _, _, _, strm in parse_klv(devc):
+                if key != "STRM":
+                    continue
+
+                scale = 1.0
+                orientation = DEFAULT_ORIENTATION
+                for key, kind, size, repeat, payload in parse_klv(strm):
+                    if key == "SCAL":
+                        scale = klv_values(kind, size, repeat, payload).reshape(-1)
+                    elif key == "ORIN":
+                        orientation = klv_values(kind, size, repeat, payload)
+                    elif key == "ACCL" and kind in GPMF_TYPES:
+                        values = klv_values(kind, size, repeat, payload) / scale
+                        samples.append(camera_axes(values, orientation))
+    finally:
+        process.stdout.close()
+        process.wait()
+
+    return np.concatenate(samples) if samples else np.empty((0, 3))
+
+def camera_axes(values, orientation):
+    """
+    Reorders sensor samples into camera X, Y, Z, following the ORIN string (i.e. "ZXY": the first column is Z,
+    lower case letters are negated axes).
+    """
+
+    result = np.zeros((len(values), 3))
+    for column, axis in enumerate(orientation[:values.shape[1]]):
+        result[:, "XYZ".index(axis.upper())] = values[:, column] * (-1 if axis.islower() else 1)
+    return result
+
+def roll_angles(samples):
+    """
+    Returns the roll of the camera for every accelerometer sample, in degrees clockwise as seen from behind the
+    camera, which is the rotation that levels the horizon (as rotation_global).
+    At rest the accelerometer measures the opposite of gravity, i.e. it points up in camera coordinates.
+    """
+
+    x, y = samples[:, 0], samples[:, 1]
+    # the up axis of the camera is the one gravity pulls along the most, whichever sign it has
+    up = np.sign(np.mean(y)) or 1.0
+    return np.degrees(np.arctan2(-x, up * y))
+
+def smooth(values, window):
+    """
+    Moving average over window samples, with the edges averaged over the samples that exist.
+    """
+
+    window = max(1, min(window, len(values)))
+    kernel = np.ones(window)
+    return np.convolve(values, kernel, "same") / np.convolve(np.ones(len(values)), kernel, "same")
+
+def estimate_roll(chapters, duration):
+    """
+    Estimates the roll of a take from the accelerometer samples of its chapters.
+
+    :param chapters: Chapter files of the take.
+    :param duration: Duration of the take in seconds, the samples are spread evenly over it.
+    :return: Tuple of the median roll in degrees and the roll curve as (times, degrees) arrays, or None if the take
+             has no telemetry.
+    """
+
+    samples = np.concatenate([accelerometer(chapter) for chapter in chapters])
+    if len(samples) == 0:
+        return None
+
+    rolls = roll_angles(samples)
+    rate = len(samples) / duration if duration > 0 else 200.0
+    curve = smooth(rolls, int(ROLL_WINDOW * rate))
+
+    times = np.arange(len(samples)) / rate
+    step = max(1, int(ROLL_STEP * rate))
+    return float(np.median(rolls)), (times[::step], curve[::step])
@@ -0,0 +1,365 @@
+# A small model of ffmpeg filter graphs, to build the -filter_complex of sync.py from typed nodes.
+# Nodes that don't change the frame (zero rotation, zero x/y offset, ...) are dropped, adjacent crops and scales are
+# merged and linear chains are fused, so that ffmpeg only runs the passes that are needed.
+
+class Node:
+    """
+    A single filter. Subclasses know what they do to the frame size, and when they are a no-op.
+    """
+
+    def output_size(self, size):
+        """
+        Returns the frame size after the filter, or None if it is unknown.
+        """
+
+        return size
+
+    def is_identity(self, size):
+        return False
+
+class Filter(Node):
+    """
+    Any other filter, kept as it is (hwdownload, v360, remap, ...).
+    """
+
+    def __init__(self, text, keeps_size=False):
+        self.text = text
+        self.keeps_size = keeps_size
+
+    def output_size(self, size):
+        return size if self.keeps_size else None
+
+    def __str__(self):
+        return self.text
+
+class Crop(Node):
+    """
+    crop=w:h:x:y, centered if x/y are None.
+    """
+
+    def __init__(self, w, h, x=None, y=None):
+        self.w = w
+        self.h = h
+        self.x = x
+        self.y = y
+
+    def output_size(self, size):
+        return (self.w, self.h)
+
+    def is_identity(self, size):
+        return size == (self.w, self.h) and not self.x and not self.y
+
+    def __str__(self):
+        if self.x is None:
+            return f"crop={self.w}:{self.h}"
+        return f"crop={self.w}:{self.h}:{self.x}:{self.y}"
+
+class Pad(Node):
+    """
+    pad=w:h:x:y
+    """
+
+    def __init__(self, w, h, x=0, y=0):
+        self.w = w
+        self.h = h
+        self.x = x
+        self.y = y
+
+    def output_size(self, size):
+        return (self.w, self.h)
+
+    def is_identity(self, size):
+        return size == (self.w, self.h) and not self.x and not self.y
+
+    def __str__(self):
+        return f"pad={self.w}:{self.h}:{self.x}:{self.y}"
+
+class Scale(Node):
+    """
+    scale=w:h, or scale_cuda=w:h:format=... on the GPU (w/h can be None to only convert the format).
+    """
+
+    def __init__(self, w=None, h=None, cuda=False, format=None):
+        self.w = w
+        self.h = h
+        self.cuda = cuda
+        self.format = format
+
+    def output_size(self, size):
+        return (self.w, self.h) if self.w is not None else size
+
+    def is_identity(self, size):
+        return self.format is None and (self.w is None or size == (self.w, self.h))
+
+    def __str__(self):
+        args = [f"{self.w}:{self.h}"] if self.w is not None else []
+        if self.format is not None:
+            args.append(f"format={self.format}")
+        return f"{'scale_cuda' if self.cuda else 'scale'}={':'.join(args)}"
+
+class Rotate(Node):
+    """
+    rotate=angle*(PI/180):ow=w:oh=h, with the angle in degrees.
+    """
+
+    def __init__(self, degrees, w, h):
+        self.degrees = degrees
+        self.w = w
+        self.h = h
+
+    def output_size(self, size):
+        return (self.w, self.h)
+
+    def is_identity(self, size):
+        return self.degrees == 0 and size == (self.w, self.h)
+
+    def __str__(self):
+        return f"rotate={self.degrees}*(PI/180):ow={self.w}:oh={self.h}"
+
+class Format(Node):
+    """
+    format=pix_fmt
+    """
+
+    def __init__(self, pix_fmt):
+        self.pix_fmt = pix_fmt
+
+    def __str__(self):
+        return f"format={self.pix_fmt}"
+
+def merge(first, second):
+    """
+    Returns a single node that does the same as two adjacent nodes, or None if they can't be merged.
+    """
+
+    if isinstance(first, Crop) and isinstance(second, Crop) and None not in (first.x, first.y, second.x, second.y):
+        return Crop(second.w, second.h, first.x + second.x, first.y + second.y)
+
+    # only the last scale counts, resampling once is both faster and sharper
+    if isinstance(first, Scale) and isinstance(second, Scale) and first.cuda == second.cuda and first.format is None and second.w is not None:
+        return second
+
+    if isinstance(first, Format) and isinstance(second, Format) and first.pix_fmt == second.pix_fmt:
+        return first
+
+    return None
+
+def simplify(nodes, size=None):
+    """
+    Drops the no-op nodes of a linear chain and merges adjacent nodes.
+
+    :param size: Frame size (w, h) at the start of the chain, or None if unknown.
+    :return: The simplified list of nodes.
+    """
+
+    result = []
+    sizes = [size] # frame size in front of every node in result
+
+    for node in nodes:
+        if node.is_identity(sizes[-1]):
+            continue
+
+        if result:
+            merged = merge(result[-1], node)
+            if merged is not None:
+                result.pop()
+                sizes.pop()
+                if merged.is_identity(sizes[-1]):
+                    continue
+                node = merged
+
+        result.append(node)
+        sizes.append(node.output_size(sizes[-1]))
+
+    return result
+
+class Chain:
+    """
+    A linear chain of nodes, from labelled inputs to an (optionally) labelled output, or a list of outputs (split).
+    """
+
+    def __init__(self, inputs, nodes, output=None, size=None):
+        self.inputs = list(inputs)
+        self.nodes = list(nodes)
+        self.output = output
+        self.size = size
+
+    def __str__(self):
+        text = f"{''.join(f'[{label}]' for label in self.inputs)} {','.join(str(node) for node in self.nodes)}"
+        if isinstance(self.output, list):
+            text += f" {''.join(f'[{label}]' for label in self.output)}"
+        elif self.output is not None:
+            text += f" [{self.output}]"
+        return text
+
+class Graph:
+    """
+    A filter graph, built with add() and turned into a -filter_complex string with str().
+    """
+
+    def __init__(self):
+        self.chains = []
+
+    def add(self, inputs, nodes, output=None, size=None):
+        """
+        :param inputs: List of input labels, i.e. ["0:v"] or ["l", "r"].
+        :param nodes: List of nodes.
+        :param output: Output label, or None for the final (unlabelled) output.
+        :param size: Frame size (w, h) at the input, if it is known.
+        """
+
+        self.chains.append(Chain(inputs, nodes, output, size))
+        return self
+
+    def consumers(self, label):
+        return [chain for chain in self.chains if label in chain.inputs]
+
+    def fuse(self):
+        """
+        Fuses chains that feed exactly one single-input chain into it, so that no intermediate labels are left.
+        """
+
+        fused = True
+        while fused:
+            fused = False
+            for chain in self.chains:
+                if not isinstance(chain.output, str):
+                    continue
+                consumers = self.consumers(chain.output)
+                if len(consumers) == 1 and consumers[0].inputs == [chain.output]:
+                    consumer = consumers[0]
+                    consumer.inputs = chain.inputs
+                    consumer.nodes = chain.nodes + consumer.nodes
+                    consumer.size = chain.size
+                    self.chains.remove(chain)
+                    fused = True
+                    break
+
+    def simplify(self):
+        self.fuse()
+        for chain in self.chains:
+            chain.nodes = simplify(chain.nodes, chain.size)
+
+        # a chain that was reduced to nothing passes its input through
+        for chain in [chain for chain in self.chains if not chain.nodes and len(chain.inputs) == 1 and isinstance(chain.output, str)]:
+            for consumer in self.consumers(chain.output):
+                consumer.inputs = [chain.inputs[0] if label == chain.output else label for label in consumer.inputs]
+            self.chains.remove(chain)
+
+        return self
+
+    def __str__(self):
+        return "; ".join(str(chain) for chain in self.simplify().chains)
+
+def eye_nodes(calibration, eye, size=4096):
+    """
+    Returns the rotation and x/y alignment (crop and pad) of an eye.
+    """
+
+    x = calibration[f"offset{eye}_x"]
+    y = calibration[f"offset{eye}_y"]
+
+    return [
+        Rotate(calibration[f"rotate_global{eye}"] + calibration[f"rotate_local{eye}"], size, size),
+        Crop(size - abs(x), size - abs(y), abs(x) if x < 0 else 0, abs(y) if y < 0 else 0),
+        Pad(size, size, abs(x) if x > 0 else 0, abs(y) if y > 0 else 0)
+    ]
+
+def timing_nodes(calibration, eye, frame_rate):
+    """
+    Returns the clock drift correction of an eye: its timestamps are scaled onto the clock of the left eye and fps
+    drops or repeats a frame wherever the scaled timestamps cross a frame of the output.
+    """
+
+    drift = calibration.get(f"drift{eye}", 0.0)
+    if not drift or frame_rate is None:
+        return []
+
+    return [Filter(f"setpts=PTS/{1 + drift:.9f}", keeps_size=True), Filter(f"fps={frame_rate}", keeps_size=True)]
+
+def build_filter_complex(calibration, dewarp, mask, cuda, maps=False, interp=None, branches=None, frame_rate=None):
+    """
+    Builds the -filter_complex of sync.py.
+    The inputs are the left and right video (0, 1), the mask (2, if any) and the x/y maps of both eyes (if any).
+
+    :param maps: Use the precomputed remap files (see remap.py) instead of scale, rotate, crop/pad and v360.
+    :param interp: Interpolation of v360, None keeps the default (linear).
+    :param branches: List of (output label, nodes) to split the result into, i.e. one per output profile.
+                     None gives a single unlabelled output (uploaded to the GPU with cuda).
+    :param frame_rate: Frame rate of the videos, i.e. "30000/1001", needed to correct the clock drift (drift1/drift2 of the calibration).
+    :return: The -filter_complex string.
+    """
+
+    graph = Graph()
+    v360 = Filter(f"v360=fisheye:hequirect:ih_fov=177:iv_fov=177:in_stereo=sbs:out_stereo=sbs{f':interp={interp}' if interp else ''}")
+    hstack = Filter("hstack=inputs=2")
+    overlay = Filter("overlay", keeps_size=True)
+    hwdownload = Filter("hwdownload", keeps_size=True)
+
+    # the maps come after the mask in the inputs
+    m = 3 if mask else 2
+
+    for eye, label, source in ((1, "l", "0:v"), (2, "r", "1:v")):
+        map_x, map_y = f"{m + (eye - 1) * 2}:v", f"{m + (eye - 1) * 2 + 1}:v"
+        timing = timing_nodes(calibration, eye, frame_rate)
+
+        if cuda:
+            # Unfortunate limitations of ffmpeg with CUDA acceleration
+            # overlay_cuda does not support 10-bit video (p010le), so we can't use it and need to do hstack on the CPU instead, uploading and downloading the frames to and from the GPU in between
+            # hevc_nvenc only supports up to 8K resolution (8192), so we need to crop the video to 1:1 before merging
+            # hwdownload does not support yuvj420p, so we need to force format=p010le at the scale_cuda filter (GPLog is apparently yuvj420p)
+            # v360 only supports yuv420p10le and yuvj420p
+            # yuv420p10le == p010le (apparently, see https://www.reddit.com/r/ffmpeg/comments/c1im2i/encode_4k_hdr_pixel_format/)
+            if maps:
+                graph.add([source], timing + [Scale(cuda=True, format="p010le"), hwdownload, Format("p010le")], f"{label}s")
+            else:
+                graph.add([source], timing + [Scale(4096, 4096, cuda=True, format="p010le"), hwdownload, Format("p010le")], f"{label}s")
+                if dewarp:
+                    graph.add([f"{label}s"], [Format("p010le"), Format("yuv420p10le")], f"{label}ss")
+                    graph.add([f"{label}ss"], eye_nodes(calibration, eye), f"{label}c", (4096, 4096))
+                else:
+                    graph.add([f"{label}s"], eye_nodes(calibration, eye), f"{label}c", (4096, 4096))
+        else:
+            if maps:
+                graph.add([source], timing + [Crop(4648, 4648)], f"{label}s")
+            else:
+                graph.add([source], timing + [Crop(4648, 4648), Scale(4096, 4096)] + eye_nodes(calibration, eye), f"{label}c")
+
+        if maps:
+            graph.add([f"{label}s", map_x, map_y], [Filter("remap")], f"{label}c")
+
+    graph.add(["lc", "rc"], [hstack], "stack")
+    last = "stack"
+
+    if maps:
+        # with precomputed maps, scale, rotate, crop/pad and dewarp are a single remap per eye, sampling the full resolution source (nearest neighbour, faster but coarser than v360)
+        if dewarp and mask is not None:
+            graph.add(["stack", "2:v"], [overlay, Format("yuv420p10")], "out")
+        else:
+            graph.add(["stack"], [Format("p010le" if cuda else "yuv420p10le")], "out")
+        last = "out"
+    elif dewarp:
+        graph.add(["stack"], [v360], "dewarp")
+        last = "dewarp"
+        if mask is not None:
+            graph.add(["dewarp", "2:v"], [overlay, Format("yuv420p10")], "out")
+            last = "out"
+
+    if branches is None:
+        if cuda:
+            graph.add([last], [Filter("hwupload_cuda", keeps_size=True)])
+        else:
+            # ffmpeg only maps an unlabelled output by itself, a labelled one would be left unconnected
+            for chain in graph.chains:
+                if chain.output == last:
+                    chain.output = None
+        return str(graph)
+
+    # a branch without nodes is the split output itself
+    split = [label if not nodes else f"{label}s" for label, nodes in branches]
+    graph.add([last], [Filter(f"split={len(branches)}", keeps_size=True)], split)
+    for (label, nodes), source in zip(branches, split):
+        if nodes:
+            graph.add([source], nodes, label)
+
+    return str(graph)
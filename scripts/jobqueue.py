@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+
+# name of the job manifest in the queue directory
+MANIFEST_FILENAME = "manifest.json"
+
+# seconds after the last heartbeat before a claimed job is handed to another worker
+# (generous, as the clocks of the hosts and the NAS are never perfectly in sync)
+LEASE = 600.0
+
+# seconds between checks for jobs of other workers that finished or expired
+POLL_INTERVAL = 30.0
+
+def worker_name():
+    """
+    Returns a name for this worker that is unique across the hosts sharing the queue (and safe to use in file names).
+    """
+
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def job_id(output_file):
+    """
+    Returns a stable id for a job, so that a re-planned queue keeps the state of its jobs.
+    """
+
+    name = os.path.splitext(os.path.basename(output_file))[0]
+    digest = hashlib.sha1(os.path.abspath(output_file).encode("utf-8")).hexdigest()[:8]
+    return f"{name}_{digest}"
+
+def lock_path(queue_dir, job):
+    return os.path.join(queue_dir, "locks", f"{job}.lock")
+
+def done_path(queue_dir, job):
+    return os.path.join(queue_dir, "done", f"{job}.json")
+
+def write_json(filename, data):
+    """
+    Writes a JSON file atomically, so that workers on other hosts never read a partial file.
+    """
+
+    temp_file = f"{filename}.{worker_name()}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_file, filename)
+
+def write_manifest(queue_dir, jobs):
+    """
+    Writes the jobs to the manifest of a queue directory.
+    Jobs that already finished successfully in this queue stay done, failed jobs are queued again.
+
+    :param jobs: List of job dictionaries, each with a unique "id".
+    """
+
+    os.makedirs(os.path.join(queue_dir, "locks"), exist_ok=True)
+    os.makedirs(os.path.join(queue_dir, "done"), exist_ok=True)
+
+    for job in jobs:
+        result = read_result(queue_dir, job["id"])
+        if result is not None and not result["success"]:
+            os.remove(done_path(queue_dir, job["id"]))
+
+    write_json(os.path.join(queue_dir, MANIFEST_FILENAME), {"created": time.time(), "jobs": jobs})
+
+def read_manifest(queue_dir):
+    with open(os.path.join(queue_dir, MANIFEST_FILENAME), "r") as f:
+        return json.load(f)
+
+def read_result(queue_dir, job):
+    """
+    Returns the result of a finished job, or None if it hasn't finished yet.
+    """
+
+    try:
+        with open(done_path(queue_dir, job), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def lock_age(lock):
+    return time.time() - os.stat(lock).st_mtime
+
+def release_expired(lock, lease):
+    """
+    Removes the lock of a job whose worker stopped sending heartbeats.
+
+    :return: True if the lock is gone and the job can be claimed again.
+    """
+
+    try:
+        if lock_age(lock) < lease:
+            return False
+
+        # renaming is atomic, so only one of the workers that noticed the expired lock gets it
+        expired = f"{lock}.{worker_name()}.expired"
+        os.rename(lock, expired)
+    except FileNotFoundError:
+        return True
+
+    # another worker may have claimed the job again between the check and the rename, put its lock back
+    if lock_age(expired) < lease:
+        try:
+            os.link(expired, lock)
+        except OSError:
+            pass
+        os.remove(expired)
+        return False
+
+    os.remove(expired)
+    print(f"Re-queued {os.path.basename(lock)[:-len('.lock')]}, its worker stopped sending heartbeats.")
+    return True
+
+def claim_job(queue_dir, job, lease=LEASE):
+    """
+    Claims a job by creating its lock file, which fails if another worker already has it.
+
+    :return: True if this worker owns the job now.
+    """
+
+    lock = lock_path(queue_dir, job)
+
+    for _ in range(2):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not release_expired(lock, lease):
+                return False
+            continue
+
+        with os.fdopen(fd, "w") as f:
+            json.dump({"worker": worker_name(), "claimed": time.time()}, f)
+        return True
+
+    return False
+
+def release_job(queue_dir, job):
+    try:
+        os.remove(lock_path(queue_dir, job))
+    except FileNotFoundError:
+        pass
+
+class Heartbeat(threading.Thread):
+    """
+    Touches the lock of a claimed job periodically, so that other workers know it is still being processed.
+    """
+
+    def __init__(self, lock, interval):
+        super().__init__(daemon=True)
+        self.lock = lock
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.lock)
+            except FileNotFoundError:
+                print(f"Lost the lock {self.lock}, another worker may process the same job.")
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_worker(queue_dir, handler, lease=LEASE, poll=POLL_INTERVAL):
+    """
+    Claims and processes jobs of a queue until all of them are done.
+    Jobs claimed by other workers are waited for, so that they are taken over if their worker crashes.
+
+    :param handler: Function that processes a job, returning True on success.
+    :return: Tuple of (number of jobs processed, number of jobs that failed) by this worker.
+    """
+
+    worker = worker_name()
+    processed = 0
+    failed = 0
+
+    print(f"Worker {worker} processing the jobs in {queue_dir}")
+
+    while True:
+        # read again every time, the queue may have been re-planned in the meantime
+        jobs = read_manifest(queue_dir)["jobs"]
+        pending = [job for job in jobs if read_result(queue_dir, job["id"]) is None]
+        if not pending:
+            break
+
+        job = next((job for job in pending if claim_job(queue_dir, job["id"], lease)), None)
+        if job is None:
+            print(f"{len(pending)} job(s) claimed by other workers, checking again in {poll:g}s...")
+            time.sleep(poll)
+            continue
+
+        # the job may have finished between listing and claiming it
+        if read_result(queue_dir, job["id"]) is not None:
+            release_job(queue_dir, job["id"])
+            continue
+
+        print(f"Worker {worker} claimed {job['id']}")
+
+        heartbeat = Heartbeat(lock_path(queue_dir, job["id"]), lease / 4)
+        heartbeat.start()
+        start = time.monotonic()
+        try:
+            success = handler(job)
+        except Exception as e:
+            print(f"Error processing {job['id']}: {e}")
+            success = False
+        finally:
+            heartbeat.stop()
+
+        write_json(done_path(queue_dir, job["id"]), {
+            "worker": worker,
+            "success": success,
+            "finished": time.time(),
+            "elapsed": time.monotonic() - start
+        })
+        release_job(queue_dir, job["id"])
+
+        processed += 1
+        if not success:
+            failed += 1
+
+    print(f"Worker {worker} done: processed {processed} job(s), {failed} failed.")
+    return processed, failed
@@ -0,0 +1,199 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__:
+    from .jobqueue import write_json
+else:
+    from jobqueue import write_json
+
+# name of the offload manifest that is kept in the ingress directory
+MANIFEST_FILENAME = ".dugotovr_offload.json"
+
+# size of the copy buffers, SD cards (and spinning disks) are fastest with large sequential reads and writes
+CHUNK_SIZE = 64 * 1024 * 1024
+
+class OffloadManifest:
+    """
+    The files copied off the cards: source, size, modification time and checksum, kept across runs so that a card
+    that is offloaded again only copies the new files.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        try:
+            with open(filename, "r") as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+
+    def is_copied(self, source, destination):
+        stat = os.stat(source)
+        entry = self.files.get(os.path.abspath(destination))
+        return (
+            entry is not None and entry["source"] == os.path.abspath(source) and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime_ns and os.path.exists(destination) and os.path.getsize(destination) == stat.st_size
+        )
+
+    def add(self, source, destination, checksum):
+        stat = os.stat(source)
+        with self.lock:
+            self.files[os.path.abspath(destination)] = {"source": os.path.abspath(source), "size": stat.st_size, "mtime": stat.st_mtime_ns, "blake2b": checksum}
+            write_json(self.filename, self.files)
+
+def card_videos(card):
+    """
+    Returns the videos on a card (i.e. DCIM/100GOPRO/GX010001.MP4), in the order they were recorded.
+    """
+
+    videos = []
+    for directory, directories, files in os.walk(card):
+        directories[:] = sorted(d for d in directories if not d.startswith("."))
+        videos += [os.path.join(directory, name) for name in files if name.lower().endswith(".mp4") and not name.startswith(".")]
+
+    # GoPro numbers the files, the chapters of a take have the same file number
+    return sorted(videos, key=lambda video: (os.path.basename(video)[4:], os.path.basename(video)))
+
+def copy_file(source, destination):
+    """
+    Copies a file with large sequential reads and writes, hashing the data on the way.
+    The next chunk is read while the previous one is written, so that both cards (and the target) stay busy.
+
+    :return: Hex digest of the data (BLAKE2b).
+    """
+
+    checksum = hashlib.blake2b()
+    buffers = [bytearray(CHUNK_SIZE), bytearray(CHUNK_SIZE)]
+    free = queue.Queue()
+    filled = queue.Queue()
+    for buffer in buffers:
+        free.put(buffer)
+
+    errors = []
+    def write(target):
+        while True:
+            buffer, length = filled.get()
+            if buffer is None:
+                return
+            try:
+                if not errors:
+                    view = memoryview(buffer)[:length]
+                    checksum.update(view) # hashlib releases the GIL for large buffers
+                    target.write(view)
+            except OSError as e:
+                errors.append(e)
+            free.put(buffer)
+
+    with open(source, "rb", buffering=0) as f, open(destination, "wb", buffering=0) as target:
+        writer = threading.Thread(target=write, args=(target,), daemon=True)
+        writer.start()
+        try:
+            while not errors:
+                buffer = free.get()
+                length = f.readinto(buffer)
+                if not length:
+                    free.put(buffer)
+                    break
+                filled.put((buffer, length))
+        finally:
+            filled.put((None, 0))
+            writer.join()
+
+        if errors:
+            raise errors[0]
+        os.fsync(target.fileno())
+
+    return checksum.hexdigest()
+
+def hash_file(filename):
+    """
+    Returns the checksum of a file as it is on disk, dropping it from the page cache first (where possible).
+    """
+
+    checksum = hashlib.blake2b()
+    buffer = bytearray(CHUNK_SIZE)
+    with open(filename, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            checksum.update(memoryview(buffer)[:length])
+
+    return checksum.hexdigest()
+
+def offload_card(card, destination_dir, manifest, verify=True, stop=None):
+    """
+    Copies the videos of a card into a directory of the ingress (i.e. ingress/left), verifying every copy.
+    Files are copied into a .partial file that is only renamed when it is verified, so the ingress never has an
+    incomplete video (and the watch mode picks it up right away).
+
+    :param stop: threading.Event to stop after the file that is being copied, or None.
+    :return: List of the videos that failed.
+    """
+
+    os.makedirs(destination_dir, exist_ok=True)
+    videos = card_videos(card)
+    print(f"Offloading {len(videos)} video(s) from {card} to {destination_dir}")
+
+    failed = []
+    for i, source in enumerate(videos, 1):
+        if stop is not None and stop.is_set():
+            print(f"Stopped offloading {card} after {i - 1}/{len(videos)} video(s).")
+            break
+
+        destination = os.path.join(destination_dir, os.path.basename(source))
+        if manifest.is_copied(source, destination):
+            continue
+        if os.path.exists(destination):
+            # i.e. copied by hand before
+            checksum = hash_file(source) if os.path.getsize(destination) == os.path.getsize(source) else None
+            if checksum is None or hash_file(destination) != checksum:
+                print(f"Skipping {source}, {destination} already exists and is not a copy of it.")
+                failed.append(source)
+            else:
+                manifest.add(source, destination, checksum)
+            continue
+
+        partial = f"{destination}.partial"
+        try:
+            checksum = copy_file(source, partial)
+            if verify and hash_file(partial) != checksum:
+                raise OSError("the checksum of the copy doesn't match")
+
+            # keep the modification time, it is part of the fingerprint of the outputs
+            stat = os.stat(source)
+            os.utime(partial, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            os.replace(partial, destination)
+        except OSError as e:
+            print(f"Error copying {source}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+            failed.append(source)
+            continue
+
+        manifest.add(source, destination, checksum)
+        print(f"[{os.path.basename(destination_dir)} {i}/{len(videos)}] {source} -> {destination} ({checksum[:16]})")
+
+    return failed
+
+def offload(cards, ingress, verify=True, stop=None):
+    """
+    Offloads the cards concurrently, each into its own directory of the ingress.
+
+    :param cards: Dictionary of side (left/right) -> card path.
+    :param stop: threading.Event to stop both cards after the files that are being copied, or None.
+    :return: List of the videos that failed.
+    """
+
+    os.makedirs(ingress, exist_ok=True)
+    manifest = OffloadManifest(os.path.join(ingress, MANIFEST_FILENAME))
+
+    with ThreadPoolExecutor(max_workers=len(cards)) as executor:
+        futures = [executor.submit(offload_card, card, os.path.join(ingress, side), manifest, verify, stop) for side, card in cards.items()]
+        return [video for future in futures for video in future.result()]
@@ -0,0 +1,147 @@
+import os
+import glob
+import argparse
+
+if __package__:
+    from .util import VIDEO_PATTERN, PipelineError, match_videos
+    from .sync import add_job_arguments, build_jobs, job_complete, prepare_job, run_job, run_jobs
+    from .telemetry import METRICS_FILENAME, MetricsLog
+else:
+    from util import VIDEO_PATTERN, PipelineError, match_videos
+    from sync import add_job_arguments, build_jobs, job_complete, prepare_job, run_job, run_jobs
+    from telemetry import METRICS_FILENAME, MetricsLog
+
+# directory to cache the remap files in, as sync.py
+MAP_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "dugotovr", "maps")
+
+class Job:
+    """
+    A left/right pair with everything that is needed to render it: inputs, calibration, options and output file.
+    The underlying job dictionary (see sync.build_jobs) is in data.
+    """
+
+    def __init__(self, data, map_cache=MAP_CACHE):
+        self.data = data
+        self.map_cache = map_cache
+
+    @property
+    def video1(self):
+        return self.data["video1"]
+
+    @property
+    def video2(self):
+        return self.data["video2"]
+
+    @property
+    def output_file(self):
+        return self.data["output_file"]
+
+    @property
+    def calibration(self):
+        return self.data["calibration"]
+
+    @property
+    def duration(self):
+        return self.data["duration"]
+
+    def is_complete(self):
+        """
+        Returns True if the output (and the outputs of the additional profiles) is up to date.
+        """
+
+        return job_complete(self.data)
+
+    def render(self, threads=None, metrics=None):
+        """
+        Renders the pair, see sync.run_job.
+
+        :param threads: Thread budget for libx265 (None lets x265 use all cores).
+        :param metrics: MetricsLog to write the metrics of the job to, or None.
+        :return: True if the job succeeded, False otherwise.
+        """
+
+        flags = self.data["flags"]
+        prepare_job(self.data, self.map_cache)
+        return run_job(self.data, flags["dewarp"], flags["mask"], flags["cuda"], flags["preview"], threads, flags["engine"], self.map_cache, metrics=metrics)
+
+    def __repr__(self):
+        return f"Job({self.video1!r}, {self.video2!r} -> {self.output_file!r})"
+
+class Pipeline:
+    """
+    The steps of sync.py, to be called from other tools without going through the command line:
+    discover the videos of the ingress, match them into pairs, load their calibration into jobs and render them.
+
+        pipeline = Pipeline("ingress", "synced", dewarp=True, cuda=False)
+        jobs = pipeline.jobs()
+        failed = pipeline.render(jobs, num_jobs=2)
+
+    The options are the ones of sync.py (dewarp, mask, cuda, preview, remap, segments, engine, profiles, drift, force,
+    organize, refresh_index) with the same defaults. Invalid input (a missing ingress, too few videos, videos that can't
+    be probed, conflicting options) raises PipelineError.
+    """
+
+    def __init__(self, ingress, egress, map_cache=MAP_CACHE, metrics=None, **options):
+        parser = argparse.ArgumentParser()
+        add_job_arguments(parser)
+        self.args = parser.parse_args([ingress, egress])
+        for key, value in options.items():
+            if key in ("ingress", "egress") or not hasattr(self.args, key):
+                raise TypeError(f"Unknown option: {key}")
+            setattr(self.args, key, value)
+
+        self.map_cache = map_cache
+        self.metrics = MetricsLog(metrics or os.path.join(egress, METRICS_FILENAME))
+
+    def discover(self):
+        """
+        Returns the videos in the ingress (in a directory per eye).
+        """
+
+        return sorted(glob.glob(os.path.join(self.args.ingress, VIDEO_PATTERN)))
+
+    def match(self, videos=None):
+        """
+        Matches videos (default: all videos in the ingress) into left/right pairs, see util.match_videos.
+
+        :return: List of ((video1, data1), (video2, data2)) pairs.
+        :raises PipelineError: If a video can't be probed.
+        """
+
+        return match_videos(self.discover() if videos is None else videos, self.args.ingress, self.args.refresh_index)
+
+    def jobs(self, videos=None):
+        """
+        Matches videos (default: all videos in the ingress) and loads the calibration of every pair into a job.
+
+        :return: List of Job.
+        :raises PipelineError: See build_jobs in sync.py.
+        """
+
+        return [Job(job, self.map_cache) for job in build_jobs(self.args, videos)]
+
+    def pending(self, jobs):
+        """
+        Returns the jobs whose output is missing or out of date (all of them with force).
+        """
+
+        return [job for job in jobs if self.args.force or not job.is_complete()]
+
+    def render(self, jobs=None, num_jobs=1, max_sessions=3):
+        """
+        Renders the pending jobs concurrently, see sync.run_jobs.
+
+        :param jobs: List of Job, None renders all pairs of the ingress.
+        :param num_jobs: Number of pairs to process at the same time.
+        :param max_sessions: Maximum number of concurrent NVENC sessions (CUDA only).
+        :return: List of the jobs that failed.
+        :raises PipelineError: When the jobs of the ingress are built, see jobs().
+        """
+
+        jobs = self.pending(self.jobs() if jobs is None else jobs)
+        for job in jobs:
+            prepare_job(job.data, self.map_cache)
+
+        args = self.args
+        failed = run_jobs([job.data for job in jobs], num_jobs, max_sessions, args.dewarp, args.mask, args.cuda, args.preview, args.engine, self.map_cache, self.metrics)
+        return [job for job in jobs if any(job.data is data for data in failed)]
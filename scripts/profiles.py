@@ -0,0 +1,84 @@
+# Output profiles of sync.py. All profiles of a pair are rendered from a single decode: the filter graph is split after
+# the stereo/dewarp stage, and every branch gets its own scale and encoder.
+
+import os
+
+if __package__:
+    from .graph import Filter, Scale, Format
+else:
+    from graph import Filter, Scale, Format
+
+# seconds between the poster thumbnails
+POSTER_INTERVAL = 30
+
+# size of the poster thumbnails (both eyes)
+POSTER_WIDTH = 1024
+POSTER_HEIGHT = 512
+
+# the master is always rendered, the others are optional
+PROFILES = ["master", "proxy", "thumbnails"]
+
+# bitrate of the track of the external recorder (PCM can't go into an mp4)
+RECORDER_BITRATE = "320k"
+
+def profile_file(output_file, profile):
+    """
+    Returns the output of a profile next to the master: i.e. name_proxy.mp4, or the name_thumbs directory.
+    """
+
+    root, ext = os.path.splitext(output_file)
+    if profile == "proxy":
+        return f"{root}_proxy{ext}"
+    if profile == "thumbnails":
+        return f"{root}_thumbs"
+    return output_file
+
+def profile_nodes(profile, cuda):
+    """
+    Returns the filter nodes of the branch of a profile, after the split.
+    """
+
+    if profile == "proxy":
+        # 2K per eye, 8-bit 4:2:0 H.264 plays on every headset (h264_nvenc takes the frames from system memory)
+        return [Scale(4096, 2048), Format("yuv420p")]
+    if profile == "thumbnails":
+        return [Filter(f"fps=1/{POSTER_INTERVAL}"), Scale(POSTER_WIDTH, POSTER_HEIGHT)]
+    # the master keeps the full resolution
+    return [Filter("hwupload_cuda", keeps_size=True)] if cuda else []
+
+def audio_args(recording=False):
+    """
+    Returns the audio encoder arguments: the track of the camera is copied. With the recording of an external recorder,
+    it is the first track (encoded, and padded with silence so that -shortest ends with the video) and the camera
+    track is kept as the second one.
+    """
+
+    if recording:
+        return ["-filter:a:0", "apad", "-c:a:0", "aac", "-b:a:0", RECORDER_BITRATE, "-c:a:1", "copy"]
+    return ["-c:a:0", "copy"]
+
+def profile_args(profile, cuda, threads=None, recording=False):
+    """
+    Returns the encoder arguments of a profile.
+
+    :param threads: Thread budget for libx265 (None lets x265 use all cores).
+    :param recording: The output has the track of an external recorder (see audio_args).
+    """
+
+    if profile == "proxy":
+        if cuda:
+            return ["-c:v", "h264_nvenc", "-b:v", "40M", *audio_args(recording)]
+        return ["-c:v", "libx264", "-preset", "fast", "-crf", "20", *audio_args(recording)]
+    if profile == "thumbnails":
+        return ["-q:v", "3"]
+    if cuda:
+        return [*audio_args(recording), "-c:v", "hevc_nvenc", "-b:v", "200M"] # TODO tune this
+    return [
+        *audio_args(recording),
+        "-c:v",
+        "libx265",
+        "-crf",
+        "18", # default is 28
+        "-x265-params" if threads else None,
+        f"pools={threads}" if threads else None # keep concurrent encoders from oversubscribing the cores
+    ]
@@ -0,0 +1,174 @@
+import os
+import glob
+import sqlite3
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__:
+    from .util import PROBE_WORKERS, MIN_OVERLAP, open_index, file_key, lazy_import
+    from .audio import AUDIO_RATE, AUDIO_WINDOW, extract_audio, cross_correlate
+else:
+    from util import PROBE_WORKERS, MIN_OVERLAP, open_index, file_key, lazy_import
+    from audio import AUDIO_RATE, AUDIO_WINDOW, extract_audio, cross_correlate
+
+ffmpeg = lazy_import("ffmpeg")
+np = lazy_import("numpy")
+
+# recordings of an external recorder (i.e. Zoom: ZOOM0001/ZOOM0001_LR.WAV), in any subdirectory of the audio folder
+RECORDING_PATTERN = "**/*.[wW][aA][vV]"
+
+# the clocks of the recorder and the cameras are set by hand, the offset is searched this far around the metadata, in seconds
+RECORDER_SEARCH = 60.0
+
+# minimum confidence of the offset to use the recording
+RECORDER_MIN_CONFIDENCE = 0.2
+
+def get_recording_info(filename):
+    """
+    Retrieves the start and duration of a recording. The start is taken from the broadcast wave (bext) chunk:
+    the date and the samples since midnight, in local time like the timecode of the cameras (see util.take_start).
+    Without it, the end of the recording is taken from the modification time of the file.
+
+    :return: Tuple of the start in seconds since the epoch and the duration in seconds, or None if it can't be probed.
+    """
+
+    try:
+        probe = ffmpeg.probe(filename)
+    except ffmpeg.Error as e:
+        print(f"Error occurred while probing {filename}: {e.stderr}")
+        return None
+
+    stream = next((stream for stream in probe["streams"] if stream["codec_type"] == "audio"), None)
+    if stream is None:
+        print(f"No audio stream found in {filename}.")
+        return None
+
+    duration = float(probe.get("format", {}).get("duration", stream.get("duration", 0.0)))
+    tags = probe.get("format", {}).get("tags", {})
+    rate = int(stream.get("sample_rate", 0))
+
+    date = tags.get("origination_date") or tags.get("date")
+    if date and tags.get("time_reference") and rate:
+        midnight = datetime.strptime(date[:10].replace(":", "-").replace("/", "-"), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        return midnight.timestamp() + int(tags["time_reference"]) / rate, duration
+
+    if tags.get("creation_time"):
+        creation_time = datetime.fromisoformat(tags["creation_time"])
+        if creation_time.tzinfo is None:
+            creation_time = creation_time.replace(tzinfo=timezone.utc)
+        return creation_time.timestamp(), duration
+
+    # local time of day labelled as UTC, like the cameras
+    end = datetime.fromtimestamp(os.path.getmtime(filename)).replace(tzinfo=timezone.utc)
+    return end.timestamp() - duration, duration
+
+def get_recordings(audio_dir, index_path):
+    """
+    Returns the recordings of an audio folder, using the metadata index for the files that didn't change.
+
+    :return: List of (path, start, duration) tuples.
+    """
+
+    files = sorted(glob.glob(os.path.join(audio_dir, RECORDING_PATTERN), recursive=True))
+    keys = {filename: file_key(filename) for filename in files}
+
+    connection = None
+    try:
+        connection = open_index(index_path)
+    except sqlite3.Error as e:
+        print(f"Could not open the metadata index {index_path}: {e}. Continuing without it.")
+
+    info = {}
+    if connection is not None:
+        for filename, (path, size, mtime) in keys.items():
+            row = connection.execute("SELECT start, duration FROM recordings WHERE path = ? AND size = ? AND mtime = ?", (path, size, mtime)).fetchone()
+            if row is not None:
+                info[filename] = tuple(row)
+
+    missing = [filename for filename in files if filename not in info]
+    if missing:
+        print(f"Probing {len(missing)} recording(s) not in the metadata index...")
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            for filename, result in zip(missing, executor.map(get_recording_info, missing)):
+                info[filename] = result
+
+        if connection is not None:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?)",
+                    [keys[filename] + info[filename] for filename in missing if info[filename] is not None]
+                )
+
+    if connection is not None:
+        connection.close()
+
+    recordings = [(filename, *info[filename]) for filename in files if info[filename] is not None]
+    print(f"Found {len(recordings)} recording(s) in {audio_dir}")
+    return recordings
+
+def match_recording(recordings, start, duration):
+    """
+    Returns the recording that overlaps the most with a synced take, or None if none overlaps with at least
+    MIN_OVERLAP of it.
+
+    :param recordings: List of (path, start, duration) tuples, see get_recordings().
+    :param start: Start of the synced take in seconds since the epoch (see util.take_start).
+    :return: Tuple of (path, start, duration), or None.
+    """
+
+    best = None
+    best_overlap = MIN_OVERLAP * duration
+    for recording in recordings:
+        _, recording_start, recording_duration = recording
+        overlap = min(start + duration, recording_start + recording_duration) - max(start, recording_start)
+        if overlap >= best_overlap:
+            best = recording
+            best_overlap = overlap
+    return best
+
+def overlap_confidence(a, b, lag):
+    """
+    Returns the normalized correlation of b and the part of a it overlaps at lag (see audio.cross_correlate).
+    """
+
+    a_start = max(lag, 0)
+    b_start = max(-lag, 0)
+    length = min(len(a) - a_start, len(b) - b_start)
+    if length <= 0:
+        return 0.0
+
+    x = a[a_start:a_start + length] - np.mean(a[a_start:a_start + length])
+    y = b[b_start:b_start + length] - np.mean(b[b_start:b_start + length])
+    norm = np.sqrt(np.sum(x * x) * np.sum(y * y))
+    return float(abs(np.dot(x, y)) / norm) if norm > 0 else 0.0
+
+def estimate_recording_offset(video, chapters, start_sec, recording, approximate, window=AUDIO_WINDOW, search=RECORDER_SEARCH):
+    """
+    Finds the position of the synced take in a recording, by cross-correlating the scratch track of the (left)
+    camera with a window of the recording around the position from the metadata.
+
+    :param start_sec: Start of the synced take in the video, in seconds.
+    :param approximate: Position of the synced take in the recording from the metadata, in seconds.
+    :return: Tuple of the position in the recording in seconds (negative if the recording started later) and
+             the confidence, or None if there is no audio to compare.
+    """
+
+    scratch = extract_audio(video, start_sec, window, chapters=chapters)
+    recording_start = max(0.0, approximate - search)
+    audio = extract_audio(recording, recording_start, max(window, window + approximate - recording_start + search))
+    if len(scratch) == 0 or len(audio) == 0:
+        return None
+
+    # an event at sample j of the scratch track is at sample j + lag of the recording window
+    lag, _ = cross_correlate(audio, scratch)
+    return recording_start + lag / AUDIO_RATE, overlap_confidence(audio, scratch, lag)
+
+def recording_args(recording, offset):
+    """
+    Returns the ffmpeg arguments to open a recording so that it starts with the synced take.
+    """
+
+    if offset >= 0:
+        return ["-ss", f"{offset:.6f}", "-i", recording]
+    # the recording started after the cameras, it is delayed
+    return ["-itsoffset", f"{-offset:.6f}", "-i", recording]
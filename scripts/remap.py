@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+
+if __package__:
+    from .util import lazy_import
+else:
+    from util import lazy_import
+
+np = lazy_import("numpy")
+
+# the center of the 5.3K 8:7 fisheye frame that is used (the decoder / crop filter crops to this)
+CROP_SIZE = 4648
+
+# size of each eye in the output
+EYE_SIZE = 4096
+
+# field of view of the fisheye lens in degrees
+FOV = 177.0
+
+# rows that are computed at once, to keep the memory use of the map generation bounded
+CHUNK_ROWS = 256
+
+# bump this when the map generation changes, so that cached maps are regenerated
+MAP_VERSION = 1
+
+def eye_map(rotation, offset_x, offset_y, dewarp, fov=FOV, size=EYE_SIZE, crop=CROP_SIZE):
+    """
+    Computes where each output pixel of an eye comes from in the (center cropped) source frame.
+    This folds the whole geometric chain of process_videos into a single lookup:
+    scale (crop -> size), rotate, crop/pad (x/y offset) and optionally the fisheye to half-equirectangular dewarp (v360).
+
+    :param rotation: Clockwise rotation in degrees (as the ffmpeg rotate filter).
+    :param offset_x: Horizontal offset in pixels of the scaled frame (positive moves the image right).
+    :param offset_y: Vertical offset in pixels of the scaled frame (positive moves the image down).
+    :return: Tuple of float32 x and y maps of shape (size, size), -1 where there is no source pixel.
+    """
+
+    map_x = np.empty((size, size), np.float32)
+    map_y = np.empty((size, size), np.float32)
+
+    angle = np.radians(rotation)
+    cos, sin = np.cos(angle), np.sin(angle)
+    center = (size - 1) / 2
+    scale = crop / size
+    columns = np.arange(size, dtype=np.float64)
+
+    for row in range(0, size, CHUNK_ROWS):
+        rows = np.arange(row, min(row + CHUNK_ROWS, size), dtype=np.float64)
+        u, v = np.meshgrid(columns, rows)
+        valid = np.ones(u.shape, bool)
+
+        if dewarp:
+            # half-equirectangular output pixel -> direction (as v360 hequirect)
+            phi = ((2 * u + 1) / size - 1) * np.pi / 2
+            theta = ((2 * v + 1) / size - 1) * np.pi / 2
+            x = np.cos(theta) * np.sin(phi)
+            y = np.sin(theta)
+            z = np.cos(theta) * np.cos(phi)
+
+            # direction -> equidistant fisheye (as v360 fisheye)
+            h = np.hypot(x, y)
+            h[h == 0] = 1
+            r = np.arctan2(np.hypot(x, y), z) / np.radians(fov / 2)
+            valid &= r <= 1
+            u = (x / h * r + 1) / 2 * (size - 1)
+            v = (y / h * r + 1) / 2 * (size - 1)
+
+        # undo the x/y offset (crop + pad), the padded border is black
+        u = u - offset_x
+        v = v - offset_y
+        valid &= (u >= 0) & (u <= size - 1) & (v >= 0) & (v <= size - 1)
+
+        # undo the clockwise rotation around the center, the corners are black
+        du, dv = u - center, v - center
+        u = cos * du + sin * dv + center
+        v = -sin * du + cos * dv + center
+        valid &= (u >= -0.5) & (u <= size - 0.5) & (v >= -0.5) & (v <= size - 0.5)
+
+        # undo the downscale, to sample the source at its full resolution
+        u = (u + 0.5) * scale - 0.5
+        v = (v + 0.5) * scale - 0.5
+
+        map_x[row:row + len(rows)] = np.where(valid, np.clip(u, 0, crop - 1), -1)
+        map_y[row:row + len(rows)] = np.where(valid, np.clip(v, 0, crop - 1), -1)
+
+    return map_x, map_y
+
+def eye_parameters(calibration, eye):
+    """
+    Returns the rotation and x/y offset of an eye (1 or 2) from the calibration dictionary of sync.py.
+    """
+
+    return (
+        calibration[f"rotate_global{eye}"] + calibration[f"rotate_local{eye}"],
+        calibration[f"offset{eye}_x"],
+        calibration[f"offset{eye}_y"]
+    )
+
+def map_key(rotation, offset_x, offset_y, dewarp, fov, size, crop):
+    parameters = {
+        "version": MAP_VERSION,
+        "rotation": round(float(rotation), 6),
+        "offset_x": round(float(offset_x), 6),
+        "offset_y": round(float(offset_y), 6),
+        "dewarp": bool(dewarp),
+        "fov": float(fov),
+        "size": int(size),
+        "crop": int(crop)
+    }
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def write_pgm(filename, data):
+    """
+    Writes a 16 bit binary PGM, as read by the ffmpeg remap filter. Written to a temporary file first,
+    so that a concurrent run never sees a partial map.
+    """
+
+    temporary = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(f"P5\n{data.shape[1]} {data.shape[0]}\n65535\n".encode("ascii"))
+        f.write(data.astype(">u2").tobytes())
+    os.replace(temporary, filename)
+
+def chroma_map(map_x, map_y):
+    """
+    Derives the maps for 4:2:0 chroma planes from the luma maps, by averaging each 2x2 block
+    and converting to chroma coordinates. Blocks with any unmapped pixel stay unmapped.
+    """
+
+    maps = []
+    invalid = (map_x[0::2, 0::2] < 0) | (map_x[1::2, 1::2] < 0) | (map_x[0::2, 1::2] < 0) | (map_x[1::2, 0::2] < 0)
+    for luma in (map_x, map_y):
+        block = (luma[0::2, 0::2] + luma[1::2, 1::2] + luma[0::2, 1::2] + luma[1::2, 0::2]) / 4
+        maps.append(np.where(invalid, -1, (block + 0.5) / 2 - 0.5).astype(np.float32))
+    return maps
+
+def save_npy(filename, data):
+    temporary = f"{filename}.{os.getpid()}.tmp.npy"
+    np.save(temporary, data)
+    os.replace(temporary, filename)
+
+def map_arrays(calibration, eye, dewarp, cache_dir, fov=FOV, size=EYE_SIZE, crop=CROP_SIZE):
+    """
+    Returns float32 maps of an eye as .npy files, for remapping in Python (see engine.py), generating them if they are not cached yet.
+    The files can be memory-mapped, so that several processes share the same pages.
+
+    :return: Tuple of luma x, luma y, chroma x and chroma y map file paths.
+    """
+
+    rotation, offset_x, offset_y = eye_parameters(calibration, eye)
+    key = map_key(rotation, offset_x, offset_y, dewarp, fov, size, crop)
+
+    files = tuple(os.path.join(cache_dir, f"{key}_{name}.npy") for name in ("x", "y", "chroma_x", "chroma_y"))
+    if all(os.path.exists(f) for f in files):
+        return files
+
+    os.makedirs(cache_dir, exist_ok=True)
+    print(f"Generating float maps for rotation: {rotation:.2f}, offset: {offset_x}/{offset_y}, dewarp: {dewarp} -> {key}")
+
+    map_x, map_y = eye_map(rotation, offset_x, offset_y, dewarp, fov, size, crop)
+    chroma_x, chroma_y = chroma_map(map_x, map_y)
+
+    for filename, data in zip(files, (map_x, map_y, chroma_x, chroma_y)):
+        save_npy(filename, data)
+
+    return files
+
+def remap_files(calibration, eye, dewarp, cache_dir, fov=FOV, size=EYE_SIZE, crop=CROP_SIZE):
+    """
+    Returns the x/y map files for the ffmpeg remap filter of an eye, generating them if they are not cached yet.
+    The maps are cached by a hash of the calibration values, FOV and sizes.
+
+    :return: Tuple of x and y map file paths.
+    """
+
+    rotation, offset_x, offset_y = eye_parameters(calibration, eye)
+    key = map_key(rotation, offset_x, offset_y, dewarp, fov, size, crop)
+
+    x_file = os.path.join(cache_dir, f"{key}_x.pgm")
+    y_file = os.path.join(cache_dir, f"{key}_y.pgm")
+
+    if os.path.exists(x_file) and os.path.exists(y_file):
+        return x_file, y_file
+
+    os.makedirs(cache_dir, exist_ok=True)
+    print(f"Generating remap for rotation: {rotation:.2f}, offset: {offset_x}/{offset_y}, dewarp: {dewarp} -> {key}")
+
+    map_x, map_y = eye_map(rotation, offset_x, offset_y, dewarp, fov, size, crop)
+
+    # the remap filter works on whole pixels, and fills everything that points outside of the source with black
+    invalid = map_x < 0
+    map_x = np.round(map_x).astype(np.uint16)
+    map_y = np.round(map_y).astype(np.uint16)
+    map_x[invalid] = 65535
+    map_y[invalid] = 65535
+
+    write_pgm(x_file, map_x)
+    write_pgm(y_file, map_y)
+
+    return x_file, y_file
@@ -5,19 +5,74 @@ import argparse
 import glob
 import yaml
 import math
+import time
+import shutil
+import threading
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from util import *
+if __package__:
+    from .util import *
+    from .remap import remap_files
+    from .graph import build_filter_complex
+    from .profiles import PROFILES, profile_file, profile_nodes, profile_args, audio_args
+    from .triage import TRIAGE_JOBS, triage
+    from .engine import process_videos_python
+    from .audio import DRIFT_MIN_DURATION, estimate_drift
+    from .recorder import RECORDER_MIN_CONFIDENCE, get_recordings, match_recording, estimate_recording_offset, recording_args
+    from .telemetry import METRICS_FILENAME, JobTelemetry, Reporter, MetricsLog, format_duration, run_ffmpeg
+    from .offload import offload
+    from .watch import SETTLE, STATE_FILENAME, FolderWatcher, WatchState, take_complete
+    from .jobqueue import LEASE, POLL_INTERVAL, MANIFEST_FILENAME, job_id, write_manifest, run_worker
+else:
+    from util import *
+    from remap import remap_files
+    from graph import build_filter_complex
+    from profiles import PROFILES, profile_file, profile_nodes, profile_args, audio_args
+    from triage import TRIAGE_JOBS, triage
+    from engine import process_videos_python
+    from audio import DRIFT_MIN_DURATION, estimate_drift
+    from recorder import RECORDER_MIN_CONFIDENCE, get_recordings, match_recording, estimate_recording_offset, recording_args
+    from telemetry import METRICS_FILENAME, JobTelemetry, Reporter, MetricsLog, format_duration, run_ffmpeg
+    from offload import offload
+    from watch import SETTLE, STATE_FILENAME, FolderWatcher, WatchState, take_complete
+    from jobqueue import LEASE, POLL_INTERVAL, MANIFEST_FILENAME, job_id, write_manifest, run_worker
 
-def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, cuda, preview):
+def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, cuda, preview, threads=None, chapters1=None, chapters2=None, maps=None, segments=None, frame_rate=None, frames=None, audio=True, fingerprint=None, telemetry=None, label="encode", interp=None, profiles=None, recording=None):
+    """
+    Trims, aligns and merges a left/right pair into a single side-by-side video.
+
+    :param threads: Thread budget for libx265 (None lets x265 use all cores).
+    :param chapters1: Chapter files of the left take, concatenated on the fly.
+    :param chapters2: Chapter files of the right take, concatenated on the fly.
+    :param maps: Tuple of x/y remap files for the left and right eye (see remap.py), replacing rotate, crop/pad and v360.
+    :param segments: List of (first frame, number of frames) segments to encode in parallel (see plan_segments), CPU only.
+    :param frame_rate: Frame rate of the videos, i.e. "30000/1001" (needed for segments and the drift correction).
+    :param frames: Only encode this many frames (used for the segments).
+    :param audio: Copy the audio of the left video (the segments get it when they are joined).
+    :param fingerprint: Fingerprint of the job (see job_fingerprint), stored in the comment tag of the output.
+    :param telemetry: JobTelemetry to report the progress of ffmpeg to (see telemetry.py).
+    :param label: Name of the ffmpeg process in the telemetry.
+    :param interp: Interpolation of v360 (nearest, linear, cubic, lanczos, ...), None keeps the default (linear).
+    :param profiles: List of (profile, file) of additional outputs rendered from the same decode (see profiles.py).
+    :param recording: Tuple of the recording of an external recorder and the position of the synced take in it
+                      (see recorder.py), muxed as the first audio track, or None.
+    :return: True if ffmpeg succeeded, False otherwise.
+    """
     cmd = []
 
+    if segments is not None and len(segments) > 1 and not cuda:
+        return process_segments(video1, video2, calibration, output_file, tc, dewarp, mask, preview, threads, chapters1, chapters2, maps, segments, frame_rate, fingerprint, telemetry, recording)
+
     # additional accelerations to look into
     # hstack_vaapi, hstack_qsv
 
-    # alternatives to ss, as it seems not too accurate
+    # -ss before -i seeks to the preceding keyframe and drops the decoded frames in front of the seek time
+    # the seek times are half way between two frames of the packet index (see set_start_times), so the right number of frames is dropped
+    # alternatives that were tried:
     # put -ss after -i -> didn't seem to work at all
     # trim filter: 'trim=start_frame=n' -> couldn't get that to work as expected, only when setstp was also set, which severely reduced the bitrate for some odd reason
-    # select filter: 'select=gte(n\,100)' -> not tried yet.
+    # select filter: 'select=gte(n\,100)' -> decodes everything in front of the start frame, and the audio would need the same cut
 
     # v360 options 
     # id_fov, ih_fov, iv_fov, d_fov, h_fov, v_fov, in_stereo, out_stereo
@@ -31,38 +86,28 @@ def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, c
     # gp-log: yuvj420p
     # normal: yuv420p10le
 
-    # rotation 
-    v1_rotate = f"rotate={calibration['rotate_global1'] + calibration['rotate_local1']}*(PI/180):ow=4096:oh=4096"
-    v2_rotate = f"rotate={calibration['rotate_global2'] + calibration['rotate_local2']}*(PI/180):ow=4096:oh=4096"
-
-    # calculate parameters for crop and pad filters for x/y stereo alignment
-    # crop: w:h:x:y
-    # pad: w:h:x:y
-    v1_crop = f"crop={4096-abs(calibration['offset1_x'])}:{4096-abs(calibration['offset1_y'])}:{abs(calibration['offset1_x']) if calibration['offset1_x'] < 0 else 0}:{abs(calibration['offset1_y']) if calibration['offset1_y'] < 0 else 0}"
-    v2_crop = f"crop={4096-abs(calibration['offset2_x'])}:{4096-abs(calibration['offset2_y'])}:{abs(calibration['offset2_x']) if calibration['offset2_x'] < 0 else 0}:{abs(calibration['offset2_y']) if calibration['offset2_y'] < 0 else 0}"
-    v1_pad = f"pad=4096:4096:{abs(calibration['offset1_x']) if calibration['offset1_x'] > 0 else 0}:{abs(calibration['offset1_y']) if calibration['offset1_y'] > 0 else 0}"
-    v2_pad = f"pad=4096:4096:{abs(calibration['offset2_x']) if calibration['offset2_x'] > 0 else 0}:{abs(calibration['offset2_y']) if calibration['offset2_y'] > 0 else 0}"
+    # the extra profiles are split off after the stereo/dewarp stage, so that the pair is only decoded once
+    outputs = [("master", output_file)] + (profiles or [])
+    # the recording needs explicit maps, so the video gets a label even without additional profiles
+    branches = [(f"out{i}", profile_nodes(profile, cuda)) for i, (profile, _) in enumerate(outputs)] if len(outputs) > 1 or (recording and audio) else None
 
-    if cuda:
-
-        # Unfortunate limitations of ffmpeg with CUDA acceleration
-        # overlay_cuda does not support 10-bit video (p010le), so we can't use it and need to do hstack on the CPU instead, uploading and downloading the frames to and from the GPU in between 
-        # hevc_nvenc only supports up to 8K resolution (8192), so we need to crop the video to 1:1 before merging
-        # hwdownload does not support yuvj420p, so we need to force format=p010le at the scale_cuda filter (GPLog is apparently yuvj420p)
-        # v360 only supports yuv420p10le and yuvj420p
-        # yuv420p10le == p010le (apparently, see https://www.reddit.com/r/ffmpeg/comments/c1im2i/encode_4k_hdr_pixel_format/)
+    # rotation, x/y stereo alignment (crop/pad) and dewarp, without the passes that don't change the frames (see graph.py)
+    filter_complex = build_filter_complex(calibration, dewarp, mask, cuda, maps is not None, interp, branches, frame_rate)
 
-        filter_complex = ""
-        if dewarp: # around 8.5 FPS
-            filter_complex = f"[0:v] scale_cuda=4096:4096:format=p010le [l]; [1:v] scale_cuda=4096:4096:format=p010le [r]; [l] hwdownload,format=p010le [ls]; [r] hwdownload,format=p010le [rs]; [ls] format=p010le,format=yuv420p10le [lss]; [rs] format=p010le,format=yuv420p10le [rss]; [lss] {v1_rotate} [lr]; [rss] {v2_rotate} [rr]; [lr] {v1_crop},{v1_pad} [lc]; [rr] {v2_crop},{v2_pad} [rc]; [lc][rc] hstack=inputs=2 [stack]; [stack] v360=fisheye:hequirect:ih_fov=177:iv_fov=177:in_stereo=sbs:out_stereo=sbs [dewarp]"
+    # the maps come after the mask in the inputs
+    map_inputs = []
+    if maps is not None:
+        for map_file in maps:
+            map_inputs += ["-i", map_file]
 
-            if mask is not None:
-                filter_complex += f"; [dewarp][2:v] overlay,format=yuv420p10 [out]; [out] hwupload_cuda"
-            else:
-                filter_complex += f"; [dewarp] hwupload_cuda"
+    # the recording comes after the maps, it is only decoded for the audio
+    recording_inputs = []
+    audio_maps = ["-map", "0:a:0?"]
+    if recording and audio:
+        recording_inputs = recording_args(*recording)
+        audio_maps = ["-map", f"{2 + (1 if mask else 0) + len(map_inputs) // 2}:a:0", "-map", "0:a:0?"]
 
-        if not dewarp: # around 23 FPS
-            filter_complex = f"[0:v] scale_cuda=4096:4096:format=p010le [l]; [1:v] scale_cuda=4096:4096:format=p010le [r]; [l] hwdownload,format=p010le [ls]; [r] hwdownload,format=p010le[rs]; [ls] {v1_rotate} [lr]; [rs] {v2_rotate} [rr]; [lr] {v1_crop},{v1_pad} [lc]; [rr] {v2_crop},{v2_pad} [rc]; [lc][rc] hstack=inputs=2 [stack]; [stack] hwupload_cuda"
+    if cuda:
 
         cmd = [
             "ffmpeg",
@@ -76,8 +121,7 @@ def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, c
             "0x0x332x332",
             "-ss",
             f"{calibration["start_sec1"]:.6f}",
-            "-i",
-            video1,
+            *input_args(video1, chapters1),
             "-hwaccel",
             "cuda",
             "-hwaccel_output_format",
@@ -88,63 +132,56 @@ def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, c
             "0x0x332x332",
             "-ss",
             f"{calibration["start_sec2"]:.6f}",
-            "-i",
-            video2,
+            *input_args(video2, chapters2),
             "-i" if mask else None,
             mask if mask else None,
-            "-shortest", # stop encoding when the shortest input ends
-            "-t" if preview else None,
-            "15" if preview else None,
+            *map_inputs,
+            *recording_inputs,
             "-filter_complex",
-            filter_complex, 
-            "-metadata",
-            f"timecode={tc}",  # Set new timecode
-            "-c:a:0",
-            "copy",
-            "-c:v",
-            "hevc_nvenc",
-            "-b:v",
-            "200M", # TODO tune this
-            output_file
+            filter_complex
         ]
 
     else:
 
-        filter_complex = ""
-        if dewarp:
-            filter_complex = f"[0:v] crop=4648:4648,scale=4096:4096 [l]; [1:v] crop=4648:4648,scale=4096:4096 [r]; [l] {v1_rotate} [lr]; [r] {v2_rotate} [rr]; [lr] {v1_crop},{v1_pad} [ls]; [rr] {v2_crop},{v2_pad} [rs]; [ls][rs] hstack=inputs=2 [stack]; [stack] v360=fisheye:hequirect:ih_fov=177:iv_fov=177:in_stereo=sbs:out_stereo=sbs [dewarp]"
-            if mask is not None:
-                filter_complex += f"; [dewarp][2:v] overlay,format=yuv420p10"
-        if not dewarp:
-            filter_complex = f"[0:v] crop=4648:4648,scale=4096:4096 [l]; [1:v] crop=4648:4648,scale=4096:4096 [r]; [l] {v1_rotate} [lr]; [r] {v2_rotate} [rr]; [lr] {v1_crop},{v1_pad} [ls]; [rr] {v2_crop},{v2_pad} [rs]; [ls][rs] hstack=inputs=2 [out]"
-
-
         cmd = [
             "ffmpeg",
             "-ss",
             f"{calibration["start_sec1"]:.6f}",
-            "-i",
-            video1,
+            *input_args(video1, chapters1),
             "-ss",
             f"{calibration["start_sec2"]:.6f}",
-            "-i",
-            video2,
+            *input_args(video2, chapters2),
             "-i" if mask else None,
             mask if mask else None,
+            *map_inputs,
+            *recording_inputs,
+            "-filter_complex",
+            filter_complex
+        ]
+
+    # the output options apply to every output
+    for i, (profile, filename) in enumerate(outputs):
+        image = profile == "thumbnails"
+        if image:
+            os.makedirs(filename, exist_ok=True)
+            filename = os.path.join(filename, "%04d.jpg")
+
+        cmd += [
+            "-map" if branches else None,
+            f"[out{i}]" if branches else None,
+            *(audio_maps if branches and audio and not image else []),
             "-shortest", # stop encoding when the shortest input ends
             "-t" if preview else None,
             "15" if preview else None,
-            "-filter_complex",
-            filter_complex,
-            "-metadata",
-            f"timecode={tc}",  # Set new timecode
-            "-c:a:0",
-            "copy",
-            "-c:v",
-            "libx265",
-            "-crf",
-            "18", # default is 28
-            output_file
+            "-frames:v" if frames else None,
+            str(frames) if frames else None,
+            "-an" if not audio and not branches else None,
+            "-metadata" if not image else None,
+            f"timecode={tc}" if not image else None,  # Set new timecode
+            "-metadata" if fingerprint and not image else None,
+            f"comment={FINGERPRINT_PREFIX}{fingerprint}" if fingerprint and not image else None,
+            *profile_args(profile, cuda, threads, bool(recording_inputs)),
+            filename
         ]
 
         # remove all None values from the list
@@ -154,14 +191,335 @@ def process_videos(video1, video2, calibration, output_file, tc, dewarp, mask, c
 
     try:
         print(f"Processing {video1} and {video2} -> {output_file}")
-        subprocess.run(cmd, check=True)
+        run_ffmpeg(cmd, telemetry, label)
         print(f"Successfully processed {output_file}\n")
+        return True
     except subprocess.CalledProcessError as e:
         print(f"Error processing {video1} and {video2}: {e.stderr}")
-        sys.exit(1)
+        return False
+
+def plan_segments(calibration, chapters1, chapters2, duration, frame_rate, count, preview, index_path):
+    """
+    Splits the synced timeline of a pair into segments that can be encoded independently.
+    The cuts are moved to the nearest keyframe of the left video, so that its decoder doesn't have to decode
+    (and throw away) the frames in front of a cut.
+
+    :param duration: Length of the synced timeline in seconds.
+    :param count: Number of segments.
+    :param index_path: Path to the SQLite index with the packet index of the chapters.
+    :return: List of (first frame, number of frames, start_sec1, start_sec2) tuples, the last segment runs to the end
+             (None) unless preview is set.
+    """
+
+    fps = Fraction(frame_rate)
+    total = int(duration * fps)
+    if count <= 1 or total < count:
+        return [(0, None, calibration["start_sec1"], calibration["start_sec2"])]
+
+    indexes = get_packet_indexes(chapters1 + chapters2, index_path)
+    takes = (take_index(indexes, chapters1), take_index(indexes, chapters2))
+
+    keyframes = []
+    if takes[0] is not None:
+        keyframes = [int(keyframe) - calibration["start_frame1"] for keyframe in takes[0][1]]
+        keyframes = [keyframe for keyframe in keyframes if 0 < keyframe < total]
+
+    cuts = set()
+    for i in range(1, count):
+        cut = total * i // count
+        if keyframes:
+            cut = min(keyframes, key=lambda keyframe: abs(keyframe - cut))
+        cuts.add(cut)
+    cuts = sorted(cuts)
+
+    def seek(eye, first):
+        # a drifting eye is that many frames further ahead (or behind) at the cut
+        frame = calibration[f"start_frame{eye}"] + first + round(first * calibration.get(f"drift{eye}", 0.0))
+        if takes[eye - 1] is None:
+            return float((frame - Fraction(1, 2)) / fps) if frame > 0 else 0.0
+        return frame_seek_time(takes[eye - 1][0], frame)
+
+    starts = [0] + cuts
+    lengths = [end - start for start, end in zip(starts, cuts)] + [total - starts[-1] if preview else None]
+    return [(first, frames, seek(1, first), seek(2, first)) for first, frames in zip(starts, lengths)]
+
+def process_segments(video1, video2, calibration, output_file, tc, dewarp, mask, preview, threads, chapters1, chapters2, maps, segments, frame_rate, fingerprint=None, telemetry=None, recording=None):
+    """
+    Encodes the segments of a pair in parallel (libx265 only), and joins them with a stream copy.
+    Each segment seeks both eyes to its first frame, the audio and timecode are added when joining.
+    Segments that are already complete from an interrupted run (same fingerprint) are not encoded again.
+
+    :return: True if all segments and the join succeeded, False otherwise.
+    """
+
+    fps = Fraction(frame_rate)
+    parts_dir = f"{output_file}.parts"
+    os.makedirs(parts_dir, exist_ok=True)
+
+    # split the thread budget over the segments, so that they don't oversubscribe the cores
+    part_threads = max(1, (threads or os.cpu_count() or 1) // len(segments))
+
+    jobs = []
+    for i, (first, frames, start_sec1, start_sec2) in enumerate(segments):
+        # both eyes start on exactly the first frame of the segment, see plan_segments()
+        part_calibration = dict(calibration, start_sec1=start_sec1, start_sec2=start_sec2)
+
+        part_file = os.path.join(parts_dir, f"part{i:03d}.mp4")
+        jobs.append((part_calibration, part_file, frames))
+
+    print(f"Encoding {video1} and {video2} in {len(segments)} segments: {', '.join(str(segment[0]) for segment in segments)}")
+
+    # the last segment runs to the end, its length is unknown
+    pending = [job for job in jobs if fingerprint is None or not output_complete(job[1], fingerprint, float(job[2] / fps) if job[2] else None)]
+    if len(pending) < len(jobs):
+        print(f"Reusing {len(jobs) - len(pending)} complete segment(s) in {parts_dir}")
+    for _, part_file, _ in pending:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+        futures = [
+            executor.submit(process_videos, video1, video2, part_calibration, part_file, tc, dewarp, mask, False, False, part_threads, chapters1, chapters2, maps, frame_rate=frame_rate, frames=frames, audio=False, fingerprint=fingerprint, telemetry=telemetry, label=os.path.splitext(os.path.basename(part_file))[0])
+            for part_calibration, part_file, frames in pending
+        ]
+        results = [future.result() for future in futures]
+
+    if not all(results):
+        print(f"Error processing {video1} and {video2}: {results.count(False)} segment(s) failed, keeping {parts_dir}")
+        return False
+
+    parts = [part_file for _, part_file, _ in jobs]
+    cmd = [
+        "ffmpeg",
+        *input_args(parts[0], parts),
+        "-ss",
+        f"{calibration["start_sec1"]:.6f}",
+        *input_args(video1, chapters1),
+        *(recording_args(*recording) if recording else []),
+        "-map",
+        "0:v",
+        "-map" if recording else None,
+        "2:a:0" if recording else None,
+        "-map",
+        "1:a:0?",
+        "-shortest",
+        "-t" if preview else None,
+        "15" if preview else None,
+        "-metadata",
+        f"timecode={tc}",
+        "-metadata" if fingerprint else None,
+        f"comment={FINGERPRINT_PREFIX}{fingerprint}" if fingerprint else None,
+        "-c",
+        "copy",
+        *(audio_args(True) if recording else []),
+        output_file
+    ]
+    cmd = list(filter(None, cmd))
+
+    print(" ".join(cmd))
+
+    try:
+        run_ffmpeg(cmd, telemetry, "join", counted=False)
+    except subprocess.CalledProcessError as e:
+        print(f"Error joining the segments of {video1} and {video2}: {e.stderr}")
+        return False
+
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    print(f"Successfully processed {output_file}\n")
+    return True
+
+def partial_file(output_file, fingerprint):
+    """
+    Returns the file a job is rendered into, it is only renamed to the output file when it is complete.
+    """
+
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.{fingerprint}.partial{ext}"
+
+def remove_partials(output_file, keep=None):
+    """
+    Removes the leftovers of interrupted runs of an output (partial files and segments), except the ones of keep.
+    """
+
+    root, ext = os.path.splitext(output_file)
+    for leftover in glob.glob(f"{glob.escape(root)}.*.partial{ext}*"):
+        if keep is not None and leftover.startswith(keep):
+            continue
+        print(f"Removing {leftover} of an interrupted run")
+        if os.path.isdir(leftover):
+            shutil.rmtree(leftover, ignore_errors=True)
+        else:
+            os.remove(leftover)
+
+def job_complete(job):
+    """
+    Checks if the output of a job and the outputs of its additional profiles are complete (see output_complete).
+    The thumbnails only need to exist, their directory is only renamed into place when the job succeeded.
+    """
+
+    if not output_complete(job["output_file"], job["fingerprint"], job["duration"]):
+        return False
+
+    for profile in job["flags"].get("profiles", []):
+        filename = profile_file(job["output_file"], profile)
+        if profile == "thumbnails":
+            if not os.path.isdir(filename):
+                return False
+        elif not output_complete(filename, job["fingerprint"], job["duration"]):
+            return False
+
+    return True
+
+def pending_jobs(jobs, force=False):
+    """
+    Returns the jobs that need to be rendered: the output is missing, incomplete or was rendered with a different
+    fingerprint (i.e. the pair was recalibrated or the options changed).
+    """
+
+    if force:
+        return jobs
+
+    pending = []
+    for job in jobs:
+        if job_complete(job):
+            print(f"Skipping {job['output_file']}, it is up to date.")
+        else:
+            pending.append(job)
+    return pending
+
+def run_job(job, dewarp, mask, cuda, preview, threads=None, engine="ffmpeg", map_cache=None, reporter=None, metrics=None):
+    """
+    Processes a single job with the given engine.
+    The job is rendered into a partial file that replaces the output when it is complete, so that an interrupted
+    run never leaves a truncated output behind. Complete segments of an interrupted run are reused.
+
+    :param reporter: Reporter that prints the progress of the job (see telemetry.py), or None.
+    :param metrics: MetricsLog to write the metrics of the job to, or None.
+    :return: True if the job succeeded, False otherwise.
+    """
+
+    telemetry = JobTelemetry(os.path.splitext(os.path.basename(job["output_file"]))[0], job["duration"])
+    if reporter is not None:
+        reporter.add(telemetry)
+
+    output_file = partial_file(job["output_file"], job["fingerprint"])
+    remove_partials(job["output_file"], keep=output_file)
+
+    # a single stream can't be resumed, only its segments
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    # the additional profiles are rendered into partial files as well
+    profiles = []
+    for profile in job["flags"].get("profiles", []):
+        final_file = profile_file(job["output_file"], profile)
+        profile_partial = partial_file(final_file, job["fingerprint"])
+        remove_partials(final_file)
+        profiles.append((profile, profile_partial, final_file))
+
+    if engine == "python":
+        success = process_videos_python(job["video1"], job["video2"], job["calibration"], output_file, job["tc"], dewarp, mask, cuda, preview, job["frame_rate"], map_cache, threads, job["chapters1"], job["chapters2"], job["fingerprint"], telemetry)
+    else:
+        success = process_videos(job["video1"], job["video2"], job["calibration"], output_file, job["tc"], dewarp, mask, cuda, preview, threads, job["chapters1"], job["chapters2"], job["maps"], job["segments"], job["frame_rate"], fingerprint=job["fingerprint"], telemetry=telemetry, profiles=[(profile, profile_partial) for profile, profile_partial, _ in profiles], recording=(job["recording"][0], job["recording_offset"]) if job.get("recording_offset") is not None else None)
+
+    if success:
+        os.replace(output_file, job["output_file"])
+        for profile, profile_partial, final_file in profiles:
+            if os.path.isdir(final_file):
+                shutil.rmtree(final_file)
+            os.replace(profile_partial, final_file)
+
+    if reporter is not None:
+        reporter.finish(telemetry)
+    if metrics is not None:
+        record = telemetry.record(success, job["output_file"])
+        record["engine"] = engine
+        record["flags"] = job["flags"]
+        if "drift2" in job["calibration"]:
+            record["drift_ppm"] = job["calibration"]["drift2"] * 1e6
+        metrics.write(record)
+
+    return success
+
+def run_jobs(jobs, num_jobs, max_sessions, dewarp, mask, cuda, preview, engine="ffmpeg", map_cache=None, metrics=None):
+    """
+    Runs the jobs concurrently, largest first, and prints a progress/ETA summary.
+    A failing job is reported but does not stop the rest of the batch.
+
+    :param jobs: List of job dictionaries as built in build_jobs().
+    :param num_jobs: Number of pairs to process at the same time.
+    :param max_sessions: Maximum number of concurrent NVENC sessions (CUDA only).
+    :param engine: "ffmpeg" to process in a single filter graph, "python" to remap in a Python pipeline (see engine.py).
+    :param map_cache: Directory to cache the remap arrays in (python engine only).
+    :param metrics: MetricsLog to write the metrics of every job to, or None.
+    :return: List of jobs that failed.
+    """
+
+    # per-backend concurrency cap: consumer GPUs only allow a handful of NVENC sessions,
+    # while libx265 gets a share of the cores so that concurrent encoders don't fight over them
+    workers = max(1, num_jobs)
+    threads = None
+    if cuda:
+        workers = min(workers, max_sessions)
+    elif workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # start with the longest pairs, so that a long pair doesn't end up running alone at the end
+    jobs = sorted(jobs, key=lambda job: job["duration"], reverse=True)
+    total_duration = sum(job["duration"] for job in jobs)
+
+    print(f"Processing {len(jobs)} pair(s) ({format_duration(total_duration)} of footage) with {workers} concurrent job(s).")
+
+    failed = []
+    done_duration = 0.0
+    start = time.monotonic()
+
+    reporter = Reporter(total_duration)
+    reporter.start()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            futures = {
+                executor.submit(run_job, job, dewarp, mask, cuda, preview, threads, engine, map_cache, reporter, metrics): job
+                for job in jobs
+            }
+
+            for i, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    success = future.result()
+                except Exception as e:
+                    print(f"Error processing {job['video1']} and {job['video2']}: {e}")
+                    success = False
+
+                if not success:
+                    failed.append(job)
+
+                done_duration += job["duration"]
+                elapsed = time.monotonic() - start
+                eta = elapsed / done_duration * (total_duration - done_duration) if done_duration > 0 else 0.0
+                print(f"[{i}/{len(jobs)}] {'done' if success else 'FAILED'}: {job['output_file']} --- elapsed: {format_duration(elapsed)}, ETA: {format_duration(eta)}")
+        except KeyboardInterrupt:
+            # the running ffmpeg processes got the SIGINT as well, the pairs that haven't started yet are dropped
+            print("Interrupted, waiting for the running jobs to stop...")
+            executor.shutdown(wait=True, cancel_futures=True)
+            reporter.stop()
+            raise
+
+    reporter.stop()
+
+    elapsed = time.monotonic() - start
+    print(f"Processed {len(jobs) - len(failed)}/{len(jobs)} pair(s) in {format_duration(elapsed)}.")
+    for job in failed:
+        print(f"Failed: {job['video1']} and {job['video2']} -> {job['output_file']}")
+
+    return failed
+
+def add_job_arguments(parser):
+    """
+    Adds the arguments that determine the jobs, shared by the direct run and plan.
+    """
 
-def main():
-    parser = argparse.ArgumentParser()
     parser.add_argument("ingress", help="the path to ingress from")
     parser.add_argument("egress", help="the path to egress to")
     parser.add_argument("-o", "--organize", help="create a folder structure of year-mm-dd/ at the egress", action="store_true", default=True)
@@ -170,25 +528,180 @@ def main():
     parser.add_argument("-p", "--preview", help="generate only a preview (15s)", action="store_true", default=False)
     parser.add_argument("--cuda", help="use CUDA accelerated operations", action="store_true", default=True)
     parser.add_argument('--no-cuda', dest='cuda', action='store_false')
+    parser.add_argument("--refresh-index", help="re-probe all videos instead of using the metadata index", action="store_true")
+    parser.add_argument("--remap", help="faster: apply rotation, alignment and dewarp with a single precomputed nearest neighbour remap per eye (lower quality than the v360 filters)", action="store_true")
+    parser.add_argument("--segments", help="split each pair into this many segments that are encoded in parallel and joined losslessly (libx265 only)", type=int, default=1)
+    parser.add_argument("--engine", help="process in a single ffmpeg filter graph, or decode to raw frames and remap them in a Python process pool", choices=["ffmpeg", "python"], default="ffmpeg")
+    parser.add_argument("--profiles", help="additional outputs rendered from the same decode: a 2K per eye H.264 proxy and/or poster thumbnails (ffmpeg engine only)", nargs="+", choices=[profile for profile in PROFILES if profile != "master"], default=[])
+    parser.add_argument("--audio", help="folder with the recordings (WAV) of an external audio recorder, matched to the pairs by time and muxed as the first audio track (ffmpeg engine only)", default=None)
+    parser.add_argument("--drift", help="measure the clock drift between the cameras of long takes from their audio and correct it on the right eye", action="store_true")
+    parser.add_argument("-f", "--force", help="render all pairs, even if their output is up to date", action="store_true")
 
-    if len(sys.argv) < 2:
-        parser.print_help()
+def job_flags(args):
+    """
+    Returns the options of a run that each job is processed with.
+    """
+
+    return {
+        "dewarp": args.dewarp,
+        "mask": args.mask,
+        "cuda": args.cuda,
+        "preview": args.preview,
+        "remap": args.remap,
+        "segments": args.segments,
+        "engine": args.engine,
+        "profiles": args.profiles,
+        "drift": args.drift,
+        "audio": args.audio,
+        "force": args.force
+    }
+
+def prepare_job(job, map_cache):
+    """
+    Adds the parts of a job that depend on the host that processes it: the remap files in its map cache and the segments.
+    """
+
+    flags = job["flags"]
+    calibration = job["calibration"]
+
+    # the segments are cut at the drift corrected frames
+    if flags.get("drift") and "drift2" not in calibration:
+        measure_drift(job)
+
+    if job.get("recording") and "recording_offset" not in job:
+        align_recording(job)
+
+    # the additional profiles need the whole timeline in a single process
+    job["segments"] = plan_segments(calibration, job["chapters1"], job["chapters2"], job["duration"], job["frame_rate"], flags["segments"], flags["preview"], job["index"]) if flags["segments"] > 1 and not flags["cuda"] and flags["engine"] == "ffmpeg" and not flags.get("profiles") else None
+    job["maps"] = remap_files(calibration, 1, flags["dewarp"], map_cache) + remap_files(calibration, 2, flags["dewarp"], map_cache) if flags["remap"] else None
+
+    return job
+
+def measure_drift(job):
+    """
+    Measures the clock drift between the cameras of a long take from its audio (see audio.estimate_drift), and sets
+    the correction of the right eye (drift2 of the calibration) if the eyes drift apart by half a frame or more.
+    """
+
+    calibration = job["calibration"]
+    calibration["drift2"] = 0.0
+    if job["duration"] < DRIFT_MIN_DURATION:
+        return
+
+    try:
+        result = estimate_drift(job["video1"], job["video2"], calibration["start_sec1"], calibration["start_sec2"], job["duration"], job["chapters1"], job["chapters2"])
+    except subprocess.CalledProcessError as e:
+        print(f"Error measuring the drift of {job['video1']} and {job['video2']}: {e}")
+        return
+
+    if result is None:
+        print(f"Could not measure the drift of {job['video1']} and {job['video2']}, not enough audio matched.")
+        return
+
+    drift, offset, windows = result
+    frames = drift * job["duration"] * float(Fraction(job["frame_rate"]))
+    print(f"Drift of {job['video1']} and {job['video2']}: {drift * 1e6:.1f} ppm, {frames:+.2f} frame(s) at the end, offset at the start: {offset * 1000:.1f} ms ({windows} windows)")
+    if abs(frames) >= 0.5:
+        calibration["drift2"] = drift
+
+def align_recording(job):
+    """
+    Finds the position of the synced take in its recording (see recorder.estimate_recording_offset), from the position
+    the metadata gives. The recording is not used if the audio doesn't match well enough.
+    """
+
+    calibration = job["calibration"]
+    recording, recording_start = job["recording"]
+    job["recording_offset"] = None
+
+    approximate = job["start"] - recording_start
+    try:
+        result = estimate_recording_offset(job["video1"], job["chapters1"], calibration["start_sec1"], recording, approximate)
+    except subprocess.CalledProcessError as e:
+        print(f"Error aligning {recording} to {job['video1']}: {e}")
+        return
+
+    if result is None or result[1] < RECORDER_MIN_CONFIDENCE:
+        print(f"{recording} doesn't match the audio of {job['video1']} reliably{f' (confidence: {result[1]:.2f})' if result else ''}, using the audio of the camera (re-render with --force once it is fixed).")
+        return
+
+    offset, confidence = result
+    print(f"{job['video1']} and {job['video2']} start at {offset:.3f}s of {recording} ({offset - approximate:+.3f}s from the metadata, confidence: {confidence:.2f})")
+    job["recording_offset"] = offset
+
+def set_start_times(jobs):
+    """
+    Sets the seek times (start_sec) of both eyes of all jobs from the packet index of their takes, so that every eye
+    starts on exactly its calibrated start frame, at the actual timestamps of the file.
+    """
+
+    # only the takes that don't start on their first frame need to be indexed, all jobs share the index of the ingress
+    chapters = [chapter for job in jobs for eye in (1, 2) if job["calibration"][f"start_frame{eye}"] > 0 for chapter in job[f"chapters{eye}"]]
+    indexes = get_packet_indexes(chapters, jobs[0]["index"]) if chapters else {}
+
+    for job in jobs:
+        calibration = job["calibration"]
+        for eye in (1, 2):
+            start_frame = calibration[f"start_frame{eye}"]
+            if start_frame <= 0:
+                calibration[f"start_sec{eye}"] = 0.0
+                continue
+
+            index = take_index(indexes, job[f"chapters{eye}"])
+            if index is None:
+                # seek half a frame early at the nominal frame rate, ffmpeg starts on the next frame
+                print(f"No packet index for {job[f'video{eye}']}, seeking at the nominal frame rate.")
+                calibration[f"start_sec{eye}"] = float((start_frame - Fraction(1, 2)) / Fraction(job["frame_rate"]))
+            else:
+                calibration[f"start_sec{eye}"] = frame_seek_time(index[0], start_frame)
+
+        print(f"{job['video1']} and {job['video2']} start at frame {calibration['start_frame1']} ({calibration['start_sec1']:.6f}s) and {calibration['start_frame2']} ({calibration['start_sec2']:.6f}s)")
+
+def build_cli_jobs(args):
+    """
+    Builds the jobs of all videos in the ingress for the command line, see build_jobs().
+    Invalid input is printed and exits, instead of raising PipelineError.
+    """
+
+    try:
+        return build_jobs(args)
+    except PipelineError as e:
+        print(e)
         sys.exit(1)
 
-    args = parser.parse_args()
+def build_jobs(args, videos=None):
+    """
+    Matches the videos in the ingress and resolves every pair into a job: inputs, calibration, flags and output file.
+
+    :param args: Parsed arguments, see add_job_arguments().
+    :param videos: The videos to match, None takes all videos in the ingress.
+    :return: List of job dictionaries.
+    :raises PipelineError: For a missing ingress, too few videos, conflicting options or videos that can't be probed.
+    """
 
     ingress = args.ingress
     egress = args.egress
     organize = args.organize
     dewarp = args.dewarp
-    cuda = args.cuda
     preview = args.preview
     mask = args.mask
 
+    if args.drift and args.preview:
+        print("The drift of a 15s preview can't be measured, rendering the preview without drift correction.")
+        args.drift = False
+
+    if args.audio is not None and args.engine == "python":
+        raise PipelineError("The recordings of an external recorder are only supported by the ffmpeg engine.")
+
+    if args.audio is not None and not os.path.isdir(args.audio):
+        raise PipelineError(f"The audio directory {args.audio} does not exist.")
+
+    if args.profiles and args.engine == "python":
+        raise PipelineError("The additional profiles are only supported by the ffmpeg engine.")
+
     # check if the ingress directory exists
     if not os.path.exists(ingress):
-        print(f"The ingress directory {ingress} does not exist.")
-        sys.exit(1)
+        raise PipelineError(f"The ingress directory {ingress} does not exist.")
     
     # check if the egress directory exists, or create it
     if not os.path.exists(egress):
@@ -196,23 +709,26 @@ def main():
         print(f"The egress directory {egress} does not exist. Created it.")
 
     # Get all video files in the ingress directory
-    videos = glob.glob(os.path.join(ingress, "*/*.mp4"))
+    if videos is None:
+        videos = glob.glob(os.path.join(ingress, VIDEO_PATTERN))
 
     if len(videos) < 2:
-        print("Please provide at least 2 video files for synchronization.")
-        sys.exit(1)
+        raise PipelineError("Please provide at least 2 video files for synchronization.")
 
-    video_pairs = match_videos(videos, ingress)
+    video_pairs = match_videos(videos, ingress, args.refresh_index)
 
     print(f"Found {len(video_pairs)} pair(s) of videos for synchronization.")
 
-    # for each pair of videos, clip them
+    recordings = get_recordings(args.audio, os.path.join(ingress, INDEX_FILENAME)) if args.audio is not None else []
+
+    jobs = []
+    # for each pair of videos, determine how to clip them
     for video_pair in video_pairs:
 
         # Determine overlapping timecode interval
         (video1, data1), (video2, data2) = video_pair
 
-        print(f"Processing video pair: {video1} and {video2}")
+        print(f"Preparing video pair: {video1} and {video2}")
 
         start_tc1 = data1["start_timecode"]
         start_tc2 = data2["start_timecode"]
@@ -241,7 +757,6 @@ def main():
             with open(calibration_file1, "r") as f:
                 calibration1 = yaml.safe_load(f)
                 calibration["start_frame1"] = calibration1["start_frame"]
-                calibration["start_sec1"] = Timecode('29.97', frames=calibration["start_frame1"]+1).to_realtime(True) # will be obsolete with ffmpeg bindings
                 calibration["offset1_x"] = calibration1["x_offset"]
                 calibration["offset1_y"] = calibration1["y_offset"]
                 calibration["rotate_global1"] = calibration1["rotation_global"] if "rotation_global" in calibration1 else 0.0 # backwards compatibility
@@ -249,24 +764,23 @@ def main():
             with open(calibration_file2, "r") as f:
                 calibration2 = yaml.safe_load(f)
                 calibration["start_frame2"] = calibration2["start_frame"]
-                calibration["start_sec2"] = Timecode('29.97', frames=calibration["start_frame2"]+1).to_realtime(True) # will be obsolete with ffmpeg bindings
                 calibration["offset2_x"] = calibration2["x_offset"]
                 calibration["offset2_y"] = calibration2["y_offset"]
                 calibration["rotate_global2"] = calibration2["rotation_global"] if "rotation_global" in calibration2 else 0.0 # backwards compatibility
                 calibration["rotate_local2"] = calibration2["rotation_local"] if "rotation_local" in calibration2 else 0.0 # backwards compatibility
 
-            print(f"Start times from calibration files: left: {calibration["start_frame1"]} - {calibration["start_sec1"]:.6f} and right: {calibration["start_frame1"]} - {calibration["start_sec2"]:.6f}")
+            print(f"Start frames from calibration files: left: {calibration["start_frame1"]} and right: {calibration["start_frame2"]}")
 
         else:
             # Determine the overlapping interval
             if start_tc1 > start_tc2:
                 start_difference = start_tc1 - start_tc2
-                calibration["start_sec2"] = start_difference.to_realtime(True)
+                calibration["start_frame2"] = start_difference.frames # same as calibrate.py
             elif start_tc2 > start_tc1:
                 start_difference = start_tc2 - start_tc1
-                calibration["start_sec1"] = start_difference.to_realtime(True)
+                calibration["start_frame1"] = start_difference.frames
             else:
-                start_difference = Timecode('29.97', 0)
+                start_difference = timecode.Timecode('29.97', 0)
 
             if start_difference.frames > 1:
                 # relative start frame
@@ -274,6 +788,7 @@ def main():
             else:
                 print(f"⭐ You got a perfect match! tc: {clip_start_tc} ⭐")
 
+        egress_full = egress
         if organize:
             # Create a folder structure based on creation time
             creation_time = data1["creation_time"]
@@ -291,7 +806,298 @@ def main():
         if mask is not None:
             options += "_mask"
         output_file = os.path.join(egress_full, f"{os.path.splitext(os.path.basename(video1))[0]}_{os.path.splitext(os.path.basename(video2))[0]}{options}.mp4")
-        process_videos(video1, video2, calibration, output_file, clip_start_tc, dewarp, mask, cuda, preview)
+
+        # length of the synced clip, used for scheduling and the ETA
+        fps = Fraction(data1["frame_rate"])
+        duration = min(data1["duration"] - float(calibration["start_frame1"] / fps), data2["duration"] - float(calibration["start_frame2"] / fps))
+        if preview:
+            duration = min(duration, 15.0)
+
+        # the synced take starts with the later camera
+        start = max(data1["start"] + float(calibration["start_frame1"] / fps), data2["start"] + float(calibration["start_frame2"] / fps))
+        recording = match_recording(recordings, start, duration) if recordings else None
+        if recording is not None:
+            print(f"Matched {recording[0]} to {video1} and {video2}")
+        elif args.audio is not None:
+            print(f"No recording in {args.audio} matches {video1} and {video2}, using the audio of the camera.")
+
+        jobs.append({
+            "video1": video1,
+            "video2": video2,
+            "calibration": calibration,
+            "output_file": output_file,
+            "tc": str(clip_start_tc),
+            "chapters1": data1["chapters"],
+            "chapters2": data2["chapters"],
+            "frame_rate": data1["frame_rate"],
+            "index": os.path.join(ingress, INDEX_FILENAME),
+            "flags": job_flags(args),
+            # the segments, additional profiles (and forcing a render) don't change the output, the matched recording does
+            "fingerprint": job_fingerprint(data1["chapters"], data2["chapters"], [calibration_file1, calibration_file2], {**{k: v for k, v in job_flags(args).items() if k not in ("segments", "profiles", "audio", "force")}, **({"recording": recording[0]} if recording else {})}),
+            "duration": max(duration, 0.0),
+            "start": start,
+            "recording": recording[:2] if recording else None
+        })
+
+    set_start_times(jobs)
+
+    return jobs
+
+def plan(argv):
+    """
+    Resolves all jobs and writes them to the manifest of a queue directory, to be processed by workers on any host.
+    """
+
+    parser = argparse.ArgumentParser(prog="sync.py plan", description="write the jobs to a queue directory shared by the workers")
+    add_job_arguments(parser)
+    parser.add_argument("queue", help="the (shared) directory to write the job manifest to")
+    args = parser.parse_args(argv)
+
+    # the workers may run on other hosts, in other working directories
+    args.ingress = os.path.abspath(args.ingress)
+    args.egress = os.path.abspath(args.egress)
+    if args.mask is not None:
+        args.mask = os.path.abspath(args.mask)
+
+    jobs = pending_jobs(build_cli_jobs(args), args.force)
+    for job in jobs:
+        job["id"] = job_id(job["output_file"])
+
+    # the longest pairs are claimed first
+    jobs.sort(key=lambda job: job["duration"], reverse=True)
+
+    write_manifest(args.queue, jobs)
+    print(f"Wrote {len(jobs)} job(s) to {os.path.join(args.queue, MANIFEST_FILENAME)}")
+
+def worker(argv):
+    """
+    Claims and processes jobs from a queue directory until all of them are done.
+    """
+
+    parser = argparse.ArgumentParser(prog="sync.py worker", description="process the jobs of a queue directory, run as many workers on as many hosts as needed")
+    parser.add_argument("queue", help="the (shared) directory with the job manifest")
+    parser.add_argument("--threads", help="thread budget for libx265 and the python engine (default: all cores)", type=int, default=None)
+    parser.add_argument("--lease", help="seconds without a heartbeat before a job of a crashed worker is re-queued", type=float, default=LEASE)
+    parser.add_argument("--poll", help="seconds between checks for jobs claimed by other workers", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--map-cache", help="directory to cache the remap files in", default=os.path.join(os.path.expanduser("~"), ".cache", "dugotovr", "maps"))
+    parser.add_argument("--metrics", help="JSON-lines file to append the metrics of every job to (default: .dugotovr_metrics.jsonl in the queue)", default=None)
+    args = parser.parse_args(argv)
+
+    metrics = MetricsLog(args.metrics or os.path.join(args.queue, METRICS_FILENAME))
+
+    def handler(job):
+        flags = job["flags"]
+        if not flags["force"] and job_complete(job):
+            print(f"Skipping {job['output_file']}, it is up to date.")
+            return True
+        prepare_job(job, args.map_cache)
+
+        reporter = Reporter(job["duration"])
+        reporter.start()
+        try:
+            return run_job(job, flags["dewarp"], flags["mask"], flags["cuda"], flags["preview"], args.threads, flags["engine"], args.map_cache, reporter, metrics)
+        finally:
+            reporter.stop()
+
+    _, failed = run_worker(args.queue, handler, args.lease, args.poll)
+    if failed:
+        sys.exit(1)
+
+def watch_ingress(args, copying=None):
+    """
+    Processes every pair of the ingress as soon as both of its takes are copied.
+    The finished jobs are kept in a state file in the egress, so that a restart doesn't process them again.
+
+    :param args: Parsed arguments, see add_job_arguments() and watch().
+    :param copying: Function that returns True while files are still being copied into the ingress (see ingest()).
+                    None watches until interrupted.
+    :return: Number of jobs that failed.
+    :raises KeyboardInterrupt: When interrupted, once the running jobs have stopped.
+    """
+
+    watcher = FolderWatcher(args.ingress, args.settle)
+    state = WatchState(os.path.join(args.egress, STATE_FILENAME))
+    metrics = MetricsLog(args.metrics or os.path.join(args.egress, METRICS_FILENAME))
+
+    # same concurrency cap as run_jobs()
+    workers = max(1, args.jobs)
+    threads = None
+    if args.cuda:
+        workers = min(workers, args.max_sessions)
+    elif workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    reporter = Reporter(0.0)
+    reporter.start()
+
+    def process(job):
+        success = run_job(job, args.dewarp, args.mask, args.cuda, args.preview, threads, args.engine, args.map_cache, reporter, metrics)
+        if success:
+            state.finish(job)
+        return success
+
+    running = {} # (output file, fingerprint) -> future
+    failed = set()
+    matched = None # the videos (and quiet state) of the last match, it only runs again when they change
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    # checked first, so that the files it copied are all seen by the scan below
+                    done = copying is not None and not copying()
+
+                    for key, future in list(running.items()):
+                        if future.done():
+                            del running[key]
+                            matched = None # a pair that was waiting for this output can go now
+                            if not future.result():
+                                failed.add(key)
+
+                    videos = watcher.scan()
+                    # all chapters are there when the copy is done
+                    quiet = done or watcher.quiet()
+                    if len(videos) >= 2 and (videos, quiet) != matched:
+                        matched = (videos, quiet)
+                        try:
+                            jobs = build_jobs(args, videos)
+                        except PipelineError as e:
+                            # i.e. a file that can't be probed, it is tried again when the ingress changes
+                            print(f"{e} Could not match the videos in the ingress, trying again when it changes.")
+                            jobs = []
+
+                        for job in jobs:
+                            key = (job["output_file"], job["fingerprint"])
+                            if key in running or key in failed or state.is_done(job):
+                                continue
+                            if any(output_file == job["output_file"] for output_file, _ in running):
+                                print(f"Waiting for the running job of {job['output_file']} to finish.")
+                                continue
+                            if not take_complete(job["chapters1"], quiet) or not take_complete(job["chapters2"], quiet):
+                                print(f"Waiting for more chapters of {job['video1']} and {job['video2']}.")
+                                continue
+                            if not args.force and job_complete(job):
+                                state.finish(job)
+                                continue
+
+                            prepare_job(job, args.map_cache)
+                            reporter.total_duration += job["duration"]
+                            print(f"Queued {job['video1']} and {job['video2']} ({format_duration(job['duration'])})")
+                            running[key] = executor.submit(process, job)
+
+                    # done when the copy is and the last match saw all of it
+                    if done and not running and (matched is None or matched[1]):
+                        break
+
+                    watcher.wait(max(1.0, args.settle / 2))
+            except KeyboardInterrupt:
+                # the running ffmpeg processes got the SIGINT as well, the queued pairs are dropped
+                print("Stopped watching, waiting for the running jobs to stop.")
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        reporter.stop()
+
+    return len(failed)
+
+def add_watch_arguments(parser):
+    """
+    Adds the arguments of the processing side of the watch and ingest modes.
+    """
+
+    add_job_arguments(parser)
+    parser.add_argument("-j", "--jobs", help="number of pairs to process concurrently", type=int, default=1)
+    parser.add_argument("--max-sessions", help="maximum number of concurrent NVENC sessions when using CUDA", type=int, default=3)
+    parser.add_argument("--map-cache", help="directory to cache the remap files in", default=os.path.join(os.path.expanduser("~"), ".cache", "dugotovr", "maps"))
+    parser.add_argument("--metrics", help="JSON-lines file to append the metrics of every job to (default: .dugotovr_metrics.jsonl in the egress)", default=None)
+    parser.add_argument("--settle", help="seconds a file has to keep its size before it counts as copied, if inotify doesn't report it", type=float, default=SETTLE)
+
+def watch(argv):
+    """
+    Watches the ingress and processes every pair as soon as both of its takes are copied, until it is interrupted.
+    """
+
+    parser = argparse.ArgumentParser(prog="sync.py watch", description="process the pairs of the ingress as soon as both takes are copied, until interrupted")
+    add_watch_arguments(parser)
+    args = parser.parse_args(argv)
+
+    print(f"Watching {args.ingress} for new pairs, press Ctrl+C to stop.")
+    try:
+        watch_ingress(args)
+    except KeyboardInterrupt:
+        pass
+
+def ingest(argv):
+    """
+    Copies the footage off the left and right card concurrently into the ingress, verifying every file, and processes
+    every pair as soon as both of its takes are copied.
+    """
+
+    parser = argparse.ArgumentParser(prog="sync.py ingest", description="offload the left and right card into the ingress and process the pairs while copying")
+    parser.add_argument("left_card", help="the path of the left card (or a copy of it)")
+    parser.add_argument("right_card", help="the path of the right card (or a copy of it)")
+    add_watch_arguments(parser)
+    parser.add_argument("--no-verify", dest="verify", help="don't read the copies back to verify their checksums", action="store_false")
+    parser.add_argument("--copy-only", help="only copy the cards, don't process the pairs", action="store_true")
+    args = parser.parse_args(argv)
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        copy = executor.submit(offload, {"left": args.left_card, "right": args.right_card}, args.ingress, args.verify, stop)
+        try:
+            failed_jobs = 0 if args.copy_only else watch_ingress(args, lambda: not copy.done())
+            failed_copies = copy.result()
+        except KeyboardInterrupt:
+            print("Stopped, finishing the files that are being copied (the rest is copied when ingest runs again).")
+            stop.set()
+            copy.result()
+            sys.exit(1)
+
+    if failed_copies:
+        print(f"{len(failed_copies)} video(s) could not be copied: {', '.join(failed_copies)}")
+    if failed_copies or failed_jobs:
+        sys.exit(1)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "plan":
+        plan(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        watch(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "ingest":
+        ingest(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(epilog="use 'sync.py plan' and 'sync.py worker' to split the work over several processes or hosts, 'sync.py watch' or 'sync.py ingest' to process the pairs while the cards are copied")
+    add_job_arguments(parser)
+    parser.add_argument("-j", "--jobs", help="number of pairs to process concurrently (default: 1, with --triage up to 8)", type=int, default=None)
+    parser.add_argument("--max-sessions", help="maximum number of concurrent NVENC sessions when using CUDA", type=int, default=3)
+    parser.add_argument("--map-cache", help="directory to cache the remap files in", default=os.path.join(os.path.expanduser("~"), ".cache", "dugotovr", "maps"))
+    parser.add_argument("--metrics", help="JSON-lines file to append the metrics of every job to (default: .dugotovr_metrics.jsonl in the egress)", default=None)
+    parser.add_argument("-t", "--triage", help="only render low resolution proxies from the keyframes, a contact sheet and an HTML index into egress/triage", action="store_true")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+
+    if args.triage:
+        failed = triage(build_cli_jobs(args), args.egress, args.dewarp, args.jobs or min(TRIAGE_JOBS, os.cpu_count() or 1))
+        if failed:
+            sys.exit(1)
+        return
+
+    jobs = [prepare_job(job, args.map_cache) for job in pending_jobs(build_cli_jobs(args), args.force)]
+
+    metrics = MetricsLog(args.metrics or os.path.join(args.egress, METRICS_FILENAME))
+    failed = run_jobs(jobs, args.jobs or 1, args.max_sessions, args.dewarp, args.mask, args.cuda, args.preview, args.engine, args.map_cache, metrics)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+from collections import deque
+from datetime import timedelta
+
+# name of the metrics log that is kept in the egress (or queue) directory
+METRICS_FILENAME = ".dugotovr_metrics.jsonl"
+
+# seconds between progress reports
+REPORT_INTERVAL = 10.0
+
+# number of stderr lines of an ffmpeg run that are kept for error reports
+STDERR_LINES = 40
+
+def format_duration(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+class Task:
+    """
+    Progress of a single ffmpeg process, as reported on its -progress stream.
+    """
+
+    def __init__(self, label, counted=True):
+        self.label = label
+        self.counted = counted # False for steps that don't process frames of the timeline again, i.e. joining segments
+        self.frame = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.out_time = 0.0
+        self.total_size = 0
+        self.peak_rss = None
+        self.finished = False
+
+    def update(self, values):
+        """
+        Updates the task from a block of key=value pairs of the -progress stream.
+        """
+
+        def number(key, default, kind=float):
+            try:
+                return kind(values.get(key, "").rstrip("x"))
+            except ValueError:
+                return default
+
+        self.frame = number("frame", self.frame, int)
+        self.fps = number("fps", self.fps)
+        self.speed = number("speed", self.speed)
+        self.out_time = number("out_time_us", self.out_time * 1000000) / 1000000
+        self.total_size = number("total_size", self.total_size, int)
+        self.finished = values.get("progress") == "end"
+
+class JobTelemetry:
+    """
+    Progress and metrics of a job (pair), which can consist of several ffmpeg processes (i.e. segments).
+    """
+
+    def __init__(self, name, duration):
+        self.name = name
+        self.duration = duration
+        self.tasks = []
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+
+    def task(self, label, counted=True):
+        task = Task(label, counted)
+        with self.lock:
+            self.tasks.append(task)
+        return task
+
+    def counted(self):
+        with self.lock:
+            return [task for task in self.tasks if task.counted]
+
+    def out_time(self):
+        return sum(task.out_time for task in self.counted())
+
+    def frames(self):
+        return sum(task.frame for task in self.counted())
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        out_time = self.out_time()
+        fps = self.frames() / elapsed if elapsed > 0 else 0.0
+        speed = out_time / elapsed if elapsed > 0 else 0.0
+        percent = out_time / self.duration * 100 if self.duration > 0 else 0.0
+        eta = (self.duration - out_time) / speed if speed > 0 else 0.0
+        return f"{self.name}: {percent:.0f}%, {self.frames()} frames, {fps:.2f} fps, {speed:.2f}x realtime, ETA: {format_duration(eta)}"
+
+    def record(self, success, output_file):
+        """
+        Returns the metrics of the finished job, for the metrics log.
+        """
+
+        wall_time = time.monotonic() - self.start
+        frames = self.frames()
+        out_time = self.out_time()
+        size = os.path.getsize(output_file) if success and os.path.exists(output_file) else None
+        peaks = [task.peak_rss for task in self.tasks if task.peak_rss is not None]
+
+        return {
+            "time": time.time(),
+            "host": socket.gethostname(),
+            "job": self.name,
+            "output_file": output_file,
+            "success": success,
+            "duration": self.duration,
+            "wall_time": wall_time,
+            "frames": frames,
+            "fps": frames / wall_time if wall_time > 0 else 0.0,
+            "speed": out_time / wall_time if wall_time > 0 else 0.0,
+            "bitrate": size * 8 / out_time if size and out_time > 0 else None,
+            "peak_rss": max(peaks) if peaks else None # of the largest ffmpeg process
+        }
+
+class Reporter(threading.Thread):
+    """
+    Prints the progress of the running jobs and of the whole batch periodically.
+    """
+
+    def __init__(self, total_duration, interval=REPORT_INTERVAL):
+        super().__init__(daemon=True)
+        self.total_duration = total_duration
+        self.interval = interval
+        self.jobs = []
+        self.done_duration = 0.0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.start_time = time.monotonic()
+
+    def add(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    def finish(self, job):
+        with self.lock:
+            self.jobs.remove(job)
+            self.done_duration += job.duration
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                jobs = list(self.jobs)
+                done_duration = self.done_duration
+
+            for job in jobs:
+                print(f"  {job.report()}")
+
+            elapsed = time.monotonic() - self.start_time
+            processed = done_duration + sum(min(job.out_time(), job.duration) for job in jobs)
+            speed = processed / elapsed if elapsed > 0 else 0.0
+            percent = processed / self.total_duration * 100 if self.total_duration > 0 else 0.0
+            eta = (self.total_duration - processed) / speed if speed > 0 else 0.0
+            print(f"Batch: {percent:.0f}% of {format_duration(self.total_duration)}, {speed:.2f}x realtime, elapsed: {format_duration(elapsed)}, ETA: {format_duration(eta)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def wait_with_usage(process):
+    """
+    Waits for a process and returns its exit code and peak RSS in bytes (None where the OS doesn't report it).
+    """
+
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return process.returncode, peak_rss
+
+def run_ffmpeg(cmd, telemetry=None, label="encode", counted=True):
+    """
+    Runs ffmpeg with a -progress stream, reporting to a job's telemetry, and keeps the tail of its stderr.
+    Replaces subprocess.run(cmd, check=True).
+
+    :param cmd: ffmpeg command, starting with "ffmpeg".
+    :param telemetry: JobTelemetry of the job, or None.
+    :param label: Name of the process within the job, i.e. "part003".
+    :param counted: Count the frames of this process towards the progress of the job.
+    :raises subprocess.CalledProcessError: If ffmpeg failed, with the stderr tail in stderr.
+    """
+
+    cmd = [cmd[0], "-nostdin", "-nostats", "-progress", "pipe:1", *cmd[1:]]
+    task = telemetry.task(label, counted) if telemetry is not None else Task(label, counted)
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+
+    tail = deque(maxlen=STDERR_LINES)
+    def read_stderr():
+        for line in process.stderr:
+            tail.append(line.rstrip())
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    values = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        values[key] = value
+        if key == "progress": # end of a block
+            task.update(values)
+            values = {}
+
+    returncode, task.peak_rss = wait_with_usage(process)
+    stderr_thread.join()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr="\n".join(tail))
+
+class MetricsLog:
+    """
+    JSON-lines log of the metrics of every job, appended to across runs (and hosts).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            # a single append, so that the lines of concurrent writers don't interleave
+            with open(self.filename, "a") as f:
+                f.write(line)
@@ -0,0 +1,182 @@
+import os
+import html
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+if __package__:
+    from .util import input_args, lazy_import
+    from .telemetry import format_duration, run_ffmpeg
+else:
+    from util import input_args, lazy_import
+    from telemetry import format_duration, run_ffmpeg
+
+np = lazy_import("numpy")
+cv2 = lazy_import("cv2")
+
+# default number of pairs to triage concurrently (each ffmpeg only decodes keyframes, so it is I/O rather than CPU bound)
+TRIAGE_JOBS = 8
+
+# size of each eye in the proxies
+PROXY_SIZE = 1024
+
+# size of the thumbnails (both eyes)
+THUMB_WIDTH = 512
+THUMB_HEIGHT = 256
+
+# number of keyframes to pick the thumbnail from
+THUMB_FRAMES = 30
+
+# thumbnails per row of the contact sheet
+SHEET_COLUMNS = 4
+CAPTION_HEIGHT = 24
+
+def triage_pair(job, output_dir, dewarp):
+    """
+    Renders a low resolution proxy and a thumbnail of a pair, decoding keyframes only and scaling right away.
+    The calibration is ignored apart from the start times, the proxies are only meant to decide which takes to keep.
+
+    :return: Tuple of the proxy and thumbnail file, or None if ffmpeg failed.
+    """
+
+    name = os.path.splitext(os.path.basename(job["output_file"]))[0]
+    proxy_file = os.path.join(output_dir, f"{name}.mp4")
+    thumb_file = os.path.join(output_dir, f"{name}.jpg")
+
+    eye = f"crop=4648:4648,scale={PROXY_SIZE}:{PROXY_SIZE}"
+    filter_complex = f"[0:v] {eye} [l]; [1:v] {eye} [r]; [l][r] hstack=inputs=2"
+    if dewarp:
+        filter_complex += ",v360=fisheye:hequirect:ih_fov=177:iv_fov=177:in_stereo=sbs:out_stereo=sbs"
+    filter_complex += f",split=2 [proxy][t]; [t] thumbnail={THUMB_FRAMES},scale={THUMB_WIDTH}:{THUMB_HEIGHT} [thumb]"
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-skip_frame", # only decode the keyframes
+        "nokey",
+        "-ss",
+        f"{job['calibration']['start_sec1']:.6f}",
+        *input_args(job["video1"], job["chapters1"]),
+        "-skip_frame",
+        "nokey",
+        "-ss",
+        f"{job['calibration']['start_sec2']:.6f}",
+        *input_args(job["video2"], job["chapters2"]),
+        "-filter_complex",
+        filter_complex,
+        "-map",
+        "[proxy]",
+        "-map",
+        "0:a:0?",
+        "-fps_mode", # keep the keyframes as they are, instead of duplicating them to the full frame rate
+        "vfr",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        "28",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "96k",
+        proxy_file,
+        "-map",
+        "[thumb]",
+        "-frames:v",
+        "1",
+        thumb_file
+    ]
+
+    try:
+        run_ffmpeg(cmd, label="triage")
+    except subprocess.CalledProcessError as e:
+        print(f"Error triaging {job['video1']} and {job['video2']}: {e.stderr}")
+        return None
+
+    return proxy_file, thumb_file
+
+def contact_sheet(entries, filename):
+    """
+    Tiles the thumbnails of all pairs into a single image, with their names below.
+
+    :param entries: List of (name, thumbnail file) tuples.
+    """
+
+    rows = -(-len(entries) // SHEET_COLUMNS)
+    cell_height = THUMB_HEIGHT + CAPTION_HEIGHT
+    sheet = np.zeros((rows * cell_height, SHEET_COLUMNS * THUMB_WIDTH, 3), np.uint8)
+
+    for i, (name, thumb_file) in enumerate(entries):
+        x = (i % SHEET_COLUMNS) * THUMB_WIDTH
+        y = (i // SHEET_COLUMNS) * cell_height
+
+        thumb = cv2.imread(thumb_file)
+        if thumb is not None:
+            sheet[y:y + THUMB_HEIGHT, x:x + THUMB_WIDTH] = cv2.resize(thumb, (THUMB_WIDTH, THUMB_HEIGHT))
+        cv2.putText(sheet, name, (x + 4, y + THUMB_HEIGHT + CAPTION_HEIGHT - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1, cv2.LINE_AA)
+
+    cv2.imwrite(filename, sheet)
+
+def write_index(entries, filename):
+    """
+    Writes an HTML page with the thumbnails of all pairs, linking to their proxies.
+
+    :param entries: List of (name, duration, proxy file, thumbnail file) tuples.
+    """
+
+    directory = os.path.dirname(filename)
+    cells = []
+    for name, duration, proxy_file, thumb_file in entries:
+        proxy = html.escape(os.path.relpath(proxy_file, directory).replace("\\", "/"))
+        thumb = html.escape(os.path.relpath(thumb_file, directory).replace("\\", "/"))
+        cells.append(
+            f'<figure><a href="{proxy}"><img src="{thumb}" width="{THUMB_WIDTH}" height="{THUMB_HEIGHT}" loading="lazy"></a>'
+            f'<figcaption>{html.escape(name)} ({format_duration(duration)})</figcaption></figure>'
+        )
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>dugotovr triage</title>"
+            "<style>body{background:#111;color:#eee;font-family:sans-serif}figure{display:inline-block;margin:8px}</style></head>\n"
+            f"<body><h1>{len(entries)} pair(s)</h1>\n" + "\n".join(cells) + "\n</body></html>\n"
+        )
+
+def triage(jobs, egress, dewarp, num_jobs):
+    """
+    Renders proxies and thumbnails of all pairs in parallel, and a contact sheet and HTML index of all of them.
+
+    :return: List of jobs that failed.
+    """
+
+    output_dir = os.path.join(egress, "triage")
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Triaging {len(jobs)} pair(s) with {num_jobs} concurrent job(s) into {output_dir}")
+
+    results = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        futures = {executor.submit(triage_pair, job, output_dir, dewarp): job for job in jobs}
+        for i, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            result = future.result()
+            if result is None:
+                failed.append(job)
+            else:
+                results[job["output_file"]] = result
+            print(f"[{i}/{len(jobs)}] {'done' if result else 'FAILED'}: {job['video1']} and {job['video2']}")
+
+    # in the (chronological) order of the pairs
+    entries = [
+        (os.path.splitext(os.path.basename(job["output_file"]))[0], job["duration"], *results[job["output_file"]])
+        for job in jobs if job["output_file"] in results
+    ]
+
+    if entries:
+        contact_sheet([(name, thumb_file) for name, _, _, thumb_file in entries], os.path.join(output_dir, "contact_sheet.jpg"))
+        write_index(entries, os.path.join(output_dir, "index.html"))
+        print(f"Wrote {os.path.join(output_dir, 'index.html')} and {os.path.join(output_dir, 'contact_sheet.jpg')}")
+
+    return failed
@@ -1,9 +1,82 @@
 import sys
-from timecode import Timecode
+import os
+import re
+import base64
+import heapq
+import sqlite3
+import json
+import hashlib
+import importlib
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from datetime import timedelta
-import ffmpeg
-import numpy as np
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported when one of its attributes is first used. The import is done by
+    importlib.import_module under a lock, so the threads of a pool can trigger it at the same time.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        # only called for the attributes of the module, the ones of the proxy are found directly
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+def lazy_import(name):
+    """
+    Returns a module that is only imported when one of its attributes is first used, so that --help and the commands
+    that don't need the heavy dependencies (numpy, cv2, ...) start right away.
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    return LazyModule(name)
+
+timecode = lazy_import("timecode")
+ffmpeg = lazy_import("ffmpeg")
+np = lazy_import("numpy")
+
+# name of the metadata index that is kept in the ingress directory
+INDEX_FILENAME = ".dugotovr_index.sqlite"
+
+# number of ffprobe processes to run concurrently for uncached files
+PROBE_WORKERS = 8
+
+# minimum overlap of a left/right pair, relative to the shorter take
+MIN_OVERLAP = 0.5
+
+# prefix of the fingerprint in the comment tag of the outputs
+FINGERPRINT_PREFIX = "dugotovr:"
+
+# videos in the ingress, in a directory per eye (GoPro writes upper case extensions)
+VIDEO_PATTERN = "*/*.[mM][pP]4"
+
+# GoPro file names: encoding (GX/GH/...), chapter and file number, i.e. GX010004.MP4, GX020004.MP4
+CHAPTER_PATTERN = re.compile(r"^(G[A-Z])(\d{2})(\d{4})\.mp4$", re.IGNORECASE)
+
+class PipelineError(Exception):
+    """
+    Raised for inputs the pipeline can't work with: missing directories, videos that can't be probed, conflicting
+    options. The command line entry points print it and exit, the Python API (see pipeline.py) passes it on.
+    """
 
 def get_metadata(filename):
     """
@@ -11,48 +84,245 @@ def get_metadata(filename):
 
     :param filename: Path to the video file.
     :return: Tuple containing timecode string, duration in seconds, and frame rate.
+    :raises PipelineError: If the file can't be probed or lacks one of them.
     """
 
     try:
         probe = ffmpeg.probe(filename)
     except ffmpeg.Error as e:
-        print(f"Error occurred while probing {filename}: {e.stderr}")
-        sys.exit(1)
+        raise PipelineError(f"Error occurred while probing {filename}: {e.stderr}")
 
     video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
 
     if video_stream is None:
-        print(f"No video stream found in {filename}.")
-        sys.exit(1) # return none?
-    
+        raise PipelineError(f"No video stream found in {filename}.")
+
     creation_time = video_stream.get("tags", {}).get("creation_time", None)
     if creation_time is None:
-        print(f"No creation time found for {filename}.")
-        sys.exit(1)
+        raise PipelineError(f"No creation time found for {filename}.")
 
     time_code = video_stream.get("tags", {}).get("timecode", None)
     if time_code is None:
-        print(f"No timecode found for {filename}.")
-        sys.exit(1)
+        raise PipelineError(f"No timecode found for {filename}.")
 
-    duration = float(video_stream.get("duration", None))
+    duration = video_stream.get("duration", None)
     if duration is None:
-        print(f"No duration found for {filename}.")
-        sys.exit(1)
+        raise PipelineError(f"No duration found for {filename}.")
+    duration = float(duration)
 
     frame_rate = video_stream.get("r_frame_rate", None)
     if frame_rate is None:
-        print(f"No frame rate found for {filename}.")
-        sys.exit(1)
-
+        raise PipelineError(f"No frame rate found for {filename}.")
 
     return creation_time, time_code, duration, frame_rate
 
-def match_videos(videos, ingress_path):
+def open_index(index_path):
+    """
+    Opens (or creates) the on-disk metadata index.
+
+    :param index_path: Path to the SQLite database.
+    :return: sqlite3 connection.
+    """
+
+    connection = sqlite3.connect(index_path, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS metadata ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+        "creation_time TEXT, timecode TEXT, duration REAL, frame_rate TEXT)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS packets ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+        "duration REAL, pts BLOB, keyframes BLOB)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS recordings ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+        "start REAL, duration REAL)"
+    )
+    return connection
+
+def file_key(filename):
+    """
+    Returns the key used to detect changed files: absolute path, size and modification time.
+    """
+
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+def get_metadata_cached(videos, index_path, refresh=False):
+    """
+    Retrieves the metadata of all videos, using the on-disk index where possible.
+    Files that are not in the index (or changed since they were indexed) are probed in parallel.
+
+    :param videos: List of paths to video files.
+    :param index_path: Path to the SQLite index, None disables the index.
+    :param refresh: Ignore (and overwrite) the cached entries.
+    :return: Dictionary of video path -> (creation_time, timecode, duration, frame_rate).
+    """
+
+    metadata = {}
+    keys = {video: file_key(video) for video in videos}
+
+    connection = None
+    if index_path is not None:
+        try:
+            connection = open_index(index_path)
+        except sqlite3.Error as e:
+            print(f"Could not open the metadata index {index_path}: {e}. Continuing without it.")
+
+    if connection is not None and not refresh:
+        for video, (path, size, mtime) in keys.items():
+            row = connection.execute(
+                "SELECT creation_time, timecode, duration, frame_rate FROM metadata WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime)
+            ).fetchone()
+            if row is not None:
+                metadata[video] = tuple(row)
+
+    missing = [video for video in videos if video not in metadata]
+    if missing:
+        print(f"Probing {len(missing)} video(s) not in the metadata index...")
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            for video, result in zip(missing, executor.map(get_metadata, missing)):
+                metadata[video] = result
+
+        if connection is not None:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [keys[video] + metadata[video] for video in missing]
+                )
+
+    if connection is not None:
+        connection.close()
+
+    return metadata
+
+def get_packet_index(filename):
+    """
+    Retrieves the timestamps of all frames and which of them are keyframes, from the packet headers of the video
+    stream (nothing is decoded). The timestamps are relative to the start of the file, like the -ss of ffmpeg.
+
+    :param filename: Path to the video file.
+    :return: Tuple of the frame timestamps (float64 array, in presentation order), the keyframe indices (int64 array)
+             and the duration of the file, or None if it could not be probed.
+    """
+
+    try:
+        probe = ffmpeg.probe(filename, select_streams="v:0", show_entries="packet=pts_time,flags:format=start_time,duration")
+    except ffmpeg.Error as e:
+        print(f"Error occurred while probing the packets of {filename}: {e.stderr}")
+        return None
+
+    packets = [packet for packet in probe.get("packets", []) if "pts_time" in packet]
+    pts = np.array([float(packet["pts_time"]) for packet in packets], dtype=np.float64)
+    keyframe = np.array(["K" in packet.get("flags", "") for packet in packets], dtype=bool)
+
+    # packets are in decoding order, frames are numbered in presentation order
+    order = np.argsort(pts, kind="stable")
+    pts = pts[order] - float(probe.get("format", {}).get("start_time", 0.0))
+    keyframes = np.flatnonzero(keyframe[order]).astype(np.int64)
+
+    return pts, keyframes, float(probe.get("format", {}).get("duration", 0.0))
+
+def get_packet_indexes(videos, index_path):
+    """
+    Retrieves the packet index of all videos, using the on-disk index where possible (see get_packet_index).
+    Reading the packet headers of a long take takes a while, so files that are not in the index are probed in parallel.
+
+    :param videos: List of paths to video files.
+    :param index_path: Path to the SQLite index, None disables the index.
+    :return: Dictionary of video path -> (pts, keyframes, duration), without the videos that could not be probed.
+    """
+
+    indexes = {}
+    keys = {video: file_key(video) for video in videos}
+
+    connection = None
+    if index_path is not None:
+        try:
+            connection = open_index(index_path)
+        except sqlite3.Error as e:
+            print(f"Could not open the metadata index {index_path}: {e}. Continuing without it.")
+
+    if connection is not None:
+        for video, (path, size, mtime) in keys.items():
+            row = connection.execute(
+                "SELECT duration, pts, keyframes FROM packets WHERE path = ? AND size = ? AND mtime = ?",
+                (path, size, mtime)
+            ).fetchone()
+            if row is not None:
+                indexes[video] = (np.frombuffer(row[1], dtype=np.float64), np.frombuffer(row[2], dtype=np.int64), row[0])
+
+    missing = [video for video in videos if video not in indexes]
+    if missing:
+        print(f"Indexing the packets of {len(missing)} video(s)...")
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            for video, result in zip(missing, executor.map(get_packet_index, missing)):
+                if result is not None:
+                    indexes[video] = result
+
+        if connection is not None:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO packets VALUES (?, ?, ?, ?, ?, ?)",
+                    [keys[video] + (indexes[video][2], indexes[video][0].tobytes(), indexes[video][1].tobytes()) for video in missing if video in indexes]
+                )
+
+    if connection is not None:
+        connection.close()
+
+    return indexes
+
+def take_index(indexes, chapters):
+    """
+    Joins the packet indexes of the chapters of a take, as the concat demuxer plays them: every chapter starts
+    where the previous one ended.
+
+    :param indexes: Dictionary of video path -> (pts, keyframes, duration), see get_packet_indexes().
+    :return: Tuple of the frame timestamps and keyframe indices of the take, or None if a chapter is not indexed.
+    """
+
+    if any(chapter not in indexes for chapter in chapters):
+        return None
+
+    pts = []
+    keyframes = []
+    offset = 0.0
+    frames = 0
+    for chapter in chapters:
+        chapter_pts, chapter_keyframes, duration = indexes[chapter]
+        pts.append(chapter_pts + offset)
+        keyframes.append(chapter_keyframes + frames)
+        offset += duration
+        frames += len(chapter_pts)
+
+    return np.concatenate(pts), np.concatenate(keyframes)
+
+def frame_seek_time(pts, frame):
+    """
+    Returns the -ss that starts a video on exactly the given frame: half way between its timestamp and the one of the
+    previous frame. ffmpeg seeks to the preceding keyframe and drops the decoded frames in front of it, so the number of
+    dropped frames doesn't depend on rounding or on the frame rate being constant.
+
+    :param pts: Frame timestamps, see take_index().
+    :param frame: Frame number (0 is the first frame).
+    """
+
+    if frame <= 0 or len(pts) == 0:
+        return 0.0
+    if frame >= len(pts):
+        return float(pts[-1])
+
+    return float(pts[frame - 1] + pts[frame]) / 2
+
+def match_videos(videos, ingress_path, refresh_index=False):
     """
     Matches videos into left/right pairs based on creation time.
 
     :param videos: Dictionary containing videos.
+    :param refresh_index: Re-probe all videos instead of using the metadata index.
     :return: List of left/right video pairs.
     """
 
@@ -61,9 +331,11 @@ def match_videos(videos, ingress_path):
 
     print(f"Found {len(videos)} video(s) in {ingress_path}:")
 
+    metadata = get_metadata_cached(videos, os.path.join(ingress_path, INDEX_FILENAME), refresh_index)
+
     for video in videos:
-        creation_time, start_tc, duration, frame_rate = get_metadata(video)
-        start_timecode = Timecode(frame_rate, start_tc)
+        creation_time, start_tc, duration, frame_rate = metadata[video]
+        start_timecode = timecode.Timecode(frame_rate, start_tc)
 
         # Extract video name from path after ingress
         video_name = video.replace(ingress_path, "")
@@ -84,53 +356,234 @@ def match_videos(videos, ingress_path):
         video_data[video] = {
             "creation_time": datetime.fromisoformat(creation_time),
             "start_timecode": start_timecode,
+            "duration": duration,
             "frame_rate": frame_rate,
             "side": side
         }
 
-    # Sort videos by creation time
-    sorted_videos = sorted(video_data.items(), key=lambda x: x[1]["creation_time"])
+    takes = group_chapters(video_data)
+
+    left = [take for take in takes if take[1]["side"] == "left"]
+    right = [take for take in takes if take[1]["side"] == "right"]
+
     video_pairs = []
+    matched = set()
 
-    # calculate the time difference between each video, skip videos that are too far apart
-    # otherwise, match videos into pairs
-    for i in range(1, len(sorted_videos)):
-        video1 = sorted_videos[i - 1]
-        video2 = sorted_videos[i]
-        time_diff = video2[1]["creation_time"] - video1[1]["creation_time"]
-        if time_diff > timedelta(seconds=5): # Skip videos that are more than 5 seconds apart
+    # assign the candidates with the largest overlap first, every take can only be used once
+    for overlap, video1, video2 in sorted(find_overlaps(left, right), key=lambda x: x[0], reverse=True):
+        if video1[0] in matched or video2[0] in matched:
+            continue
+
+        shortest = min(video1[1]["duration"], video2[1]["duration"])
+        if overlap < MIN_OVERLAP * shortest: # Skip takes that only overlap by a small part
             print(
-                f"Skipping {video1[0]} and {video2[0]} pair due to large time difference: {time_diff}"
+                f"Skipping {video1[0]} and {video2[0]} pair due to small overlap: {overlap:.3f} of {shortest:.3f} seconds"
             )
-        elif video1[1]["frame_rate"] != video2[1]["frame_rate"]: # Skip videos with different frame rates
+            continue
+
+        if video1[1]["frame_rate"] != video2[1]["frame_rate"]: # Skip videos with different frame rates
             print(
                 f"Skipping {video1[0]} and {video2[0]} pair due to different frame rates: {video1[1]['frame_rate']} vs {video2[1]['frame_rate']}"
             )
-        else:
+            continue
 
-            # Check that the videos are left and right sides
-            if video1[1]["side"] == video2[1]["side"]:
-                print(f"Skipping {video1[0]} and {video2[0]} pair as they are both {video1[1]['side']} sides.")
-                continue
+        matched.add(video1[0])
+        matched.add(video2[0])
+        video_pairs.append((video1, video2))
 
-            # make sure that the first video is left and the second video is right, otherwise swap them
-            if video1[1]["side"] == "right":
-                video1, video2 = video2, video1
+    for video, data in takes:
+        if video not in matched:
+            print(f"Skipping {video} as no matching {'right' if data['side'] == 'left' else 'left'} video was found.")
 
-            video_pairs.append((video1, video2))
+    # keep the pairs in chronological order
+    video_pairs.sort(key=lambda pair: pair[0][1]["start"])
 
     return video_pairs
 
+def group_chapters(video_data):
+    """
+    Groups GoPro chapter files (GX01xxxx, GX02xxxx, ...) of the same recording into a single take.
+    Videos that don't follow the GoPro naming scheme are a take of their own.
+
+    :param video_data: Dictionary of video path -> metadata, as built in match_videos.
+    :return: List of (video, data) tuples, where video is the first chapter of the take.
+    """
+
+    groups = {}
+    for video, data in video_data.items():
+        chapter = CHAPTER_PATTERN.match(os.path.basename(video))
+        if chapter is not None:
+            key = (os.path.dirname(video), chapter.group(1).upper(), chapter.group(3))
+            number = int(chapter.group(2))
+        else:
+            key = (video,)
+            number = 0
+        groups.setdefault(key, []).append((number, video, data))
+
+    takes = []
+    for chapters in groups.values():
+        chapters.sort(key=lambda x: x[0])
+        video, data = chapters[0][1], dict(chapters[0][2])
+
+        data["chapters"] = [chapter for _, chapter, _ in chapters]
+        data["duration"] = sum(chapter_data["duration"] for _, _, chapter_data in chapters)
+        data["start"] = take_start(data["creation_time"], data["start_timecode"])
+
+        if len(chapters) > 1:
+            print(f"Grouped {len(chapters)} chapters into one take: {', '.join(os.path.basename(chapter) for chapter in data['chapters'])}, Duration: {data['duration']:.6f} seconds")
+
+        takes.append((video, data))
+
+    return takes
+
+def take_start(creation_time, start_timecode):
+    """
+    Returns the start of a take in seconds since the epoch, based on the (time of day) timecode.
+    The date is taken from the creation time, as the timecode wraps around at midnight.
+    """
+
+    midnight = creation_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = midnight.timestamp() + start_timecode.to_realtime(True)
+
+    # the timecode and creation time can be on different sides of midnight
+    day = 24 * 60 * 60
+    if start - creation_time.timestamp() > day / 2:
+        start -= day
+    elif creation_time.timestamp() - start > day / 2:
+        start += day
+
+    return start
+
+def find_overlaps(left, right):
+    """
+    Finds all overlapping left/right takes with a sweep over the [start, start + duration] intervals.
+    Runs in O(n log n + k) for n takes and k overlapping pairs.
+
+    :return: List of (overlap in seconds, left take, right take) tuples.
+    """
+
+    events = sorted(
+        [(data["start"], 0, i) for i, (_, data) in enumerate(left)] +
+        [(data["start"], 1, i) for i, (_, data) in enumerate(right)]
+    )
 
-def color_anaglyph(left, right):
-    out = np.zeros_like(left, dtype=np.uint8)
-    l_r =  left[:,:,2]
+    takes = (left, right)
+    active = ([], []) # heaps of (end, index) of the takes that started, but haven't ended yet
+    overlaps = []
+
+    for start, side, i in events:
+        other = 1 - side
+
+        # drop the takes of the other side that ended before this one started
+        while active[other] and active[other][0][0] <= start:
+            heapq.heappop(active[other])
+
+        end = start + takes[side][i][1]["duration"]
+        for other_end, j in active[other]:
+            overlap = min(end, other_end) - start
+            if side == 0:
+                overlaps.append((overlap, takes[0][i], takes[1][j]))
+            else:
+                overlaps.append((overlap, takes[0][j], takes[1][i]))
+
+        heapq.heappush(active[side], (end, i))
+
+    return overlaps
+
+def job_fingerprint(chapters1, chapters2, calibration_files, options):
+    """
+    Returns a fingerprint of everything that determines the output of a pair: the size and modification time of
+    the inputs, the contents of the calibration files and the processing options.
+
+    :param calibration_files: Paths to the calibration files of the left and right take (missing files are allowed).
+    :param options: Dictionary of the options that change the output (dewarp, mask, preview, cuda, ...), and the
+                    recording of the external recorder (if any).
+    :return: Hex digest.
+    """
+
+    inputs = []
+    for chapter in chapters1 + chapters2:
+        stat = os.stat(chapter)
+        inputs.append([os.path.basename(chapter), stat.st_size, stat.st_mtime_ns])
+
+    calibrations = []
+    for calibration_file in calibration_files:
+        try:
+            with open(calibration_file, "rb") as f:
+                calibrations.append(hashlib.sha256(f.read()).hexdigest())
+        except FileNotFoundError:
+            calibrations.append(None)
+
+    options = dict(options)
+    for key in ("mask", "recording"):
+        if options.get(key) is not None:
+            stat = os.stat(options[key])
+            options[key] = [os.path.basename(options[key]), stat.st_size, stat.st_mtime_ns]
+
+    data = json.dumps({"inputs": inputs, "calibrations": calibrations, "options": options}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+def output_complete(output_file, fingerprint, duration=None):
+    """
+    Checks if an output was rendered completely with the given fingerprint.
+    A truncated file (i.e. of a killed ffmpeg) has no index and can't be probed.
+
+    :param duration: Expected length in seconds, with a tolerance of a second (None skips the check).
+    :return: True if the output can be kept.
+    """
+
+    if not os.path.exists(output_file):
+        return False
+
+    try:
+        probe = ffmpeg.probe(output_file)
+    except ffmpeg.Error:
+        return False
+
+    comment = probe.get("format", {}).get("tags", {}).get("comment", "")
+    if comment != f"{FINGERPRINT_PREFIX}{fingerprint}":
+        return False
+
+    if duration is not None and float(probe.get("format", {}).get("duration", 0.0)) < duration - 1.0:
+        return False
+
+    return True
+
+def input_args(video, chapters=None):
+    """
+    Returns the ffmpeg arguments to open a take. Takes with multiple chapters are opened with
+    the concat demuxer, using an inline (data URI) playlist, so no intermediate file is needed.
+
+    :param video: Path to the video file (first chapter).
+    :param chapters: List of chapter files, or None.
+    :return: List of ffmpeg arguments, ending with the input.
+    """
+
+    if chapters is None or len(chapters) <= 1:
+        return ["-i", video]
+
+    playlist = "ffconcat version 1.0\n"
+    for chapter in chapters:
+        path = os.path.abspath(chapter).replace("\\", "/").replace("'", "'\\''")
+        playlist += f"file 'file:{path}'\n" # explicit protocol, relative paths would be resolved against the data URI
+
+    payload = base64.b64encode(playlist.encode("utf-8")).decode("ascii")
+
+    return ["-f", "concat", "-safe", "0", "-protocol_whitelist", "file,data", "-i", f"data:text/plain;base64,{payload}"]
+
+
+def color_anaglyph(left, right, out=None):
+    """
+    Combines the red channel of the left and the green/blue channels of the right (BGR) image.
+
+    :param out: Optional preallocated output buffer.
+    """
 
-    r_g = right[:,:,1]
-    r_b = right[:,:,0]
+    if out is None:
+        out = np.empty_like(left, dtype=np.uint8)
 
-    out[:,:,2] = l_r
-    out[:,:,1] = r_g
-    out[:,:,0] = r_b
+    out[:,:,2] = left[:,:,2]
+    out[:,:,1] = right[:,:,1]
+    out[:,:,0] = right[:,:,0]
 
     return out
\ No newline at end of file
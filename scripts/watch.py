@@ -0,0 +1,191 @@
+import os
+import sys
+import glob
+import time
+import json
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+if __package__:
+    from .util import VIDEO_PATTERN
+    from .jobqueue import write_json
+else:
+    from util import VIDEO_PATTERN
+    from jobqueue import write_json
+
+# name of the state file of the watch mode that is kept in the egress directory
+STATE_FILENAME = ".dugotovr_watch.json"
+
+# seconds a file has to keep its size before it counts as copied (where inotify doesn't report it closed)
+SETTLE = 30.0
+
+# GoPro splits recordings into chapters of ~4 GB, a take that ends in a chapter this large may get another one
+CHAPTER_SIZE = 3_900_000_000
+
+# seconds without changes in the ingress after which a take that ends in a full chapter is processed anyway
+QUIET = 300.0
+
+# inotify events (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct("iIII")
+
+class Inotify:
+    """
+    Minimal inotify binding (Linux only), to learn about copied files right away instead of waiting for their size
+    to settle.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.add_watch_fn = libc.inotify_add_watch
+        self.add_watch_fn.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+
+    def add_watch(self, directory):
+        wd = self.add_watch_fn(self.fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        :return: List of (path, mask) tuples.
+        """
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                if wd in self.directories:
+                    events.append((os.path.join(self.directories[wd], os.fsdecode(name)), mask))
+
+        return events
+
+class FolderWatcher:
+    """
+    Keeps track of the videos in the ingress (i.e. ingress/left and ingress/right) and which of them are completely
+    copied: closed after writing (inotify) or unchanged for the settle time.
+    """
+
+    def __init__(self, ingress, settle=SETTLE):
+        self.ingress = ingress
+        self.settle = settle
+        self.files = {} # path -> (size, mtime, time of the last change)
+        self.closed = set()
+        self.last_change = time.monotonic()
+
+        self.inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                print(f"inotify is not available ({e}), checking the ingress every {settle:g}s instead.")
+
+    def scan(self):
+        """
+        Updates the state of all videos in the ingress.
+
+        :return: List of the videos that are completely copied.
+        """
+
+        if self.inotify is not None:
+            self.inotify.add_watch(self.ingress)
+            for directory in glob.glob(os.path.join(self.ingress, "*/")):
+                self.inotify.add_watch(os.path.normpath(directory))
+
+        now = time.monotonic()
+        videos = glob.glob(os.path.join(self.ingress, VIDEO_PATTERN))
+        for video in set(self.files) - set(videos):
+            del self.files[video]
+            self.closed.discard(video)
+
+        for video in videos:
+            try:
+                stat = os.stat(video)
+            except FileNotFoundError:
+                continue
+
+            previous = self.files.get(video)
+            if previous is None or previous[:2] != (stat.st_size, stat.st_mtime_ns):
+                self.files[video] = (stat.st_size, stat.st_mtime_ns, now)
+                self.last_change = now
+
+        return sorted(video for video, (_, _, changed) in self.files.items() if video in self.closed or now - changed >= self.settle)
+
+    def quiet(self):
+        """
+        Returns True if nothing changed in the ingress for a while, i.e. the card dump is done.
+        """
+
+        return time.monotonic() - self.last_change >= QUIET
+
+    def wait(self, timeout):
+        """
+        Waits for changes in the ingress, or timeout seconds.
+        """
+
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+
+        for path, mask in self.inotify.read(timeout):
+            if mask & IN_ISDIR:
+                continue
+            # written to again after it was closed, i.e. a copy that is resumed
+            if mask & IN_MODIFY:
+                self.closed.discard(path)
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.closed.add(path)
+
+class WatchState:
+    """
+    The jobs that the watch mode finished, by output file and fingerprint, kept across restarts.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, "r") as f:
+                self.done = json.load(f)
+        except FileNotFoundError:
+            self.done = {}
+        self.lock = threading.Lock()
+
+    def is_done(self, job):
+        return self.done.get(job["output_file"], {}).get("fingerprint") == job["fingerprint"]
+
+    def finish(self, job):
+        with self.lock:
+            self.done[job["output_file"]] = {"fingerprint": job["fingerprint"], "time": time.time()}
+            write_json(self.filename, self.done)
+
+def take_complete(chapters, quiet):
+    """
+    Checks if all chapters of a take landed: its last chapter is smaller than the chapters GoPro splits into, or the
+    ingress stopped changing.
+    """
+
+    return quiet or os.path.getsize(chapters[-1]) < CHAPTER_SIZE
@@ -0,0 +1,110 @@
+import re
+
+import pytest
+
+from graph import Scale, build_filter_complex
+
+ZERO = {
+    "offset1_x": 0, "offset1_y": 0, "offset2_x": 0, "offset2_y": 0,
+    "rotate_global1": 0, "rotate_global2": 0, "rotate_local1": 0, "rotate_local2": 0,
+}
+CALIBRATED = dict(ZERO, offset1_x=12, offset2_y=-8, rotate_global1=1.5, rotate_local2=-0.25)
+
+V360 = "v360=fisheye:hequirect:ih_fov=177:iv_fov=177:in_stereo=sbs:out_stereo=sbs"
+LEFT = "rotate=1.5*(PI/180):ow=4096:oh=4096,crop=4084:4096:0:0,pad=4096:4096:12:0"
+RIGHT = "rotate=-0.25*(PI/180):ow=4096:oh=4096,crop=4096:4088:0:8,pad=4096:4096:0:0"
+CPU_SCALE = "crop=4648:4648,scale=4096:4096"
+CUDA_SCALE = "scale_cuda=4096:4096:format=p010le,hwdownload,format=p010le"
+
+CHAIN = re.compile(r"^((?:\[[^\]]+\])*) (.*?)((?: \[[^\]]+\])?|(?: (?:\[[^\]]+\])+))$")
+
+def parse(filter_complex):
+    """
+    Splits a -filter_complex string into (inputs, nodes, outputs) per chain.
+    """
+
+    chains = []
+    for text in filter_complex.split("; "):
+        match = CHAIN.match(text)
+        assert match, text
+        inputs, nodes, outputs = match.groups()
+        chains.append((re.findall(r"\[([^\]]+)\]", inputs), nodes, re.findall(r"\[([^\]]+)\]", outputs)))
+    return chains
+
+def assert_connected(filter_complex, branches=None):
+    """
+    Asserts that every labelled output is consumed by another chain or is one of the branches (mapped by sync.py),
+    that every label is produced before it is consumed, and that there is a single unlabelled output without branches.
+    """
+
+    chains = parse(filter_complex)
+    produced = [label for _, _, outputs in chains for label in outputs]
+    consumed = [label for inputs, _, _ in chains for label in inputs]
+    mapped = [label for label, _ in branches or []]
+
+    for label in produced:
+        assert label in consumed or label in mapped, f"[{label}] is not connected: {filter_complex}"
+    for label in consumed:
+        assert re.fullmatch(r"\d+:v", label) or label in produced, f"[{label}] is never produced: {filter_complex}"
+    assert sorted(set(mapped) - set(consumed)) == sorted(mapped)
+
+    unlabelled = [chain for chain in chains if not chain[2]]
+    assert len(unlabelled) == (0 if branches else 1), filter_complex
+
+@pytest.mark.parametrize("calibration", [ZERO, CALIBRATED], ids=["zero", "calibrated"])
+@pytest.mark.parametrize("cuda", [False, True], ids=["cpu", "cuda"])
+@pytest.mark.parametrize("dewarp, mask, maps", [
+    (False, None, False),
+    (True, None, False),
+    (True, "mask.png", False),
+    (False, None, True),
+    (True, None, True),
+    (True, "mask.png", True),
+], ids=["stereo", "dewarp", "mask", "maps", "maps-dewarp", "maps-mask"])
+@pytest.mark.parametrize("branches", [None, [("out0", []), ("out1", [Scale(2048, 1024)])]], ids=["single", "branches"])
+def test_outputs_connected(calibration, cuda, dewarp, mask, maps, branches):
+    assert_connected(build_filter_complex(calibration, dewarp, mask, cuda, maps, branches=branches), branches)
+
+@pytest.mark.parametrize("calibration, cuda, dewarp, mask, maps, expected", [
+    (ZERO, False, False, None, False,
+     f"[0:v] {CPU_SCALE} [lc]; [1:v] {CPU_SCALE} [rc]; [lc][rc] hstack=inputs=2"),
+    (ZERO, False, True, None, False,
+     f"[0:v] {CPU_SCALE} [lc]; [1:v] {CPU_SCALE} [rc]; [lc][rc] hstack=inputs=2,{V360}"),
+    (CALIBRATED, False, True, None, False,
+     f"[0:v] {CPU_SCALE},{LEFT} [lc]; [1:v] {CPU_SCALE},{RIGHT} [rc]; [lc][rc] hstack=inputs=2,{V360}"),
+    (CALIBRATED, False, True, "mask.png", False,
+     f"[0:v] {CPU_SCALE},{LEFT} [lc]; [1:v] {CPU_SCALE},{RIGHT} [rc]; [lc][rc] hstack=inputs=2,{V360} [dewarp]; "
+     "[dewarp][2:v] overlay,format=yuv420p10"),
+    (ZERO, False, True, None, True,
+     "[0:v] crop=4648:4648 [ls]; [ls][2:v][3:v] remap [lc]; [1:v] crop=4648:4648 [rs]; [rs][4:v][5:v] remap [rc]; "
+     "[lc][rc] hstack=inputs=2,format=yuv420p10le"),
+    (CALIBRATED, False, True, "mask.png", True,
+     "[0:v] crop=4648:4648 [ls]; [ls][3:v][4:v] remap [lc]; [1:v] crop=4648:4648 [rs]; [rs][5:v][6:v] remap [rc]; "
+     "[lc][rc] hstack=inputs=2 [stack]; [stack][2:v] overlay,format=yuv420p10"),
+    (ZERO, True, True, None, False,
+     f"[0:v] {CUDA_SCALE},format=yuv420p10le [lc]; [1:v] {CUDA_SCALE},format=yuv420p10le [rc]; "
+     f"[lc][rc] hstack=inputs=2,{V360},hwupload_cuda"),
+    (CALIBRATED, True, True, "mask.png", False,
+     f"[0:v] {CUDA_SCALE},format=yuv420p10le,{LEFT} [lc]; [1:v] {CUDA_SCALE},format=yuv420p10le,{RIGHT} [rc]; "
+     f"[lc][rc] hstack=inputs=2,{V360} [dewarp]; [dewarp][2:v] overlay,format=yuv420p10,hwupload_cuda"),
+    (ZERO, True, True, None, True,
+     "[0:v] scale_cuda=format=p010le,hwdownload,format=p010le [ls]; [ls][2:v][3:v] remap [lc]; "
+     "[1:v] scale_cuda=format=p010le,hwdownload,format=p010le [rs]; [rs][4:v][5:v] remap [rc]; "
+     "[lc][rc] hstack=inputs=2,format=p010le,hwupload_cuda"),
+])
+def test_filter_complex(calibration, cuda, dewarp, mask, maps, expected):
+    assert build_filter_complex(calibration, dewarp, mask, cuda, maps) == expected
+
+def test_branches():
+    branches = [("out0", []), ("out1", [Scale(2048, 1024)])]
+    assert build_filter_complex(ZERO, True, None, False, branches=branches) == (
+        f"[0:v] {CPU_SCALE} [lc]; [1:v] {CPU_SCALE} [rc]; [lc][rc] hstack=inputs=2,{V360},split=2 [out0][out1s]; "
+        "[out1s] scale=2048:1024 [out1]"
+    )
+
+def test_drift():
+    calibration = dict(ZERO, drift2=2.5e-5)
+    assert build_filter_complex(calibration, True, None, False, frame_rate="30000/1001") == (
+        f"[0:v] {CPU_SCALE} [lc]; [1:v] setpts=PTS/1.000025000,fps=30000/1001,{CPU_SCALE} [rc]; "
+        f"[lc][rc] hstack=inputs=2,{V360}"
+    )
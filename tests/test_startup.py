@@ -0,0 +1,24 @@
+import sys
+
+import pytest
+
+if sys.version_info < (3, 12):
+    pytest.skip("the scripts need Python 3.12", allow_module_level=True)
+
+from benchmark import STARTUP_BUDGET, STARTUP_COMMANDS, run_startup
+
+# runs of every command, the median is checked against the budget
+REPEAT = 3
+
+@pytest.mark.parametrize("name", list(STARTUP_COMMANDS))
+def test_help(name):
+    result = run_startup(STARTUP_COMMANDS[name], REPEAT)
+    assert result["imported"] == [], f"{name} imported {', '.join(result['imported'])}"
+    assert result["wall_time"] <= STARTUP_BUDGET, f"{name} took {result['wall_time'] * 1000:.0f} ms"
+
+def test_plan_empty_ingress(tmp_path):
+    ingress, egress, queue = tmp_path / "ingress", tmp_path / "egress", tmp_path / "queue"
+    ingress.mkdir()
+    result = run_startup(["sync.py", "plan", str(ingress), str(egress), str(queue)], REPEAT)
+    assert result["imported"] == [], f"plan imported {', '.join(result['imported'])}"
+    assert result["wall_time"] <= STARTUP_BUDGET, f"plan took {result['wall_time'] * 1000:.0f} ms"